@@ -0,0 +1,6 @@
+"""
+    Замеры производительности пакета datasample
+
+Запуск из корня проекта: python -m benchmarks.<имя_модуля>
+Набор замеров с сохранением результатов и сравнением с базовыми - python -m benchmarks.run --help
+"""
@@ -0,0 +1,50 @@
+"""
+    Зависимость времени check_params/check_options от количества полей СВД
+
+"warm" - индексы возможностей уже построены в СВД (типичный повторный вызов);
+"cold" - индексы строятся заново на каждый вызов (как было до кэширования индексов в Sample).
+
+Запуск: python -m benchmarks.bench_check_options
+"""
+from timeit import Timer
+
+from datasample import Sample, check_params, check_options
+from .synthetic import make_sample_meta
+
+FIELD_COUNTS = (10, 100, 1000, 10000)
+
+
+OPTIONS = {
+    'fields': (('key_2', None), ('key_4', None), ('calc_1', 'sum'), ('calc_3', 'max')),
+    'filters': (('key_2', 'in', (1, 2, 3)), ('calc_1', '>', (0,))),
+    'group': ('key_2', 'key_4'),
+    'having': (('calc_1', '>', (100,)),),
+    'order': (('key_2', 'asc'), ('calc_1', 'desc')),
+}
+PARAMS = {'P_0': 2020}
+
+
+def measure(func, number: int) -> float:
+    """ Лучшее из трёх время одного вызова в микросекундах """
+    return min(Timer(func).repeat(repeat=3, number=number)) / number * 1e6
+
+
+def main():
+    print(f"{'fields':>8} {'warm, us':>12} {'cold, us':>12}")
+    for fields_count in FIELD_COUNTS:
+        sample = Sample(make_sample_meta(fields_count))
+        number = max(10, 100000 // fields_count)
+
+        def warm():
+            check_params(PARAMS, sample)
+            check_options(OPTIONS, sample)
+
+        def cold():
+            sample._indexes = None
+            warm()
+
+        print(f"{fields_count:>8} {measure(warm, number):>12.1f} {measure(cold, number):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
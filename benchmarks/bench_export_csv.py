@@ -0,0 +1,70 @@
+"""
+    Выгрузка в CSV: COPY TO STDOUT (datasample.export_csv) против fetchall + csv.writer
+
+Требуется доступная БД PostgreSQL, настройки подключения берутся из переменных окружения
+DATASAMPLE_BENCH_HOST, DATASAMPLE_BENCH_PORT, DATASAMPLE_BENCH_NAME, DATASAMPLE_BENCH_USER, DATASAMPLE_BENCH_PASSWORD.
+
+Запуск: python -m benchmarks.bench_export_csv
+"""
+import io
+import os
+import csv
+from time import perf_counter
+
+from datasample import Sample, execute, export_csv, close_all
+
+ROW_COUNTS = (10000, 100000, 1000000)
+
+DB_SETTINGS = {
+    'HOST': os.environ.get('DATASAMPLE_BENCH_HOST', '127.0.0.1'),
+    'PORT': os.environ.get('DATASAMPLE_BENCH_PORT', '5432'),
+    'NAME': os.environ.get('DATASAMPLE_BENCH_NAME', 'postgres'),
+    'USER': os.environ.get('DATASAMPLE_BENCH_USER', 'postgres'),
+    'PASSWORD': os.environ.get('DATASAMPLE_BENCH_PASSWORD', ''),
+}
+
+SAMPLE_META = {
+    'tables': {
+        'main': """select i as id, 'name ' || i as name, i * 1.5 as amount, i % 2 = 0 as even
+                   from generate_series(1, :ROWS) as i""",
+    },
+    'fields': {
+        'id': {'ctype': 'Integer', 'label': 'ID'},
+        'name': {'ctype': 'String', 'label': 'Наименование'},
+        'amount': {'ctype': 'Decimal', 'label': 'Сумма'},
+        'even': {'ctype': 'Boolean', 'label': 'Чётный'},
+    },
+    'params': {'ROWS': {'ctype': 'Integer'}},
+}
+OPTIONS = {'fields': [['id', None], ['name', None], ['amount', None], ['even', None]]}
+
+
+def fetchall_csv(sample, params, fileobj):
+    writer = csv.writer(fileobj)
+    writer.writerow([sample.fields[field_name]['label'] for field_name, _ in OPTIONS['fields']])
+    writer.writerows(execute(sample, params, OPTIONS, DB_SETTINGS))
+
+
+def measure(func) -> float:
+    """ Лучшее из трёх время выгрузки в секундах """
+    timings = []
+    for _ in range(3):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    sample = Sample(SAMPLE_META).compile()
+    print(f"{'rows':>10} {'COPY, s':>10} {'fetchall, s':>12} {'speedup':>8}")
+    for rows in ROW_COUNTS:
+        params = {'ROWS': rows}
+        copy = measure(lambda: export_csv(sample, params, OPTIONS, DB_SETTINGS, io.BytesIO()))
+        fetchall = measure(lambda: fetchall_csv(sample, params, io.StringIO()))
+        print(f"{rows:>10} {copy:>10.3f} {fetchall:>12.3f} {fetchall / copy:>8.1f}")
+    close_all()
+
+
+if __name__ == '__main__':
+    main()
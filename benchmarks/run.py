@@ -0,0 +1,148 @@
+"""
+    Замеры Sample.__setstate__, check_params, check_options, compose и pickle СВД
+    в зависимости от размера СВД, с сохранением результатов и сравнением с базовыми
+
+Размер СВД меняется по одному измерению (tables, fields, params, filters), остальные
+измерения равны BASE_SIZE. Для каждого замера сохраняется лучшее и медианное время одного вызова.
+
+Запуск:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --save-baseline                   # записать benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --threshold 1.25
+
+При сравнении с базовыми результатами код завершения 1, если какой-либо замер
+медленнее базового более чем в threshold раз (по лучшему времени).
+Базовые результаты зависят от машины и в репозиторий не входят: если файла --baseline нет,
+сравнение пропускается с сообщением (код завершения 0), базовые результаты записывает --save-baseline.
+"""
+import os
+import sys
+import json
+import pickle
+import argparse
+import platform
+from datetime import datetime
+from statistics import median
+from timeit import Timer
+
+from datasample import Sample, check_params, check_options, compose
+from .synthetic import make_sample_meta, make_params, make_options
+
+__all__ = (
+    'DIMENSIONS',
+    'OPERATIONS',
+    'run',
+    'compare',
+    'main',
+)
+
+DIMENSIONS = ('tables', 'fields', 'params', 'filters')
+OPERATIONS = ('setstate', 'check_params', 'check_options', 'compose', 'pickle')
+SIZES = (10, 100, 1000, 10000)
+BASE_SIZE = 10
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def make_case(dimension: str, size: int):
+    """ СВД, параметры и настройки, в которых измерение dimension равно size """
+    sizes = {name: size if name == dimension else BASE_SIZE for name in DIMENSIONS}
+    # В каждой таблице должно быть хотя бы одно поле
+    fields_count = max(sizes['fields'], sizes['tables'])
+    sample_meta = make_sample_meta(fields_count, sizes['tables'], sizes['params'])
+    return sample_meta, make_params(sizes['params']), make_options(fields_count, sizes['filters'])
+
+
+def operations(sample_meta: dict, params: dict, options: dict) -> dict:
+    """ Замеряемые вызовы без аргументов """
+    sample = Sample(sample_meta)
+    sample.indexes  # индексы строятся при первом обращении, замеряются повторные вызовы
+    compiled = sample.compile()
+    return {
+        'setstate': lambda: Sample().__setstate__(sample_meta),
+        'check_params': lambda: check_params(params, sample),
+        'check_options': lambda: check_options(options, sample),
+        'compose': lambda: compose(compiled, params, options),
+        'pickle': lambda: pickle.loads(pickle.dumps(sample)),
+    }
+
+
+def measure(func, min_time: float, repeat: int) -> dict:
+    """ Время одного вызова в секундах: лучшее и медиана из repeat серий по min_time секунд """
+    timer = Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    timings = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {'best': min(timings), 'median': median(timings), 'number': number}
+
+
+def run(dimensions=DIMENSIONS, sizes=SIZES, ops=OPERATIONS, min_time: float = 0.2, repeat: int = 5,
+        verbose: bool = True) -> dict:
+    """ Выполнить замеры, результат - {'meta': {...}, 'results': {'<измерение>/<размер>/<операция>': {...}}} """
+    results = dict()
+    for dimension in dimensions:
+        for size in sizes:
+            funcs = operations(*make_case(dimension, size))
+            for op in ops:
+                key = f'{dimension}/{size}/{op}'
+                results[key] = measure(funcs[op], min_time, repeat)
+                if verbose:
+                    print(f"{key:<32} {results[key]['best'] * 1e6:>14.1f} us", flush=True)
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'min_time': min_time,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 1.25) -> list:
+    """ Замеры, медленнее базовых более чем в threshold раз: [(ключ, базовое, текущее, отношение)] """
+    regressions = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        ratio = result['best'] / base['best']
+        if ratio > threshold:
+            regressions.append((key, base['best'], result['best'], ratio))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dimensions', nargs='+', choices=DIMENSIONS, default=DIMENSIONS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--min-time', type=float, default=0.2, help="длительность одной серии, с")
+    parser.add_argument('--repeat', type=int, default=5, help="количество серий")
+    parser.add_argument('--output', help="файл JSON для результатов")
+    parser.add_argument('--baseline', help="файл JSON базовых результатов для сравнения")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="допустимое замедление относительно базовых результатов")
+    parser.add_argument('--save-baseline', action='store_true', help=f"записать результаты в {BASELINE}")
+    args = parser.parse_args(argv)
+
+    current = run(args.dimensions, args.sizes, args.ops, args.min_time, args.repeat)
+    for path in filter(None, (args.output, BASELINE if args.save_baseline else None)):
+        with open(path, 'w') as fileobj:
+            json.dump(current, fileobj, indent=2)
+    if not args.baseline:
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"SKIPPED comparison: baseline {args.baseline} not found, create it with --save-baseline")
+        return 0
+    with open(args.baseline) as fileobj:
+        regressions = compare(current, json.load(fileobj), args.threshold)
+    for key, base, best, ratio in regressions:
+        print(f"REGRESSION {key}: {base * 1e6:.1f} us -> {best * 1e6:.1f} us (x{ratio:.2f})")
+    if not regressions:
+        print(f"No regressions over x{args.threshold} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+    Генератор синтетических СВД, параметров и настроек для замеров производительности
+
+Поля чередуются: чётные - ключевые (key_<N>), нечётные - вычисляемые (calc_<N>),
+поля распределяются по таблицам (main, t_1, t_2, ...) по кругу,
+каждая таблица использует один из параметров (P_<N>).
+"""
+
+__all__ = (
+    'make_sample_meta',
+    'make_params',
+    'make_options',
+)
+
+
+def make_sample_meta(fields_count: int, tables_count: int = 1, params_count: int = 1) -> dict:
+    """ Синтетическая СВД с fields_count полями разных видов в tables_count таблицах и params_count параметрами """
+    table_names = ['main', *(f't_{i}' for i in range(1, tables_count))]
+    fields = dict()
+    for i in range(fields_count):
+        table = table_names[i % tables_count]
+        if i % 2:
+            fields[f'calc_{i}'] = {
+                'ctype': 'Decimal',
+                'calc': ('sum', 'min', 'max', 'avg'),
+                'filtered': ('=', '!=', '<', '<=', '>', '>=', 'between'),
+                'having': ('<', '<=', '>', '>='),
+                'ordered': True,
+                'table': table,
+            }
+        else:
+            fields[f'key_{i}'] = {
+                'ctype': 'Integer',
+                'key': True,
+                'filtered': ('=', '!=', 'in', 'not in'),
+                'ordered': True,
+                'hidden': i % 10 == 0,
+                'table': table,
+            }
+    return {
+        'tables': {
+            name: f"select i as id from generate_series(1, :P_{number % params_count}) as i"
+            for number, name in enumerate(table_names)
+        },
+        'fields': fields,
+        'params': {f'P_{i}': {'ctype': 'Integer'} for i in range(params_count)},
+    }
+
+
+def make_params(params_count: int = 1) -> dict:
+    return {f'P_{i}': 100 + i for i in range(params_count)}
+
+
+def make_options(fields_count: int, filters_count: int = 2) -> dict:
+    """
+        Настройки с группировкой для СВД из make_sample_meta
+
+    В выборке - до 4 ключевых (видимых) и до 4 вычисляемых полей, фильтры по кругу
+    накладываются на все поля СВД, чтобы их количество не зависело от количества полей.
+    """
+    keys = [f'key_{i}' for i in range(2, fields_count, 2) if i % 10][:4]
+    calcs = [f'calc_{i}' for i in range(1, fields_count, 2)][:4]
+    filters = []
+    for i in range(filters_count):
+        number = i % fields_count
+        if number % 2:
+            filters.append((f'calc_{number}', '>', (i,)))
+        else:
+            filters.append((f'key_{number}', 'in', (i, i + 1, i + 2)))
+    options = {
+        'fields': (*((key, None) for key in keys), *((calc, 'sum') for calc in calcs)),
+        'group': tuple(keys),
+        'order': (*((key, 'asc') for key in keys[:1]), *((calc, 'desc') for calc in calcs[:1])),
+    }
+    if filters:
+        options['filters'] = tuple(filters)
+    if calcs:
+        options['having'] = ((calcs[0], '>', (100,)),)
+    return options
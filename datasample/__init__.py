@@ -13,6 +13,8 @@
 Для возможности отладки использутся фнукции
 * compose - компанует итоговый SQL-запрос
 * execute- компанует итоговый SQL-запрос и делает выборку данных
+* execute_iter - то же, что execute, но отдаёт строки по мере чтения из server-side курсора
+* explain - оценка стоимости запроса планировщиком PostgreSQL без выполнения
 
 Функция execute в дальнейшем может использоваться для реальной выборки данных
 на основе (пример в example/tests/example_schema.json):
@@ -20,6 +22,15 @@
 * переданных значений параметров (ключ "params")
 * настроек выборки (ключ "options")
 """
-from .elements import Sample, SampleElementError
+from .elements import Sample, CompiledSample, SampleElementError, compile_sample
 from .validators import check_params, check_options
-from .sqlalchemytools import compose, execute
+from .sqlalchemytools import compose, execute, execute_iter, next_cursor, explain
+from .engines import engines, close_all
+from .execution import (SampleExecutionError, SampleTimeoutError, SampleCancelledError, SampleBudgetError,
+                        SampleOverloadError, CancelHandle)
+from .guard import CostGuard
+from .scheduler import ExecutionScheduler
+from .export import export_csv
+from .arrow import write_arrow
+from .output import write_result
+from .instrumentation import PrometheusSink, set_sink, labels
@@ -0,0 +1,238 @@
+"""
+    Подбор индексов по рабочей нагрузке СВД (index advisor)
+
+Рабочая нагрузка - список запросов (params, options, weight), например, из журнала выполнений.
+По полям фильтров, группировки и сортировки строятся кандидаты в индексы:
+    - по одному полю для каждого фильтруемого поля, поля группировки и сортировки;
+    - составной: поля фильтров на равенство ('=', 'in'), затем первое поле фильтра
+      по диапазону или первое поле сортировки (не более max_columns полей).
+Поле СВД - колонка Field.expression подзапроса Sample.tables[Field.table], базовая таблица и колонка
+определяются самим PostgreSQL (источник колонки результата запроса, PQftable/PQftablecol).
+Поля, которые вычисляются выражением или берутся из представления, в кандидаты не попадают.
+
+Кандидаты, совпадающие с началом существующего индекса, не оцениваются.
+Выигрыш кандидата оценивается сравнением планов запросов нагрузки (EXPLAIN) без индекса и с ним:
+    hypopg      - гипотетический индекс расширения hypopg (индекс не строится);
+    transaction - индекс создаётся в транзакции, которая после оценки откатывается
+                  (индекс строится, таблица на это время блокируется от изменений);
+    auto        - hypopg; если расширение не установлено - SampleExecutionError, а не переход к transaction:
+                  построение индексов на рабочей БД выбирается только явно.
+"""
+from collections import OrderedDict, namedtuple
+from typing import Iterable, Sequence, Tuple, Union
+from sqlalchemy.sql import select, text
+
+from .cache import fingerprint
+from .elements import Sample, CompiledSample, SampleElementError, compile_sample
+from .engines import get_engine
+from .execution import SampleExecutionError
+from .sqlalchemytools import compose, compile_query, options_shape
+
+__all__ = (
+    'ADVISOR_METHODS',
+    'EQUALITY_OPERATIONS',
+    'RANGE_OPERATIONS',
+    'IndexAdvice',
+    'index_candidates',
+    'advise_indexes',
+)
+
+ADVISOR_METHODS = ('auto', 'hypopg', 'transaction')
+EQUALITY_OPERATIONS = ('=', 'in', 'is null')
+RANGE_OPERATIONS = ('<', '<=', '>', '>=', 'between')
+# Типы отношений, для которых можно создать индекс: таблица, секционированная таблица, материализованное представление
+INDEXABLE_RELKINDS = ('r', 'p', 'm')
+
+# Рекомендация: table - таблица, columns - колонки индекса, queries - вес запросов нагрузки, план которых
+# улучшает индекс, cost_before/cost_after - взвешенная стоимость всех запросов нагрузки без индекса и с ним,
+# gain - доля снижения стоимости, statement - команда создания индекса
+IndexAdvice = namedtuple('IndexAdvice', ('table', 'columns', 'queries', 'cost_before', 'cost_after', 'gain',
+                                         'statement'))
+
+
+def index_candidates(options: dict, origins: dict, max_columns: int = 3) -> list:
+    """
+        Кандидаты в индексы для одного запроса
+
+    :param options: настройки запроса
+    :param origins: словарь ИмяПоля:(таблица, колонка) для полей, взятых из колонок таблиц
+    :param max_columns: наибольшее количество колонок составного индекса
+    :return: список уникальных кандидатов (таблица, кортеж колонок)
+    """
+    filters = options.get('filters', [])
+    equality = [field for field, operation, *_ in filters if operation in EQUALITY_OPERATIONS]
+    ranges = [field for field, operation, *_ in filters if operation in RANGE_OPERATIONS]
+    order = [field for field, *_ in options.get('order', [])]
+    group = list(options.get('group', []))
+
+    candidates = OrderedDict()
+    for field in (*equality, *ranges, *group, *order):
+        if field in origins:
+            table, column = origins[field]
+            candidates[(table, (column,))] = None
+
+    by_table = OrderedDict()
+    for field in (*equality, *(ranges or order)[:1]):
+        if field in origins:
+            table, column = origins[field]
+            columns = by_table.setdefault(table, [])
+            if column not in columns:
+                columns.append(column)
+    for table, columns in by_table.items():
+        if len(columns) > 1:
+            candidates[(table, tuple(columns[:max_columns]))] = None
+    return list(candidates)
+
+
+def column_origins(cursor, sample: CompiledSample, params: dict, dialect) -> dict:
+    """
+        Базовые таблицы и колонки полей СВД: словарь ИмяПоля:(таблица, колонка)
+
+    Таблица - имя с учётом search_path, колонка - имя в кавычках, если они нужны.
+    """
+    fields = sample.field_names
+    query = select([text(sample.sql_identifiers[sample.field_index[name]]) for name in fields]) \
+        .select_from(sample.sql_tables(fields)).limit(0)
+    sql, binds = compile_query(query, params, dialect)
+    cursor.execute(sql, binds)
+    sources = {name: (column.table_oid, column.table_column)
+               for name, column in zip(fields, cursor.description) if column.table_oid}
+    origins = dict()
+    for name, (table_oid, table_column) in sources.items():
+        cursor.execute(
+            "select c.oid::regclass::text, quote_ident(a.attname) "
+            "from pg_class as c join pg_attribute as a on a.attrelid = c.oid "
+            "where c.oid = %s and a.attnum = %s and c.relkind in %s",
+            (table_oid, table_column, INDEXABLE_RELKINDS),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            origins[name] = tuple(row)
+    return origins
+
+
+def _plan_cost(cursor, sql: str, binds: dict) -> float:
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", binds)
+    return cursor.fetchone()[0][0]['Plan']['Total Cost']
+
+
+def _has_hypopg(cursor) -> bool:
+    cursor.execute("select 1 from pg_extension where extname = 'hypopg'")
+    return cursor.fetchone() is not None
+
+
+def _covered(cursor, table: str, columns: Sequence[str]) -> bool:
+    """ Есть ли у таблицы индекс, начинающийся с колонок columns """
+    cursor.execute(
+        "select array(select quote_ident(a.attname) "
+        "             from unnest(i.indkey) with ordinality as k(attnum, n) "
+        "                 join pg_attribute as a on a.attrelid = i.indrelid and a.attnum = k.attnum "
+        "             order by k.n) "
+        "from pg_index as i where i.indrelid = %s::regclass",
+        (table,),
+    )
+    return any(tuple(existing[:len(columns)]) == tuple(columns) for existing, in cursor.fetchall())
+
+
+def _index_name(table: str, columns: Sequence[str]) -> str:
+    name = '_'.join((table.split('.')[-1], *columns, 'idx')).replace('"', '')
+    return name[:63]
+
+
+def _costs_with_index(cursor, table: str, columns: Sequence[str], queries: list, method: str) -> list:
+    """ Стоимость запросов [(sql, binds), ...] при наличии индекса """
+    definition = f"{table} ({', '.join(columns)})"
+    if method == 'hypopg':
+        cursor.execute("select indexrelid from hypopg_create_index(%s)", (f"CREATE INDEX ON {definition}",))
+        try:
+            return [_plan_cost(cursor, sql, binds) for sql, binds in queries]
+        finally:
+            cursor.execute("select hypopg_reset()")
+    cursor.execute("SAVEPOINT advise_index")
+    try:
+        cursor.execute(f"CREATE INDEX ON {definition}")
+        return [_plan_cost(cursor, sql, binds) for sql, binds in queries]
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT advise_index")
+
+
+def advise_indexes(sample_meta: Union[dict, Sample, CompiledSample],
+                   workload: Iterable[Tuple[dict, dict, float]],
+                   db_settings: dict, method: str = 'auto', min_gain: float = 0.05,
+                   max_columns: int = 3) -> list:
+    """
+        Подобрать индексы для рабочей нагрузки СВД
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param workload: запросы нагрузки (params, options, weight), weight - количество или доля выполнений;
+                     запросы одной формы настроек (см. options_shape) оцениваются один раз с суммарным весом,
+                     запросы, не проходящие валидацию (например, для прежней revision СВД), пропускаются
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param method: способ оценки плана с индексом - один из ADVISOR_METHODS
+                   (auto и hypopg без расширения hypopg - SampleExecutionError)
+    :param min_gain: наименьшая доля снижения суммарной стоимости нагрузки для рекомендации индекса
+    :param max_columns: наибольшее количество колонок составного индекса
+    :return: список IndexAdvice по убыванию gain
+    """
+    if method not in ADVISOR_METHODS:
+        raise ValueError(f"'method' must be in {ADVISOR_METHODS}")
+    sample = compile_sample(sample_meta)
+    engine = get_engine(db_settings)
+
+    shapes = OrderedDict()
+    for params, options, weight in workload:
+        key = fingerprint(options_shape(options))
+        if key in shapes:
+            shapes[key][2] += weight
+            continue
+        try:
+            query, kwargs = compose(sample, params, options)
+        except SampleElementError:
+            continue
+        shapes[key] = [params, options, weight, compile_query(query, kwargs, engine.dialect)]
+    if not shapes:
+        return []
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            if method in ('auto', 'hypopg'):
+                if not _has_hypopg(cursor):
+                    raise SampleExecutionError(
+                        "Расширение hypopg не установлено: установите его (create extension hypopg) или явно "
+                        "выберите method='transaction' (индексы будут построены в откатываемой транзакции)")
+                method = 'hypopg'
+            origins = column_origins(cursor, sample, next(iter(shapes.values()))[0], engine.dialect)
+            queries = list(shapes.values())
+            costs = [_plan_cost(cursor, sql, binds) for *_, (sql, binds) in queries]
+            total = sum(weight * cost for (_, _, weight, _), cost in zip(queries, costs))
+
+            candidates = OrderedDict()  # кандидат: номера запросов, из настроек которых он получен
+            for number, (_, options, _, _) in enumerate(queries):
+                for candidate in index_candidates(options, origins, max_columns):
+                    candidates.setdefault(candidate, []).append(number)
+
+            advices = []
+            for (table, columns), numbers in candidates.items():
+                if _covered(cursor, table, columns):
+                    continue
+                after = _costs_with_index(cursor, table, columns, [queries[n][3] for n in numbers], method)
+                improved = {n: cost for n, cost in zip(numbers, after) if cost < costs[n]}
+                saving = sum(queries[n][2] * (costs[n] - cost) for n, cost in improved.items())
+                gain = saving / total if total else 0.0
+                if not improved or gain < min_gain:
+                    continue
+                advices.append(IndexAdvice(
+                    table=table,
+                    columns=columns,
+                    queries=sum(queries[n][2] for n in improved),
+                    cost_before=total,
+                    cost_after=total - saving,
+                    gain=gain,
+                    statement=f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {_index_name(table, columns)} "
+                              f"ON {table} ({', '.join(columns)});",
+                ))
+        conn.rollback()
+    finally:
+        conn.close()
+    return sorted(advices, key=lambda advice: advice.gain, reverse=True)
@@ -0,0 +1,164 @@
+"""
+    Результат выполнения СВД в формате Apache Arrow
+
+Record batches строятся по мере чтения порций строк из курсора, схема Arrow
+выводится из описания полей СВД (ctype, label). Результат записывается в формате
+Arrow IPC stream или в файл Feather (Arrow IPC file), который потребитель может
+открыть через memory map без копирования данных.
+
+pyarrow - необязательная зависимость пакета, нужна только для этого модуля.
+"""
+import io
+from typing import Union
+
+from .elements import Sample, CompiledSample, compile_sample
+from .instrumentation import current_labels, span
+from .sqlalchemytools import compose, fetch_batches
+from .columnar import DECIMAL_AS_FLOAT, column_ctypes
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+__all__ = (
+    'ARROW_FORMATS',
+    'arrow_schema',
+    'execute_arrow',
+    'iter_arrow_stream',
+    'write_arrow',
+)
+
+ARROW_FORMATS = ('stream', 'feather')
+
+
+def _arrow_type(ctype: str):
+    return {
+        'Integer': pyarrow.int64(),
+        'Decimal': pyarrow.float64(),
+        'Boolean': pyarrow.bool_(),
+        'String': pyarrow.string(),
+        'Date': pyarrow.date32(),
+    }[ctype]
+
+
+def _check_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Arrow output requires pyarrow.")
+
+
+def arrow_schema(sample: CompiledSample, options: dict):
+    """ Схема Arrow для колонок результата: тип по ctype, метка поля - в метаданных колонки """
+    _check_pyarrow()
+    return pyarrow.schema([
+        pyarrow.field(field_name, _arrow_type(ctype), metadata={
+            'label': sample.fields[field_name]['label'] or field_name,
+            'ctype': ctype,
+        })
+        for (field_name, _), ctype in zip(options['fields'], column_ctypes(sample, options))
+    ])
+
+
+def _prepare(sample_meta, params: dict, options: dict):
+    _check_pyarrow()
+    sample = compile_sample(sample_meta)
+    query, kwargs = compose(sample, params, options)
+    return arrow_schema(sample, options), query, kwargs
+
+
+def _record_batches(schema, query, kwargs: dict, db_settings: dict, batch_size: int, timeout: float, cancel):
+    # fetch_batches вызывается сразу, чтобы замеры получили метки вызывающего кода.
+    # NUMERIC читается в float, а целые значения (sum по bigint) - в int, поэтому колонки int64 точны
+    return (
+        pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(values, type=field.type) for field, values in zip(schema, zip(*rows))],
+            schema=schema,
+        )
+        for rows in fetch_batches(query, kwargs, db_settings, batch_size, (DECIMAL_AS_FLOAT,), timeout, cancel)
+    )
+
+
+def execute_arrow(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                  db_settings: dict, batch_size: int = 10000, timeout: float = None, cancel=None):
+    """
+        Выполнить запрос согласно параметризации и вернуть результат как pyarrow.Table
+
+    Параметры - как у datasample.execute, batch_size - количество строк в одном record batch.
+    """
+    schema, query, kwargs = _prepare(sample_meta, params, options)
+    return pyarrow.Table.from_batches(
+        _record_batches(schema, query, kwargs, db_settings, batch_size, timeout, cancel), schema
+    )
+
+
+def write_arrow(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                db_settings: dict, sink, format: str = 'stream', batch_size: int = 10000,
+                timeout: float = None, cancel=None, progress=None) -> int:
+    """
+        Записать результат выполнения СВД в формате Arrow
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param sink: путь к файлу или бинарный файлоподобный объект
+    :param format: 'stream' - Arrow IPC stream, 'feather' - файл Feather (Arrow IPC file)
+    :param batch_size: количество строк в одном record batch
+    :param timeout: ограничение времени выполнения каждого обращения к БД в секундах
+    :param cancel: объект datasample.CancelHandle для отмены запроса
+    :param progress: функция, вызываемая с количеством записанных строк после каждого record batch
+    :return: количество записанных строк
+    """
+    if format not in ARROW_FORMATS:
+        raise ValueError(f"'format' must be in {ARROW_FORMATS}")
+    schema, query, kwargs = _prepare(sample_meta, params, options)
+    new_writer = pyarrow.ipc.new_stream if format == 'stream' else pyarrow.ipc.new_file
+    rows = 0
+    serialize_span = span('serialize')
+    with new_writer(sink, schema) as writer:
+        for batch in _record_batches(schema, query, kwargs, db_settings, batch_size, timeout, cancel):
+            with serialize_span.measure():
+                writer.write_batch(batch)
+            serialize_span.add(rows=batch.num_rows, bytes=batch.nbytes)
+            rows += batch.num_rows
+            if progress is not None:
+                progress(rows)
+    serialize_span.finish()
+    return rows
+
+
+def iter_arrow_stream(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                      db_settings: dict, batch_size: int = 10000, timeout: float = None, cancel=None):
+    """
+        Выполнить СВД и отдавать результат фрагментами байт в формате Arrow IPC stream
+
+    Запрос компонуется (и проверяется) сразу, выборка начинается при первом обращении к генератору.
+    Каждый record batch отдаётся отдельным фрагментом, например, для StreamingHttpResponse.
+    """
+    schema, query, kwargs = _prepare(sample_meta, params, options)
+    return _stream_chunks(schema, _record_batches(schema, query, kwargs, db_settings, batch_size, timeout, cancel),
+                          current_labels())
+
+
+def _stream_chunks(schema, batches, labels: dict):
+    buffer = io.BytesIO()
+
+    def take():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    serialize_span = span('serialize', labels)
+    writer = pyarrow.ipc.new_stream(buffer, schema)
+    for batch in batches:
+        with serialize_span.measure():
+            writer.write_batch(batch)
+            chunk = take()
+        serialize_span.add(rows=batch.num_rows, bytes=len(chunk))
+        yield chunk
+    writer.close()
+    chunk = take()
+    serialize_span.add(bytes=len(chunk))
+    serialize_span.finish()
+    yield chunk
@@ -0,0 +1,136 @@
+"""
+    Кэш результатов выполнения запросов по СВД
+
+Ключ кэша - канонический отпечаток (имя СВД, revision, значения параметров, настройки, целевая БД),
+поэтому изменение описания СВД (новый revision) никогда не приводит к выдаче устаревших данных.
+"""
+import json
+import pickle
+import hashlib
+from time import monotonic
+from threading import Lock
+from collections import OrderedDict
+
+from .engines import normalize_db_settings
+from .sqlalchemytools import execute
+
+__all__ = (
+    'fingerprint',
+    'result_key',
+    'ResultCache',
+)
+
+
+def fingerprint(value) -> str:
+    """ Канонический отпечаток JSON-совместимого значения (порядок ключей словарей не важен) """
+    dump = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+def result_key(name: str, revision, params: dict, options: dict, db_settings: dict) -> str:
+    """ Ключ кэша результата выполнения СВД """
+    # Пароль в отпечаток не попадает: результат определяется БД, а не способом аутентификации
+    user, _, host, port, db_name, _ = normalize_db_settings(db_settings)
+    return fingerprint([name, revision, params, options, [user, host, port, db_name]])
+
+
+class ResultCache:
+    """
+        Потокобезопасный кэш результатов в памяти процесса
+
+    Вытеснение - LRU по суммарному размеру результатов (размер оценивается по pickle),
+    время жизни записи задаётся для всех СВД (ttl) или для конкретной СВД (sample_ttl[<имя СВД>]).
+    Результаты хранятся как кортеж кортежей, а выдаются копией списка,
+    поэтому изменение выданного результата не затрагивает кэш.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300, sample_ttl: dict = None, clock=monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sample_ttl = dict(sample_ttl or {})
+        self.clock = clock
+        self._lock = Lock()
+        self._entries = OrderedDict()  # ключ: (имя СВД, строки, размер, истекает)
+        self._names = dict()  # имя СВД: множество ключей её записей
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def get(self, key: str):
+        """ Получить результат по ключу или None, если его нет в кэше или истёк срок жизни """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def set(self, key: str, name: str, rows) -> list:
+        """ Сохранить результат выполнения СВД name. Возвращает сохранённое представление результата """
+        rows = tuple(tuple(row) for row in rows)
+        size = len(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        ttl = self.sample_ttl.get(name, self.ttl)
+        if size > self.max_bytes or ttl <= 0:
+            return list(rows)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (name, rows, size, self.clock() + ttl)
+            self._names.setdefault(name, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return list(rows)
+
+    def invalidate(self, name: str) -> None:
+        """ Удалить все результаты СВД name (например, после изменения её описания) """
+        with self._lock:
+            for key in list(self._names.get(name, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._names.clear()
+            self.bytes = 0
+
+    def _remove(self, key: str) -> None:
+        name, _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+        keys = self._names[name]
+        keys.discard(key)
+        if not keys:
+            del self._names[name]
+
+    def execute(self, name: str, revision, sample_meta, params: dict, options: dict, db_settings: dict,
+                **execute_options) -> list:
+        """
+            Выполнить СВД через кэш (см. datasample.execute)
+
+        :param name: имя СВД
+        :param revision: номер изменения описания СВД (любое JSON-совместимое значение)
+        :param execute_options: параметры выполнения запроса (timeout, cancel)
+        :return: список кортежей
+        """
+        key = result_key(name, revision, params, options, db_settings)
+        rows = self.get(key)
+        if rows is None:
+            rows = self.set(key, name, execute(sample_meta, params, options, db_settings, **execute_options))
+        return rows
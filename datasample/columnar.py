@@ -0,0 +1,137 @@
+"""
+    Колоночный результат выполнения СВД в массивах NumPy
+
+numpy - необязательная зависимость пакета, нужна только для result_format='columnar'.
+"""
+from typing import Union
+from psycopg2.extensions import DECIMAL, new_type
+
+from .elements import Sample, CompiledSample, compile_sample
+from .sqlalchemytools import compose, fetch_batches
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__all__ = (
+    'CTYPE_DTYPES',
+    'column_ctypes',
+    'execute_columnar',
+)
+
+# Типы массивов NumPy для типов полей СВД. String - массив объектов или строк фиксированной длины (string_width)
+CTYPE_DTYPES = {
+    'Integer': 'int64',
+    'Decimal': 'float64',
+    'Boolean': 'bool',
+    'String': 'object',
+    'Date': 'datetime64[D]',
+}
+# Функции агрегации, результат которых имеет тип, отличный от типа поля
+AGGREGATE_CTYPES = {
+    'avg': 'Decimal',
+}
+
+
+
+def _cast_numeric(value: str, cursor):
+    if value is None:
+        return None
+    # Целые значения (например, sum по bigint) - без потери точности через float
+    return int(value) if value.lstrip('-').isdigit() else float(value)
+
+
+# NUMERIC читается сразу в float (целые - в int), минуя создание объектов Decimal
+# (только для курсора колоночной выборки)
+DECIMAL_AS_FLOAT = new_type(DECIMAL.values, 'DATASAMPLE_DECIMAL_AS_FLOAT', _cast_numeric)
+
+
+def column_ctypes(sample: CompiledSample, options: dict) -> list:
+    """ Типы полей СВД для колонок результата с учётом функций агрегации """
+    return [
+        AGGREGATE_CTYPES.get(operation, sample.fields[field_name]['ctype'])
+        for field_name, operation in options['fields']
+    ]
+
+
+class ColumnBuilder:
+    """ Накопление значений одной колонки порциями с последующей склейкой в один массив """
+
+    def __init__(self, ctype: str, decimal: str, string_width: int = None):
+        self.ctype = ctype
+        if ctype == 'Decimal' and decimal == 'exact':
+            self.dtype = 'object'
+        elif ctype == 'String' and string_width:
+            self.dtype = f'U{string_width}'
+        else:
+            self.dtype = CTYPE_DTYPES[ctype]
+        self.masked = self.dtype in ('int64', 'bool')
+        self.chunks = []
+        self.masks = []
+
+    def append(self, values: tuple):
+        count = len(values)
+        if self.masked:
+            mask = numpy.fromiter((value is None for value in values), dtype='bool', count=count)
+            if mask.any():
+                values = [value if value is not None else 0 for value in values]
+            self.chunks.append(numpy.fromiter(values, dtype=self.dtype, count=count))
+            self.masks.append(mask)
+        elif self.dtype in ('float64', 'datetime64[D]'):
+            missing = numpy.nan if self.dtype == 'float64' else numpy.datetime64('NaT')
+            self.chunks.append(numpy.fromiter(
+                (value if value is not None else missing for value in values), dtype=self.dtype, count=count
+            ))
+        elif self.dtype == 'object':
+            chunk = numpy.empty(count, dtype='object')
+            chunk[:] = values
+            self.chunks.append(chunk)
+        else:
+            self.chunks.append(numpy.array([value if value is not None else '' for value in values], dtype=self.dtype))
+
+    def build(self):
+        data = numpy.concatenate(self.chunks) if self.chunks else numpy.empty(0, dtype=self.dtype)
+        if self.masked:
+            mask = numpy.concatenate(self.masks) if self.masks else numpy.empty(0, dtype='bool')
+            return numpy.ma.MaskedArray(data, mask=mask)
+        return data
+
+
+def execute_columnar(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                     db_settings: dict, batch_size: int = 10000, decimal: str = 'float',
+                     string_width: int = None, timeout: float = None, cancel=None) -> dict:
+    """
+        Выполнить запрос согласно параметризации и вернуть результат по колонкам
+
+    Массивы заполняются порциями прямо из именованного курсора, без промежуточного списка всех строк.
+    Integer и Boolean возвращаются как numpy.ma.MaskedArray (NULL - замаскированные элементы),
+    Decimal - float64 с NaN вместо NULL или массив Decimal при decimal='exact', Date - datetime64[D] с NaT,
+    String - массив объектов (None для NULL) или строк фиксированной длины string_width.
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param batch_size: количество строк, читаемых из курсора за одно обращение к БД
+    :param decimal: 'float' или 'exact' - представление полей Decimal
+    :param string_width: длина строк для полей String (по-умолчанию - массив объектов)
+    :param timeout: ограничение времени выполнения каждого обращения к БД в секундах
+    :param cancel: объект datasample.CancelHandle для отмены запроса
+    :return: словарь ИмяПоля:массив
+    """
+    if numpy is None:
+        raise ImportError("result_format='columnar' requires numpy.")
+    if decimal not in ('float', 'exact'):
+        raise ValueError("'decimal' must be 'float' or 'exact'.")
+    sample = compile_sample(sample_meta)
+    query, kwargs = compose(sample, params, options)
+    builders = [ColumnBuilder(ctype, decimal, string_width) for ctype in column_ctypes(sample, options)]
+    typecasters = (DECIMAL_AS_FLOAT,) if decimal == 'float' else ()
+    for rows in fetch_batches(query, kwargs, db_settings, batch_size, typecasters, timeout, cancel):
+        for builder, values in zip(builders, zip(*rows)):
+            builder.append(values)
+    return {
+        field_name: builder.build()
+        for (field_name, _), builder in zip(options['fields'], builders)
+    }
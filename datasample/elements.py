@@ -1,13 +1,15 @@
 from typing import Sequence, Set, FrozenSet, Union
 from decimal import Decimal
 from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 from sqlalchemy.sql import text
 
 from .utils import add_message
 
 __all__ = (
     'CTYPES',
-    'Field', 'Param', 'Sample',
+    'Field', 'Param', 'Sample', 'CompiledSample', 'SampleIndexes',
+    'compile_sample', 'build_indexes',
     'check_op_args',
     'SampleElementError',
 )
@@ -59,6 +61,33 @@ ERR_MSG_KEY_CALC = "Only one of 'key' and 'calc' must by set on."
 # namedtuple позволяет работать с данными как с классом, при этом данные упорядочены как в кортеже
 FieldType = namedtuple('FieldType', ('datatype', 'default', 'validator', 'errmsg',))
 
+# Индексы возможностей полей и параметров СВД для быстрой проверки настроек и параметров.
+# Строятся один раз при изменении состояния СВД (см. build_indexes)
+SampleIndexes = namedtuple('SampleIndexes', (
+    'visible',  # frozenset имён не скрытых полей
+    'mandatory',  # frozenset имён обязательных полей
+    'keys',  # frozenset имён ключевых полей (допустимы в группировке)
+    'having',  # frozenset имён полей, допустимых в отсеве
+    'ordered',  # frozenset имён полей, допустимых в сортировке
+    'filter_ops',  # ИмяПоля:frozenset допустимых операций фильтра (пустой - ограничений нет)
+    'having_ops',  # ИмяПоля:frozenset допустимых операций отсева (пустой - ограничений нет)
+    'param_types',  # ИмяПараметра:кортеж допустимых типов Python
+))
+
+
+def build_indexes(fields: dict, params: dict) -> SampleIndexes:
+    """ Построить индексы возможностей по описаниям полей и параметров СВД """
+    return SampleIndexes(
+        visible=frozenset(name for name, state in fields.items() if not state['hidden']),
+        mandatory=frozenset(name for name, state in fields.items() if state['mandatory']),
+        keys=frozenset(name for name, state in fields.items() if state['key']),
+        having=frozenset(name for name, state in fields.items() if state['having']),
+        ordered=frozenset(name for name, state in fields.items() if state['ordered']),
+        filter_ops=MappingProxyType({name: frozenset(state['filtered'] or ()) for name, state in fields.items()}),
+        having_ops=MappingProxyType({name: frozenset(state['having'] or ()) for name, state in fields.items()}),
+        param_types=MappingProxyType({name: CTYPES.get(state['ctype'], ()) for name, state in params.items()}),
+    )
+
 
 def check_val_ctype(val, ctype: str):
     """ Проверка значениен на допустимые типы полей """
@@ -354,6 +383,7 @@ class Sample:
             self.tables = dict()
             self.fields = dict()
             self.params = dict()
+            self._indexes = None
 
     def __getstate__(self):
         return OrderedDict([
@@ -372,6 +402,7 @@ class Sample:
         self.tables = dict()
         self.fields = dict()
         self.params = dict()
+        self._indexes = None  # индексы будут перестроены по новому состоянию при первом обращении
         sample_messages = dict()
 
         tables_messages = dict()
@@ -440,6 +471,17 @@ class Sample:
     def state(self, state: dict):
         self.__setstate__(state)
 
+    @property
+    def indexes(self) -> SampleIndexes:
+        """ Индексы возможностей полей и параметров, кэшируемые до следующего изменения состояния """
+        if self._indexes is None:
+            self._indexes = build_indexes(self.fields, self.params)
+        return self._indexes
+
+    def compile(self) -> 'CompiledSample':
+        """ Получить неизменяемое скомпилированное представление СВД для многократной компоновки запросов """
+        return CompiledSample(self)
+
     def sql_tables(self, fields: Union[Sequence[str], Set[str], FrozenSet[str]]) -> str:
         """
             Генерация списка таблиц для SQL-фразы WHERE
@@ -460,3 +502,116 @@ class Sample:
 
     def __repr__(self):
         return repr(self.__getstate__())
+
+
+def _freeze(value):
+    """ Неизменяемая копия значения атрибута элемента СВД """
+    return tuple(value) if isinstance(value, list) else value
+
+
+class CompiledSample:
+    """
+        Скомпилированная СВД
+
+    Неизменяемый объект, который строится один раз из проверенной Sample и хранит
+    заранее подготовленные фрагменты SQL, поэтому его можно многократно (в т.ч. из разных потоков)
+    передавать в compose и execute вместо описания СВД, минуя повторную валидацию.
+
+    Атрибуты
+    ========
+    field_names     - кортеж имён полей в порядке описания СВД
+    field_index     - словарь ИмяПоля:ПозицияВКортежах
+    sql_identifiers - фрагменты SQL с полным идентификатором поля (см. Field.sql_identifier)
+    sql_aliases     - фрагменты SQL с алиасом поля (см. Field.sql_alias)
+    sql_columns     - фрагменты SQL для фразы SELECT (см. Field.sql_column)
+    field_tables    - алиас таблицы каждого поля
+    table_names     - кортеж алиасов таблиц в порядке описания СВД
+    table_index     - словарь АлиасТаблицы:ПозицияВКортежах
+    sql_froms       - фрагменты SQL для фразы FROM по каждой таблице
+    tables, fields, params - read-only описание СВД, совместимое с Sample.tables/fields/params
+    indexes         - индексы возможностей полей и параметров (см. SampleIndexes)
+    rollups         - кортеж предагрегатов СВД, на которые compose переводит подходящие запросы
+                      (см. datasample.rollup)
+    """
+    __slots__ = (
+        'field_names', 'field_index', 'sql_identifiers', 'sql_aliases', 'sql_columns', 'field_tables',
+        'table_names', 'table_index', 'sql_froms',
+        'tables', 'fields', 'params', 'indexes', 'rollups',
+    )
+
+    def __init__(self, sample: Sample, rollups: Sequence = ()):
+        init = super().__setattr__
+        fields = [Field(name, **state) for name, state in sample.fields.items()]
+        init('field_names', tuple(field.name for field in fields))
+        init('field_index', MappingProxyType({name: i for i, name in enumerate(self.field_names)}))
+        init('sql_identifiers', tuple(field.sql_identifier for field in fields))
+        init('sql_aliases', tuple(field.sql_alias for field in fields))
+        init('sql_columns', tuple(field.sql_column for field in fields))
+        init('field_tables', tuple(field.state['table'] for field in fields))
+        init('table_names', tuple(sample.tables))
+        init('table_index', MappingProxyType({alias: i for i, alias in enumerate(self.table_names)}))
+        init('sql_froms', tuple(f'({stmt}) AS "{alias}"' for alias, stmt in sample.tables.items()))
+        init('tables', MappingProxyType(dict(sample.tables)))
+        init('fields', MappingProxyType({
+            field.name: MappingProxyType({attr: _freeze(value) for attr, value in field.state.items()})
+            for field in fields
+        }))
+        init('params', MappingProxyType({
+            name: MappingProxyType(dict(state)) for name, state in sample.params.items()
+        }))
+        init('indexes', sample.indexes)
+        init('rollups', tuple(rollups))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"'{type(self).__name__}' is immutable.")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"'{type(self).__name__}' is immutable.")
+
+    @property
+    def state(self) -> OrderedDict:
+        """ Описание СВД в формате Sample.__getstate__ """
+        return OrderedDict([
+            ('tables', dict(self.tables)),
+            ('fields', {name: OrderedDict(state) for name, state in self.fields.items()}),
+            ('params', {name: OrderedDict(state) for name, state in self.params.items()}),
+        ])
+
+    def __reduce__(self):
+        if self.rollups:
+            return _compile_with_rollups, (self.state, self.rollups)
+        return compile_sample, (self.state,)
+
+    def sql_tables(self, fields: Union[Sequence[str], Set[str], FrozenSet[str]]) -> str:
+        """
+            Генерация списка таблиц для SQL-фразы FROM
+
+        :param fields: коллекция имён полей
+        :return: список таблиц с алиасами
+        """
+        using_tables = {self.field_tables[self.field_index[name]] for name in fields}
+        return text(', '.join([
+            sql_from
+            for alias, sql_from in zip(self.table_names, self.sql_froms)
+            if alias in using_tables
+        ]))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({repr(self.state)})"
+
+
+def compile_sample(sample_meta: Union[dict, Sample, CompiledSample]) -> CompiledSample:
+    """
+        Получить CompiledSample из описания СВД, объекта Sample или уже скомпилированной СВД
+
+    Для словаря с описанием СВД выполняется полная валидация через Sample.
+    """
+    if isinstance(sample_meta, CompiledSample):
+        return sample_meta
+    if not isinstance(sample_meta, Sample):
+        sample_meta = Sample(sample_meta)
+    return sample_meta.compile()
+
+
+def _compile_with_rollups(state: dict, rollups: Sequence) -> CompiledSample:
+    return CompiledSample(Sample(state), rollups)
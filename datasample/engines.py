@@ -0,0 +1,107 @@
+"""
+    Реестр пулов соединений с БД
+
+Для каждой уникальной (нормализованной) комбинации db_settings создаётся ровно один
+sqlalchemy.engine.Engine со своим пулом соединений, который переиспользуется
+всеми последующими выполнениями запросов к этой БД.
+"""
+from threading import Lock
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import URL
+
+__all__ = (
+    'POOL_DEFAULTS',
+    'normalize_db_settings',
+    'EngineRegistry',
+    'engines',
+    'get_engine',
+    'close_all',
+)
+
+# Настройки пула по-умолчанию (имена совпадают с параметрами sqlalchemy.create_engine)
+POOL_DEFAULTS = {
+    'pool_size': 5,  # количество постоянно открытых соединений
+    'max_overflow': 10,  # сколько соединений можно открыть сверх pool_size при пиковой нагрузке
+    'pool_recycle': 1800,  # через сколько секунд пересоздавать соединение
+    'pool_pre_ping': True,  # проверять живость соединения перед выдачей из пула
+}
+
+
+def normalize_db_settings(db_settings: dict) -> tuple:
+    """
+        Нормализовать db_settings в хешируемый ключ реестра
+
+    Учитываются только параметры, влияющие на подключение, и параметры пула (db_settings['POOL']).
+    Порт по-умолчанию - 5432, пустой пароль эквивалентен отсутствующему.
+    """
+    pool = db_settings.get('POOL') or dict()
+    return (
+        db_settings.get('USER') or '',
+        db_settings.get('PASSWORD') or '',
+        db_settings.get('HOST') or '',
+        str(db_settings.get('PORT') or '5432'),
+        db_settings.get('NAME') or '',
+        tuple(sorted(pool.items())),
+    )
+
+
+class EngineRegistry:
+    """
+        Потокобезопасный реестр sqlalchemy.engine.Engine
+
+    Ключ реестра - нормализованные db_settings (см. normalize_db_settings).
+    Параметры пула задаются при создании реестра и могут быть перекрыты
+    для конкретной БД в db_settings['POOL'].
+    """
+
+    def __init__(self, **pool_options):
+        self._lock = Lock()
+        self._engines = dict()
+        self.pool_options = {**POOL_DEFAULTS, **pool_options}
+
+    def configure(self, **pool_options):
+        """ Изменить параметры пула для вновь создаваемых Engine """
+        unknown = set(pool_options) - set(POOL_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры пула: {unknown}")
+        with self._lock:
+            self.pool_options.update(pool_options)
+
+    def get(self, db_settings: dict):
+        """ Получить (при необходимости - создать) Engine для db_settings """
+        key = normalize_db_settings(db_settings)
+        engine = self._engines.get(key)
+        if engine is None:
+            with self._lock:
+                # Повторная проверка: другой поток мог успеть создать Engine, пока мы ждали блокировку
+                engine = self._engines.get(key)
+                if engine is None:
+                    user, password, host, port, name, pool = key
+                    engine = create_engine(
+                        URL('postgresql', username=user, password=password, host=host, port=port, database=name),
+                        **{**self.pool_options, **dict(pool)}
+                    )
+                    self._engines[key] = engine
+        return engine
+
+    def close_all(self):
+        """ Закрыть все соединения всех пулов и очистить реестр """
+        with self._lock:
+            engines, self._engines = self._engines, dict()
+        for engine in engines.values():
+            engine.dispose()
+
+    def __len__(self):
+        return len(self._engines)
+
+
+# Реестр по-умолчанию, используемый datasample.execute
+engines = EngineRegistry()
+
+
+def get_engine(db_settings: dict):
+    return engines.get(db_settings)
+
+
+def close_all():
+    engines.close_all()
@@ -0,0 +1,132 @@
+"""
+    Ограничение времени выполнения и отмена запросов СВД
+
+Время выполнения ограничивается параметром PostgreSQL statement_timeout, который
+устанавливается только на транзакцию выполняемого запроса (set_config(..., true)),
+поэтому соединения, возвращённые в пул, его не сохраняют.
+Отмена выполняется через pg_cancel_backend из отдельного соединения,
+например, из другого потока, когда клиент перестал ждать результат.
+"""
+from threading import Lock
+from contextlib import contextmanager
+from psycopg2 import Error as DriverError
+from sqlalchemy.exc import DBAPIError
+
+__all__ = (
+    'SampleExecutionError',
+    'SampleTimeoutError',
+    'SampleCancelledError',
+    'SampleBudgetError',
+    'SampleOverloadError',
+    'CancelHandle',
+    'guarded',
+)
+
+# SQLSTATE query_canceled - и для statement_timeout, и для pg_cancel_backend
+QUERY_CANCELED = '57014'
+
+
+class SampleExecutionError(Exception):
+    """ Ошибка выполнения запроса СВД """
+
+
+class SampleTimeoutError(SampleExecutionError):
+    """ Превышено время выполнения запроса """
+
+
+class SampleCancelledError(SampleExecutionError):
+    """ Выполнение запроса отменено """
+
+
+class SampleBudgetError(SampleExecutionError):
+    """ Оценка стоимости запроса превышает допустимую (см. datasample.guard.CostGuard) """
+
+    def __init__(self, message: str, plan=None):
+        super().__init__(message)
+        self.plan = plan
+
+
+class SampleOverloadError(SampleExecutionError):
+    """ Запрос не принят к выполнению: очередь заполнена или время ожидания истекло (см. datasample.scheduler) """
+
+
+class CancelHandle:
+    """
+        Отмена выполняющегося запроса СВД
+
+    Передаётся в execute (execute_iter, export_csv, ...) параметром cancel.
+    Метод cancel потокобезопасен: его можно вызвать из любого потока
+    до начала, во время или после выполнения запроса.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._engine = None
+        self._pid = None
+        self.cancelled = False
+
+    def attach(self, engine, dbapi_connection) -> None:
+        """ Запомнить процесс БД, выполняющий запрос. Если отмена уже запрошена - SampleCancelledError """
+        with self._lock:
+            if self.cancelled:
+                raise SampleCancelledError("Выполнение запроса отменено")
+            self._engine = engine
+            self._pid = dbapi_connection.get_backend_pid()
+
+    def detach(self) -> None:
+        """ Запрос завершён: соединение возвращается в пул и больше не должно отменяться """
+        with self._lock:
+            self._pid = None
+
+    def cancel(self) -> bool:
+        """
+            Отменить запрос
+
+        :return: True, если в БД был отправлен pg_cancel_backend
+        """
+        with self._lock:
+            self.cancelled = True
+            if self._pid is None:
+                return False
+            # Отдельное соединение вне пула: пул может быть исчерпан как раз долгими запросами
+            cargs, cparams = self._engine.dialect.create_connect_args(self._engine.url)
+            conn = self._engine.dialect.connect(*cargs, **cparams)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("select pg_cancel_backend(%s)", (self._pid,))
+                    return bool(cursor.fetchone()[0])
+            finally:
+                conn.close()
+
+
+@contextmanager
+def guarded(engine, dbapi_connection, timeout: float = None, cancel: CancelHandle = None):
+    """
+        Выполнение запроса на соединении dbapi_connection с ограничением времени и возможностью отмены
+
+    Отмена запроса по statement_timeout или pg_cancel_backend
+    преобразуется в SampleTimeoutError или SampleCancelledError.
+
+    :param engine: sqlalchemy.engine.Engine, которому принадлежит соединение
+    :param dbapi_connection: соединение psycopg2 (в том числе из пула SQLAlchemy)
+    :param timeout: ограничение времени выполнения запроса в секундах
+    :param cancel: объект отмены запроса
+    """
+    if timeout is not None and timeout <= 0:
+        raise ValueError("'timeout' must be positive.")
+    try:
+        if cancel is not None:
+            cancel.attach(engine, dbapi_connection)
+        if timeout is not None:
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute("select set_config('statement_timeout', %s, true)", (f'{max(int(timeout * 1000), 1)}',))
+        yield
+    except (DBAPIError, DriverError) as e:
+        if getattr(getattr(e, 'orig', e), 'pgcode', None) != QUERY_CANCELED:
+            raise
+        if cancel is not None and cancel.cancelled:
+            raise SampleCancelledError("Выполнение запроса отменено") from e
+        raise SampleTimeoutError(f"Превышено время выполнения запроса ({timeout} с)") from e
+    finally:
+        if cancel is not None:
+            cancel.detach()
@@ -0,0 +1,93 @@
+"""
+    Выгрузка результатов выполнения СВД средствами PostgreSQL
+
+COPY ... TO STDOUT передаёт результат потоком байт прямо из сервера БД в файл,
+минуя построчную выборку и сериализацию в Python.
+"""
+import io
+import csv
+from typing import Union
+
+from .elements import Sample, CompiledSample, compile_sample
+from .engines import get_engine
+from .execution import CancelHandle, guarded
+from .instrumentation import get_sink, span
+from .sqlalchemytools import compose, compile_query
+
+__all__ = (
+    'export_csv',
+)
+
+
+def export_csv(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict, db_settings: dict,
+               fileobj, timeout: float = None, cancel: CancelHandle = None, progress=None,
+               progress_every: int = 10000) -> int:
+    """
+        Выгрузить результат выполнения СВД в CSV через COPY (...) TO STDOUT
+
+    Первая строка - заголовки колонок из меток (label) полей СВД.
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param fileobj: файлоподобный объект с методом write (текстовый или бинарный, например HttpResponse)
+    :param timeout: ограничение времени выполнения выгрузки в секундах
+    :param cancel: объект datasample.CancelHandle для отмены выгрузки
+    :param progress: функция, вызываемая с количеством выгруженных строк каждые progress_every строк
+    :param progress_every: периодичность вызова progress
+    :return: количество выгруженных строк (без заголовка)
+    """
+    sample = compile_sample(sample_meta)
+    query, kwargs = compose(sample, params, options)
+    engine = get_engine(db_settings)
+    sql, binds = compile_query(query, kwargs, engine.dialect)
+
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow([
+        sample.fields[field_name]['label'] for field_name, *_ in options['fields']
+    ])
+    fileobj.write(header.getvalue() if isinstance(fileobj, io.TextIOBase) else header.getvalue().encode())
+
+    # Счётчик нужен только для progress и замеров, без них COPY пишет прямо в fileobj
+    writer = fileobj
+    if progress is not None or get_sink() is not None:
+        writer = ProgressWriter(fileobj, progress, progress_every)
+    # raw_connection берёт соединение из того же пула, close() возвращает его в пул
+    conn = engine.raw_connection()
+    try:
+        with guarded(engine, conn, timeout, cancel), conn.cursor() as cursor:
+            copy_sql = f"COPY ({cursor.mogrify(sql, binds).decode()}) TO STDOUT WITH (FORMAT csv, ENCODING 'UTF8')"
+            # COPY выполняет запрос и передаёт результат одной командой, поэтому замеряется как fetch
+            with span('fetch') as fetch_span:
+                cursor.copy_expert(copy_sql, writer)
+                rows = cursor.rowcount
+                fetch_span.add(rows=rows, bytes=getattr(writer, 'bytes', 0))
+        conn.rollback()
+    finally:
+        conn.close()
+    return rows
+
+
+class ProgressWriter:
+    """
+        Подсчёт строк и байт, выгружаемых через COPY TO STDOUT
+
+    Сервер передаёт каждую строку результата отдельным сообщением CopyData,
+    а psycopg2 записывает каждое сообщение отдельным вызовом write.
+    """
+
+    def __init__(self, fileobj, progress, every: int):
+        self.fileobj = fileobj
+        self.progress = progress
+        self.every = every
+        self.rows = 0
+        self.bytes = 0
+        self.text = isinstance(fileobj, io.TextIOBase)
+
+    def write(self, data):
+        self.rows += 1
+        self.bytes += len(data)
+        if self.progress is not None and self.rows % self.every == 0:
+            self.progress(self.rows)
+        return self.fileobj.write(data.decode() if self.text and isinstance(data, bytes) else data)
@@ -0,0 +1,135 @@
+"""
+    Предварительная оценка стоимости запроса СВД (cost guard)
+
+Перед выполнением запрос оценивается планировщиком PostgreSQL (datasample.explain),
+оценка сравнивается с бюджетом - допустимой стоимостью и количеством строк.
+При превышении бюджета запрос отклоняется или выполняется в другом режиме:
+    reject - SampleBudgetError
+    cap    - с ограничением количества строк (options['limit'])
+    stream - только с потоковой выдачей строк (execute_iter, выгрузки), выдача результата целиком
+             (например, для просмотра на странице) отклоняется вызывающим
+    queue  - фоновым заданием вместо выполнения в рамках запроса (решение выполняет вызывающий)
+Оценки кэшируются по (имя СВД, revision, форма настроек), поэтому для часто
+выполняемых отчётов проверка не требует обращения к БД.
+"""
+from threading import Lock
+from collections import OrderedDict, namedtuple
+
+from .cache import fingerprint
+from .engines import normalize_db_settings
+from .execution import SampleBudgetError
+from .sqlalchemytools import PlanSummary, explain, options_shape
+
+__all__ = (
+    'GUARD_ACTIONS',
+    'BUDGET_DEFAULTS',
+    'GuardDecision',
+    'check_budget',
+    'CostGuard',
+)
+
+GUARD_ACTIONS = ('reject', 'cap', 'stream', 'queue')
+BUDGET_DEFAULTS = {
+    'max_cost': None,  # допустимая оценка стоимости запроса (Total Cost), None - без ограничения
+    'max_rows': None,  # допустимая оценка количества строк, None - без ограничения
+    'on_exceed': 'reject',  # действие при превышении бюджета - один из GUARD_ACTIONS
+    'cap_rows': 10000,  # ограничение количества строк для on_exceed='cap'
+}
+
+# Решение по запросу: action - 'allow' или один из GUARD_ACTIONS, plan - оценка, options - настройки для выполнения
+GuardDecision = namedtuple('GuardDecision', ('action', 'plan', 'options'))
+
+
+def check_budget(budget: dict) -> dict:
+    """ Проверить бюджет (все ключи необязательны) и вернуть его копию """
+    budget = dict(budget or {})
+    unknown = set(budget) - set(BUDGET_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Неизвестные параметры бюджета: {unknown}")
+    if budget.get('on_exceed', 'reject') not in GUARD_ACTIONS:
+        raise ValueError(f"'on_exceed' must be in {GUARD_ACTIONS}")
+    for key in ('max_cost', 'max_rows', 'cap_rows'):
+        value = budget.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+            raise ValueError(f"'{key}' must be positive number.")
+    return budget
+
+
+class CostGuard:
+    """
+        Проверка оценки стоимости запроса по бюджету
+
+    Общий бюджет задаётся при создании, бюджет конкретной СВД перекрывает его при вызове check.
+    Оценки хранятся в LRU-кэше на max_plans записей.
+    """
+
+    def __init__(self, budget: dict = None, max_plans: int = 1024):
+        self.budget = {**BUDGET_DEFAULTS, **check_budget(budget)}
+        self.max_plans = max_plans
+        self._lock = Lock()
+        self._plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'plans': len(self._plans), 'hits': self.hits, 'misses': self.misses}
+
+    def plan(self, sample_meta, params: dict, options: dict, db_settings: dict,
+             name: str = None, revision=None) -> PlanSummary:
+        """ Оценка запроса, для именованной СВД - из кэша по форме настроек """
+        if name is None:
+            return explain(sample_meta, params, options, db_settings)
+        user, _, host, port, db_name, _ = normalize_db_settings(db_settings)
+        key = fingerprint([name, revision, options_shape(options), [user, host, port, db_name]])
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+        plan = explain(sample_meta, params, options, db_settings)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def check(self, sample_meta, params: dict, options: dict, db_settings: dict,
+              name: str = None, revision=None, budget: dict = None) -> GuardDecision:
+        """
+            Решение о выполнении запроса
+
+        :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+        :param params: значения параметров согласно схемы
+        :param options: значения настроек согласно схемы
+        :param db_settings: database connection settings like django.conf.settings.DATABASES
+        :param name: имя СВД (без имени оценка не кэшируется)
+        :param revision: номер изменения описания СВД
+        :param budget: бюджет СВД, перекрывающий общий
+        :return: GuardDecision, при on_exceed='reject' и превышении бюджета - SampleBudgetError
+        """
+        budget = {**self.budget, **check_budget(budget)}
+        if budget['max_cost'] is None and budget['max_rows'] is None:
+            return GuardDecision('allow', None, options)
+        plan = self.plan(sample_meta, params, options, db_settings, name, revision)
+        exceeded = (
+            (budget['max_cost'] is not None and plan.total_cost > budget['max_cost'])
+            or (budget['max_rows'] is not None and plan.rows > budget['max_rows'])
+        )
+        if not exceeded:
+            return GuardDecision('allow', plan, options)
+        action = budget['on_exceed']
+        if action == 'reject':
+            raise SampleBudgetError(
+                f"Оценка запроса превышает допустимую: стоимость {plan.total_cost}, строк {plan.rows}", plan
+            )
+        if action == 'cap':
+            limit = min(options.get('limit') or budget['cap_rows'], budget['cap_rows'])
+            return GuardDecision('cap', plan, {**options, 'limit': int(limit)})
+        return GuardDecision(action, plan, options)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
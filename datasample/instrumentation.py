@@ -0,0 +1,257 @@
+"""
+    Замеры времени этапов выполнения СВД
+
+Этапы (phase):
+    validate  - проверка описания СВД, параметров и настроек
+    compose   - компоновка SQL-запроса (включая validate)
+    execute   - выполнение запроса до получения первых строк
+    fetch     - чтение строк из БД (rows - количество строк)
+    serialize - преобразование результата в формат выдачи (bytes - размер результата)
+    render    - формирование страницы с результатом (Django)
+
+Замеры передаются в приёмник (sink), установленный set_sink. Пока приёмник не установлен,
+span возвращает один и тот же пустой объект, поэтому замеры почти ничего не стоят.
+Метки замеров (имя СВД, версия, revision) задаются для блока кода через labels.
+"""
+import logging
+from bisect import bisect_left
+from threading import Lock
+from functools import wraps
+from time import perf_counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+__all__ = (
+    'PHASES',
+    'MetricsSink',
+    'MultiSink',
+    'PrometheusSink',
+    'Span',
+    'set_sink',
+    'get_sink',
+    'labels',
+    'current_labels',
+    'span',
+    'timed',
+    'render_gauges',
+)
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('validate', 'compose', 'execute', 'fetch', 'serialize', 'render')
+
+_sink = None
+_labels = ContextVar('datasample_labels', default={})
+
+
+class MetricsSink:
+    """ Приёмник замеров. Метод record вызывается по завершении каждого этапа """
+
+    def record(self, span: 'Span') -> None:
+        pass
+
+
+class MultiSink(MetricsSink):
+    """ Передача замеров в несколько приёмников """
+
+    def __init__(self, *sinks: MetricsSink):
+        self.sinks = sinks
+
+    def record(self, span: 'Span') -> None:
+        for sink in self.sinks:
+            sink.record(span)
+
+
+class Span:
+    """ Замер одного этапа: длительность, количество строк и байт, имя класса исключения """
+    __slots__ = ('sink', 'phase', 'labels', 'duration', 'rows', 'bytes', 'error', '_started')
+
+    def __init__(self, sink: MetricsSink, phase: str, labels: dict):
+        self.sink = sink
+        self.phase = phase
+        self.labels = labels
+        self.duration = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.error = None
+        self._started = None
+
+    def __enter__(self):
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration += perf_counter() - self._started
+        self.finish(exc_type)
+        return False
+
+    @contextmanager
+    def measure(self):
+        """ Добавить длительность блока к замеру, не завершая его (например, для каждой порции строк) """
+        started = perf_counter()
+        try:
+            yield self
+        finally:
+            self.duration += perf_counter() - started
+
+    def add(self, rows: int = 0, bytes: int = 0) -> None:
+        self.rows += rows
+        self.bytes += bytes
+
+    def finish(self, exc_type=None) -> None:
+        """ Завершить замер и передать его в приёмник """
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        try:
+            self.sink.record(self)
+        except Exception:
+            logger.exception("Metrics sink failed")
+
+
+class _NoopSpan:
+    """ Замер при отключенных замерах: ничего не делает """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def measure(self):
+        return self
+
+    def add(self, rows: int = 0, bytes: int = 0) -> None:
+        pass
+
+    def finish(self, exc_type=None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def set_sink(sink: MetricsSink = None) -> None:
+    """ Установить приёмник замеров (None - отключить замеры) """
+    global _sink
+    _sink = sink
+
+
+def get_sink():
+    return _sink
+
+
+@contextmanager
+def labels(**values):
+    """ Метки замеров, выполняемых в блоке кода (например, sample, version, revision) """
+    token = _labels.set({**_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> dict:
+    """ Текущие метки. Генераторы запоминают их при создании, так как выполняются вне блока labels """
+    return _labels.get()
+
+
+def span(phase: str, span_labels: dict = None):
+    """ Замер этапа phase: with span('fetch') as s: ...; s.add(rows=len(rows)) """
+    sink = _sink
+    if sink is None:
+        return NOOP_SPAN
+    return Span(sink, phase, _labels.get() if span_labels is None else span_labels)
+
+
+def timed(phase: str):
+    """ Декоратор: замер выполнения функции как этапа phase """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            with span(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Границы интервалов гистограммы длительности этапов в секундах
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LABEL_NAMES = ('phase', 'sample', 'version', 'revision')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class PrometheusSink(MetricsSink):
+    """
+        Приёмник замеров с выдачей в текстовом формате Prometheus
+
+    Для каждого сочетания (phase, sample, version, revision) ведётся гистограмма длительности
+    и счётчики строк, байт и ошибок.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix: str = 'datasample'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = Lock()
+        self._series = dict()  # метки: [количество по интервалам, сумма длительностей, строк, байт, ошибок]
+
+    def record(self, span: Span) -> None:
+        key = (span.phase, *(str(span.labels.get(name, '')) for name in LABEL_NAMES[1:]))
+        index = bisect_left(self.buckets, span.duration)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0, 0]
+            series[0][index] += 1
+            series[1] += span.duration
+            series[2] += span.rows
+            series[3] += span.bytes
+            series[4] += span.error is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> str:
+        """ Метрики в текстовом формате Prometheus """
+        with self._lock:
+            series = sorted((key, [list(value[0]), *value[1:]]) for key, value in self._series.items())
+        name = f'{self.prefix}_phase_seconds'
+        lines = [
+            f'# HELP {name} Duration of datasample execution phases.',
+            f'# TYPE {name} histogram',
+        ]
+        for key, (counts, total, *_) in series:
+            labels_text = _format_labels(LABEL_NAMES, key)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels_text}}} {total}')
+            lines.append(f'{name}_count{{{labels_text}}} {cumulative}')
+        for index, counter, help_text in ((2, 'rows', 'Rows processed'), (3, 'bytes', 'Bytes produced'),
+                                          (4, 'errors', 'Errors raised')):
+            name = f'{self.prefix}_phase_{counter}_total'
+            lines.append(f'# HELP {name} {help_text} by datasample execution phases.')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in series:
+                lines.append(f'{name}{{{_format_labels(LABEL_NAMES, key)}}} {value[index]}')
+        return '\n'.join(lines) + '\n'
+
+
+def render_gauges(prefix: str, values: dict) -> str:
+    """ Значения (например, stats планировщика) в текстовом формате Prometheus как gauge """
+    lines = []
+    for key, value in values.items():
+        lines.append(f'# TYPE {prefix}_{key} gauge')
+        lines.append(f'{prefix}_{key} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,156 @@
+"""
+    Материализация подзапросов таблиц СВД (PostgreSQL materialized view)
+
+Тяжёлый подзапрос Sample.tables[<алиас>], который редко меняется, можно один раз выполнить
+в материализованное представление и читать данные из него: СВД с подзапросом
+'select * from <представление>' (materialized_sample) компонуется и выполняется как обычно.
+Материализуются только подзапросы без параметров - значения параметров известны лишь при выполнении.
+
+Настройка материализации (все ключи необязательны):
+    tables           - словарь <алиас таблицы>: [<колонки уникального ключа>];
+                       по уникальному ключу строится уникальный индекс, который нужен
+                       для REFRESH MATERIALIZED VIEW CONCURRENTLY (обновление без блокировки чтения),
+                       без ключа представление обновляется с блокировкой
+    refresh_interval - через сколько секунд обновлять представления (None - только по требованию)
+
+Фраза FROM запроса СВД - список подзапросов таблиц, на которые по алиасам ссылаются поля,
+поэтому материализуется каждый подзапрос отдельно; для СВД из одной таблицы это и есть вся фраза FROM.
+"""
+from typing import Iterable, Union
+from sqlalchemy.sql import text
+
+from .elements import Sample, CompiledSample, compile_sample
+from .engines import get_engine
+
+__all__ = (
+    'MATERIALIZE_DEFAULTS',
+    'check_materialize',
+    'materialized_sample',
+    'create_views',
+    'refresh_views',
+    'drop_views',
+    'find_views',
+)
+
+MATERIALIZE_DEFAULTS = {
+    'tables': {},  # алиас таблицы: колонки уникального ключа
+    'refresh_interval': None,  # через сколько секунд обновлять представления, None - только по требованию
+}
+
+
+def check_materialize(materialize: dict, sample_meta: Union[dict, Sample, CompiledSample]) -> dict:
+    """ Проверить настройку материализации для СВД (все ключи необязательны) и вернуть её копию """
+    materialize = dict(materialize or {})
+    unknown = set(materialize) - set(MATERIALIZE_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Неизвестные параметры материализации: {unknown}")
+    tables = materialize.get('tables', {})
+    if not isinstance(tables, dict):
+        raise ValueError("'tables' must be dict of table alias: unique key columns.")
+    sample = compile_sample(sample_meta)
+    for alias, columns in tables.items():
+        if alias not in sample.tables:
+            raise ValueError(f"table '{alias}' not in 'tables' ({','.join(sample.tables)})")
+        if text(sample.tables[alias])._bindparams:
+            raise ValueError(f"table '{alias}' uses params and can not be materialized.")
+        if not isinstance(columns, (list, tuple)) or not all(isinstance(column, str) for column in columns):
+            raise ValueError(f"unique key of table '{alias}' must be list of column names.")
+    interval = materialize.get('refresh_interval')
+    if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float))
+                                 or interval <= 0):
+        raise ValueError("'refresh_interval' must be positive number.")
+    return materialize
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def materialized_sample(sample_meta: Union[dict, Sample, CompiledSample], views: dict) -> Sample:
+    """
+        СВД, подзапросы таблиц которой читают данные из материализованных представлений
+
+    :param views: словарь <алиас таблицы>: <имя представления>
+    """
+    state = compile_sample(sample_meta).state
+    state['tables'] = {
+        alias: f"select * from {_quote(views[alias])}" if alias in views else stmt
+        for alias, stmt in state['tables'].items()
+    }
+    return Sample(state)
+
+
+def create_views(sample_meta: Union[dict, Sample, CompiledSample], views: dict, materialize: dict,
+                 db_settings: dict) -> None:
+    """
+        Создать (пересоздать) материализованные представления подзапросов таблиц СВД в одной транзакции
+
+    :param views: словарь <алиас таблицы>: <имя представления>
+    :param materialize: настройка материализации (см. check_materialize)
+    """
+    sample = compile_sample(sample_meta)
+    tables = materialize.get('tables', {})
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for alias, name in views.items():
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {_quote(name)}")
+                cursor.execute(f"CREATE MATERIALIZED VIEW {_quote(name)} AS {sample.tables[alias]}")
+                if tables.get(alias):
+                    cursor.execute(f"CREATE UNIQUE INDEX {_quote(name[:59] + '_key')} ON {_quote(name)} "
+                                   f"({', '.join(map(_quote, tables[alias]))})")
+                cursor.execute(f"ANALYZE {_quote(name)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def refresh_views(views: dict, materialize: dict, db_settings: dict) -> None:
+    """
+        Обновить материализованные представления
+
+    Представление с уникальным ключом обновляется CONCURRENTLY (чтение не блокируется),
+    каждое представление - в своей транзакции.
+    """
+    tables = materialize.get('tables', {})
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for alias, name in views.items():
+                concurrently = 'CONCURRENTLY ' if tables.get(alias) else ''
+                cursor.execute(f"REFRESH MATERIALIZED VIEW {concurrently}{_quote(name)}")
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def drop_views(names: Iterable[str], db_settings: dict) -> None:
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for name in names:
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {_quote(name)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def find_views(prefix: str, db_settings: dict) -> list:
+    """ Имена материализованных представлений из search_path, начинающиеся с prefix """
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("select matviewname from pg_matviews "
+                           "where schemaname = any(current_schemas(false)) and left(matviewname, %s) = %s "
+                           "order by matviewname", (len(prefix), prefix))
+            names = [name for name, in cursor.fetchall()]
+        conn.rollback()
+    finally:
+        conn.close()
+    return names
@@ -0,0 +1,83 @@
+"""
+    Запись результата выполнения СВД в файл одного из форматов
+
+csv    - через PostgreSQL COPY (см. datasample.export_csv)
+ndjson - по одному JSON-объекту на строку
+arrow  - Arrow IPC stream (см. datasample.arrow.write_arrow)
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Union
+
+from .elements import Sample, CompiledSample
+from .export import export_csv
+from .instrumentation import span
+from .sqlalchemytools import execute_iter
+
+__all__ = (
+    'OUTPUT_FORMATS',
+    'write_ndjson',
+    'write_result',
+)
+
+OUTPUT_FORMATS = ('csv', 'ndjson', 'arrow')
+
+
+def _json_default(value):
+    # Как django.core.serializers.json.DjangoJSONEncoder, который используется в API
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_ndjson(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                 db_settings: dict, fileobj, batch_size: int = 10000, progress=None, **execute_options) -> int:
+    """ Записать результат в NDJSON в бинарный файлоподобный объект. Возвращает количество строк """
+    columns = [field_name for field_name, *_ in options['fields']]
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+    rows = 0
+    serialize_span = span('serialize')
+    for batch in execute_iter(sample_meta, params, options, db_settings, batch_size=batch_size, batches=True,
+                              **execute_options):
+        with serialize_span.measure():
+            data = ''.join(encoder.encode(dict(zip(columns, row))) + '\n' for row in batch).encode()
+        serialize_span.add(rows=len(batch), bytes=len(data))
+        fileobj.write(data)
+        rows += len(batch)
+        if progress is not None:
+            progress(rows)
+    serialize_span.finish()
+    return rows
+
+
+def write_result(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                 db_settings: dict, fileobj, format: str = 'csv', progress=None, batch_size: int = 10000,
+                 **execute_options) -> int:
+    """
+        Записать результат выполнения СВД в файл
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param fileobj: бинарный файлоподобный объект
+    :param format: один из OUTPUT_FORMATS
+    :param progress: функция, вызываемая с количеством записанных строк по мере записи
+    :param batch_size: количество строк, читаемых из БД за одно обращение (для csv - периодичность вызова progress)
+    :param execute_options: параметры выполнения запроса (timeout, cancel)
+    :return: количество записанных строк
+    """
+    if format == 'csv':
+        return export_csv(sample_meta, params, options, db_settings, fileobj, progress=progress,
+                          progress_every=batch_size, **execute_options)
+    if format == 'ndjson':
+        return write_ndjson(sample_meta, params, options, db_settings, fileobj, batch_size, progress,
+                            **execute_options)
+    if format == 'arrow':
+        from .arrow import write_arrow
+        return write_arrow(sample_meta, params, options, db_settings, fileobj, batch_size=batch_size,
+                           progress=progress, **execute_options)
+    raise ValueError(f"'format' must be in {OUTPUT_FORMATS}")
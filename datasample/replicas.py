@@ -0,0 +1,288 @@
+"""
+    Выбор реплики для чтения с учётом доступности, отставания и задержки
+
+ReplicaRouter выбирает для выполнения запроса СВД одну из реплик (read replica) основной БД:
+    - реплика периодически (не чаще check_interval секунд) проверяется запросом отставания репликации
+      в фоновом потоке: выбор реплики не ждёт проверок, до первой проверки реплика не выбирается;
+    - соединение и запрос проверки ограничены check_timeout секунд;
+    - недоступная реплика и реплика, отстающая больше max_lag секунд, не выбираются;
+    - из подходящих выбирается реплика с наименьшей сглаженной задержкой (EWMA с коэффициентом alpha),
+      реплика без замеров считается самой быстрой, чтобы получить первые замеры;
+    - если подходящих реплик нет (или запрос требует свежих данных) - основная БД (primary).
+Задержка замеряется при проверке реплики, при выполнении через ReplicaRouter.execute и по этапу execute
+выполнения СВД (см. datasample.instrumentation): ReplicaRouter - приёмник замеров, учитывающий замеры
+с меткой replica (имя реплики), поэтому СВД можно выполнять и напрямую на БД, выбранной choose.
+Реплика, на которой произошла ошибка соединения, исключается на failure_backoff секунд.
+ReplicaRouter.run и ReplicaRouter.iterate повторяют на основной БД запрос, соединение которого с репликой
+не удалось, поэтому отказ реплики не приводит к ошибке запроса.
+"""
+import random
+from math import ceil
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+from collections import namedtuple
+from typing import Callable, Iterator, Tuple, Union
+
+import psycopg2
+
+from .elements import Sample, CompiledSample
+from .engines import normalize_db_settings
+from .instrumentation import MetricsSink, labels, current_labels
+from .sqlalchemytools import execute
+
+__all__ = (
+    'PRIMARY',
+    'Route',
+    'ReplicaState',
+    'ReplicaRouter',
+)
+
+# Имя основной БД в маршрутах и метках замеров
+PRIMARY = 'primary'
+# Отставание реплики в секундах: 0, если реплика применила всё полученное (или это не реплика)
+LAG_SQL = ("select case when not pg_is_in_recovery() or pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+           "then 0 else coalesce(extract(epoch from now() - pg_last_xact_replay_timestamp()), 0) end")
+# Ошибки соединения (классы исключений psycopg2 и SQLAlchemy), после которых реплика исключается
+CONNECTION_ERRORS = ('OperationalError', 'InterfaceError')
+
+# Выбранная БД: имя реплики (или PRIMARY) и db_settings
+Route = namedtuple('Route', ('name', 'db_settings'))
+
+
+class ReplicaState:
+    """ Состояние реплики: результат последней проверки и сглаженная задержка """
+    __slots__ = ('db_settings', 'lag', 'latency', 'checked', 'down_until', 'checking', 'error')
+
+    def __init__(self, db_settings: dict):
+        self.db_settings = db_settings
+        self.lag = None  # отставание по последней проверке, секунд
+        self.latency = None  # EWMA задержки, секунд
+        self.checked = None  # когда проверена (по часам роутера)
+        self.down_until = None  # до какого момента исключена после ошибки
+        self.checking = False  # проверка выполняется в другом потоке
+        self.error = None  # последняя ошибка проверки
+
+
+class ReplicaRouter(MetricsSink):
+    """
+        Потокобезопасный выбор реплики для чтения в пределах процесса
+
+    :param primary: db_settings основной БД
+    :param replicas: реплики {имя: db_settings}
+    :param max_lag: допустимое отставание реплики, секунд
+    :param alpha: коэффициент сглаживания задержки (вес нового замера)
+    :param check_interval: как часто проверять реплику, секунд
+    :param check_timeout: ограничение времени соединения и запроса проверки, секунд
+    :param failure_backoff: на сколько секунд исключать реплику после ошибки соединения
+    """
+
+    def __init__(self, primary: dict, replicas: dict, max_lag: float = 30, alpha: float = 0.3,
+                 check_interval: float = 10, check_timeout: float = 2, failure_backoff: float = 30,
+                 clock=monotonic):
+        if not 0 < alpha <= 1:
+            raise ValueError("'alpha' must be in (0, 1].")
+        for name, value in (('max_lag', max_lag), ('check_interval', check_interval),
+                            ('check_timeout', check_timeout), ('failure_backoff', failure_backoff)):
+            if value < 0:
+                raise ValueError(f"'{name}' must not be negative.")
+        if PRIMARY in replicas:
+            raise ValueError(f"'{PRIMARY}' is reserved for primary database.")
+        self.primary = primary
+        self.max_lag = max_lag
+        self.alpha = alpha
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.failure_backoff = failure_backoff
+        self.clock = clock
+        self._lock = Lock()
+        self._replicas = {name: ReplicaState(db_settings) for name, db_settings in replicas.items()}
+        self._checks = dict()  # выполняющиеся проверки {имя: поток}
+
+    def _observe(self, state: ReplicaState, seconds: float) -> None:
+        state.latency = seconds if state.latency is None else self.alpha * seconds + (1 - self.alpha) * state.latency
+
+    def observe(self, name: str, seconds: float, error: str = None) -> None:
+        """ Учесть замер задержки реплики name; error - имя класса исключения, если запрос завершился ошибкой """
+        with self._lock:
+            state = self._replicas.get(name)
+            if state is None:
+                return
+            if error in CONNECTION_ERRORS:
+                state.down_until = self.clock() + self.failure_backoff
+            elif error is None:
+                self._observe(state, seconds)
+
+    def record(self, span) -> None:
+        """ Приёмник замеров: этап execute с меткой replica """
+        if span.phase == 'execute' and 'replica' in span.labels:
+            self.observe(span.labels['replica'], span.duration, span.error)
+
+    def _probe(self, db_settings: dict) -> Tuple[float, float]:
+        """ Отставание реплики и время запроса проверки по отдельному соединению (без пула) с connect_timeout """
+        user, password, host, port, name, _ = normalize_db_settings(db_settings)
+        timeouts = dict()
+        if self.check_timeout:
+            # connect_timeout libpq - целое число секунд
+            timeouts = {'connect_timeout': max(1, ceil(self.check_timeout)),
+                        'options': f"-c statement_timeout={max(1, int(self.check_timeout * 1000))}"}
+        conn = psycopg2.connect(dbname=name, user=user or None, password=password or None, host=host or None,
+                                port=port, **timeouts)
+        try:
+            with conn.cursor() as cursor:
+                started = perf_counter()
+                cursor.execute(LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+                return lag, perf_counter() - started
+        finally:
+            conn.close()
+
+    def check(self, name: str) -> None:
+        """ Проверить реплику: доступность, отставание и задержку запроса проверки """
+        state = self._replicas[name]
+        lag, duration, error = None, None, None
+        try:
+            lag, duration = self._probe(state.db_settings)
+        except Exception as e:
+            error = e
+        with self._lock:
+            state.checked = self.clock()
+            state.checking = False
+            state.error = None if error is None else f"{type(error).__name__}: {error}"
+            state.lag = lag
+            if error is None:
+                state.down_until = None
+                self._observe(state, duration)
+            else:
+                state.down_until = state.checked + self.failure_backoff
+
+    def _check(self, name: str) -> None:
+        try:
+            self.check(name)
+        finally:
+            with self._lock:
+                self._checks.pop(name, None)
+
+    def refresh(self, wait: bool = False) -> None:
+        """
+            Запустить просроченные проверки реплик в фоновых потоках
+
+        Каждую реплику проверяет один поток, проверки разных реплик выполняются параллельно.
+        :param wait: дождаться окончания всех выполняющихся проверок
+        """
+        now = self.clock()
+        with self._lock:
+            for name, state in self._replicas.items():
+                if not state.checking and (state.checked is None or now - state.checked >= self.check_interval) \
+                        and (state.down_until is None or state.down_until <= now):
+                    state.checking = True
+                    self._checks[name] = Thread(target=self._check, args=(name,), daemon=True,
+                                                name=f"datasample-replica-{name}")
+                    self._checks[name].start()
+            checks = list(self._checks.values())
+        if wait:
+            for thread in checks:
+                thread.join()
+
+    def _available(self, state: ReplicaState, now: float) -> bool:
+        return state.lag is not None and state.lag <= self.max_lag and \
+               (state.down_until is None or state.down_until <= now)
+
+    def choose(self, primary: bool = False) -> Route:
+        """
+            Выбрать БД для чтения
+
+        Просроченные проверки реплик запускаются в фоне (см. refresh), выбор использует результат
+        предыдущей проверки.
+        :param primary: запрос требует свежих данных - только основная БД
+        """
+        if primary or not self._replicas:
+            return Route(PRIMARY, self.primary)
+        self.refresh()
+        now = self.clock()
+        with self._lock:
+            candidates = [(state.latency or 0.0, random.random(), name)
+                          for name, state in self._replicas.items() if self._available(state, now)]
+            if not candidates:
+                return Route(PRIMARY, self.primary)
+            name = min(candidates)[2]
+            return Route(name, self._replicas[name].db_settings)
+
+    def _failover(self, route: Route, error: Exception, started: float) -> bool:
+        """ Учесть ошибку запроса на route; True - запрос следует повторить на основной БД """
+        if route.name == PRIMARY:
+            return False
+        self.observe(route.name, perf_counter() - started, type(error).__name__)
+        return type(error).__name__ in CONNECTION_ERRORS
+
+    def run(self, function: Callable[[Route], object], primary: bool = False):
+        """
+            Выполнить function(route) на выбранной БД
+
+        При ошибке соединения с репликой вызов повторяется на основной БД, поэтому function должна
+        допускать повторный вызов (например, начинать запись результата заново).
+        :param primary: запрос требует свежих данных - только основная БД
+        """
+        route = self.choose(primary)
+        started = perf_counter()
+        try:
+            return function(route)
+        except Exception as e:
+            if not self._failover(route, e, started):
+                raise
+        return function(Route(PRIMARY, self.primary))
+
+    def iterate(self, function: Callable[[Route], Iterator], primary: bool = False) -> Iterator:
+        """
+            Итератор function(route) на выбранной БД
+
+        function вызывается сразу (ошибки валидации - как при прямом вызове), а при ошибке соединения
+        с репликой до получения первого элемента итерация начинается заново на основной БД.
+        Ошибку после выдачи первого элемента повторить нельзя: она передаётся получателю.
+        """
+        route = self.choose(primary)
+        started = perf_counter()
+        items = function(route)
+        # Генератор выполняется вне блока labels вызывающего кода
+        outer = current_labels()
+
+        def generator():
+            nonlocal items
+            try:
+                first = next(items)
+            except StopIteration:
+                return
+            except Exception as e:
+                if not self._failover(route, e, started):
+                    raise
+                with labels(**outer):
+                    items = function(Route(PRIMARY, self.primary))
+            else:
+                yield first
+            yield from items
+
+        return generator()
+
+    def execute(self, sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                primary: bool = False, **kwargs):
+        """
+            Выполнить запрос (см. datasample.execute) на выбранной БД
+
+        Задержка замеряется здесь же, поэтому роутер не обязательно устанавливать приёмником замеров.
+        При ошибке соединения с репликой запрос повторяется на основной БД.
+        """
+        def run(route: Route):
+            started = perf_counter()
+            rows = execute(sample_meta, params, options, route.db_settings, **kwargs)
+            self.observe(route.name, perf_counter() - started)
+            return rows
+
+        return self.run(run, primary)
+
+    @property
+    def stats(self) -> dict:
+        """ Состояние реплик: {имя: {available, lag, latency, error}} """
+        now = self.clock()
+        with self._lock:
+            return {name: {'available': self._available(state, now), 'lag': state.lag,
+                           'latency': state.latency, 'error': state.error}
+                    for name, state in self._replicas.items()}
@@ -0,0 +1,245 @@
+"""
+    Предагрегаты (rollup) СВД для частых сочетаний группировки и агрегатов
+
+Предагрегат - таблица в БД с результатом группировки СВД по набору ключевых полей (keys)
+с агрегатами вычисляемых полей (measures): для каждого поля <поле>__sum, <поле>__min, <поле>__max
+и <поле>__count (количество непустых значений), поэтому avg вычисляется как сумма сумм,
+делённая на сумму количеств, и остаётся точным при повторной группировке.
+
+Запрос с группировкой переводится compose на наименьший (по количеству строк) предагрегат, если:
+    - поля группировки, фильтров и невычисляемые поля выборки входят в keys;
+    - вычисляемые поля выборки, отсевов (having) и сортировки агрегируются sum, min, max или avg
+      и входят в measures.
+Иначе запрос выполняется по исходным подзапросам таблиц. Предагрегаты передаются в compose
+вместе со скомпилированной СВД (with_rollups). Подзапросы таблиц предагрегата не должны иметь параметров.
+
+Объявление предагрегата (check_rollups):
+    name        - имя предагрегата
+    keys        - ключевые поля
+    measures    - вычисляемые поля
+    incremental - ключевое поле с монотонно растущими непустыми значениями (например, дата), необязательно:
+                  при обновлении пересчитываются только группы, где оно не меньше наибольшего
+                  значения в предагрегате, остальные группы считаются неизменными
+"""
+from collections import namedtuple
+from typing import Iterable, Sequence, Union
+from sqlalchemy.sql import text
+
+from .elements import AGGREGATES, Sample, CompiledSample, compile_sample
+from .engines import get_engine
+
+__all__ = (
+    'ROLLUP_ALIAS',
+    'Rollup',
+    'check_rollups',
+    'rollup_sql',
+    'with_rollups',
+    'match_rollup',
+    'rollup_identifier',
+    'rollup_aggregate',
+    'create_rollup',
+    'refresh_rollup',
+    'drop_rollups',
+    'find_rollups',
+)
+
+# Алиас таблицы предагрегата в запросе compose
+ROLLUP_ALIAS = '_rollup'
+# Агрегаты колонок предагрегата для каждого вычисляемого поля: <поле>__<агрегат>
+ROLLUP_COLUMNS = ('sum', 'min', 'max', 'count')
+
+# Построенный предагрегат: table - имя таблицы, keys, measures - кортежи имён полей, rows - количество строк
+Rollup = namedtuple('Rollup', ('table', 'keys', 'measures', 'rows'))
+
+
+def check_rollups(rollups: list, sample_meta: Union[dict, Sample, CompiledSample]) -> list:
+    """ Проверить объявления предагрегатов СВД и вернуть их копию """
+    if not isinstance(rollups or [], list):
+        raise ValueError("'rollups' must be list.")
+    sample = compile_sample(sample_meta)
+    checked = []
+    names = set()
+    for rollup in rollups or []:
+        if not isinstance(rollup, dict):
+            raise ValueError("rollup must be dict.")
+        rollup = dict(rollup)
+        unknown = set(rollup) - {'name', 'keys', 'measures', 'incremental'}
+        if unknown:
+            raise ValueError(f"Неизвестные параметры предагрегата: {unknown}")
+        name = rollup.get('name')
+        if not isinstance(name, str) or not name.isidentifier() or name in names:
+            raise ValueError(f"rollup name {repr(name)} must be unique identifier.")
+        names.add(name)
+        keys, measures = rollup.get('keys', []), rollup.get('measures', [])
+        if not keys or not isinstance(keys, list):
+            raise ValueError(f"rollup '{name}': 'keys' must be not empty list of key fields.")
+        if not isinstance(measures, list):
+            raise ValueError(f"rollup '{name}': 'measures' must be list of calc fields.")
+        for field_name in keys:
+            if not sample.fields.get(field_name, {}).get('key'):
+                raise ValueError(f"rollup '{name}': '{field_name}' is not key field.")
+        for field_name in measures:
+            if not sample.fields.get(field_name, {}).get('calc'):
+                raise ValueError(f"rollup '{name}': '{field_name}' is not calc field.")
+        if rollup.get('incremental') is not None and rollup['incremental'] not in keys:
+            raise ValueError(f"rollup '{name}': 'incremental' must be one of 'keys'.")
+        for alias in {sample.fields[field_name]['table'] for field_name in (*keys, *measures)}:
+            if text(sample.tables[alias])._bindparams:
+                raise ValueError(f"rollup '{name}': table '{alias}' uses params.")
+        checked.append(rollup)
+    return checked
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def rollup_sql(sample_meta: Union[dict, Sample, CompiledSample], keys: Sequence[str], measures: Sequence[str],
+               incremental: str = None) -> str:
+    """
+        Запрос построения предагрегата
+
+    С incremental - только группы, в которых значение поля incremental не меньше параметра watermark
+    (запрос в paramstyle pyformat).
+    """
+    sample = compile_sample(sample_meta)
+    identifiers = {name: sample.sql_identifiers[sample.field_index[name]] for name in (*keys, *measures)}
+    columns = [f"{identifiers[name]} AS {_quote(name)}" for name in keys]
+    for name in measures:
+        columns.extend(f"{aggregate}({identifiers[name]}) AS {_quote(f'{name}__{aggregate}')}"
+                       for aggregate in ROLLUP_COLUMNS)
+    sql = f"SELECT {', '.join(columns)}\nFROM {sample.sql_tables((*keys, *measures))}"
+    if incremental:
+        # Запрос выполняется с параметром watermark - знаки % подзапросов экранируются для DBAPI
+        sql = f"{sql.replace('%', '%%')}\nWHERE {identifiers[incremental]} >= %(watermark)s"
+    return f"{sql}\nGROUP BY {', '.join(identifiers[name] for name in keys)}"
+
+
+def with_rollups(sample_meta: Union[dict, Sample, CompiledSample], rollups: Iterable[Rollup]) -> CompiledSample:
+    """ Скомпилированная СВД с предагрегатами, на которые compose переводит подходящие запросы """
+    sample = compile_sample(sample_meta)
+    return CompiledSample(Sample(sample.state), tuple(rollups))
+
+
+def match_rollup(sample: CompiledSample, options: dict):
+    """ Наименьший предагрегат СВД, которым можно ответить на запрос с настройками options, или None """
+    if 'group' not in options or not sample.rollups:
+        return None
+    operations = {field_name: operation for field_name, operation in options['fields']}
+    keys = {*options['group'], *(field for field, *_ in options.get('filters', []))}
+    keys.update(field_name for field_name, operation in operations.items() if not operation)
+    measures = set()
+    for field_name in (*operations, *(field for field, *_ in options.get('having', [])),
+                       *(field for field, _ in options.get('order', []))):
+        if sample.fields[field_name].get('calc'):
+            if operations.get(field_name) not in AGGREGATES:
+                return None
+            measures.add(field_name)
+        else:
+            keys.add(field_name)
+    candidates = [rollup for rollup in sample.rollups
+                  if keys <= set(rollup.keys) and measures <= set(rollup.measures)]
+    return min(candidates, key=lambda rollup: (rollup.rows, len(rollup.keys)), default=None)
+
+
+def rollup_identifier(field_name: str) -> str:
+    """ Идентификатор ключевого поля в таблице предагрегата """
+    return f'{_quote(ROLLUP_ALIAS)}.{_quote(field_name)}'
+
+
+def rollup_aggregate(field_name: str, operation: str) -> str:
+    """ Повторная агрегация вычисляемого поля по колонкам предагрегата """
+    if operation == 'avg':
+        total, count = _rollup_column(field_name, 'sum'), _rollup_column(field_name, 'count')
+        return f'(sum({total})::numeric / nullif(sum({count}), 0))'
+    return f'{operation}({_rollup_column(field_name, operation)})'
+
+
+def _rollup_column(field_name: str, aggregate: str) -> str:
+    return f'{_quote(ROLLUP_ALIAS)}.{_quote(f"{field_name}__{aggregate}")}'
+
+
+def _analyze(cursor, table: str) -> int:
+    """ Собрать статистику таблицы предагрегата, возвращает количество строк """
+    cursor.execute(f"ANALYZE {_quote(table)}")
+    cursor.execute(f"SELECT count(*) FROM {_quote(table)}")
+    return cursor.fetchone()[0]
+
+
+def create_rollup(sample_meta: Union[dict, Sample, CompiledSample], table: str, keys: Sequence[str],
+                  measures: Sequence[str], db_settings: dict) -> int:
+    """ Создать (пересоздать) таблицу предагрегата, возвращает количество строк """
+    sql = rollup_sql(sample_meta, keys, measures)
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+            cursor.execute(f"CREATE TABLE {_quote(table)} AS {sql}")
+            cursor.execute(f"CREATE INDEX ON {_quote(table)} ({', '.join(map(_quote, keys))})")
+            rows = _analyze(cursor, table)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return rows
+
+
+def refresh_rollup(sample_meta: Union[dict, Sample, CompiledSample], table: str, keys: Sequence[str],
+                   measures: Sequence[str], db_settings: dict, incremental: str = None) -> int:
+    """
+        Обновить таблицу предагрегата в одной транзакции, возвращает количество строк
+
+    С incremental пересчитываются группы, начиная с наибольшего значения поля incremental в предагрегате,
+    иначе (или если предагрегат пуст) - все группы.
+    """
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            watermark = None
+            if incremental:
+                cursor.execute(f"SELECT max({_quote(incremental)}) FROM {_quote(table)}")
+                watermark = cursor.fetchone()[0]
+            if watermark is None:
+                cursor.execute(f"DELETE FROM {_quote(table)}")
+                cursor.execute(f"INSERT INTO {_quote(table)} {rollup_sql(sample_meta, keys, measures)}")
+            else:
+                cursor.execute(f"DELETE FROM {_quote(table)} WHERE {_quote(incremental)} >= %(watermark)s",
+                               {'watermark': watermark})
+                cursor.execute(f"INSERT INTO {_quote(table)} {rollup_sql(sample_meta, keys, measures, incremental)}",
+                               {'watermark': watermark})
+            rows = _analyze(cursor, table)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return rows
+
+
+def drop_rollups(tables: Iterable[str], db_settings: dict) -> None:
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def find_rollups(prefix: str, db_settings: dict) -> list:
+    """ Имена таблиц из search_path, начинающиеся с prefix """
+    conn = get_engine(db_settings).raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("select tablename from pg_tables "
+                           "where schemaname = any(current_schemas(false)) and left(tablename, %s) = %s "
+                           "order by tablename", (len(prefix), prefix))
+            names = [name for name, in cursor.fetchall()]
+        conn.rollback()
+    finally:
+        conn.close()
+    return names
@@ -0,0 +1,198 @@
+"""
+    Планировщик выполнения запросов СВД (admission control)
+
+Ограничивает количество одновременно выполняемых запросов - всего, по СВД и по пользователю,
+чтобы нагрузка на PostgreSQL оставалась в пределах его пропускной способности.
+Запросы сверх ограничений ждут в ограниченной очереди с приоритетами:
+интерактивные запросы выполняются раньше выгрузок. Запрос, не дождавшийся
+выполнения за queue_timeout секунд, или не поместившийся в очередь, - SampleOverloadError.
+Ограничения действуют в пределах процесса: при N процессах (например, воркерах gunicorn или uwsgi)
+к PostgreSQL одновременно обращаются до N * max_concurrent запросов, поэтому ограничения
+рассчитываются на процесс, исходя из количества процессов.
+"""
+import heapq
+from time import monotonic
+from itertools import count
+from threading import Condition
+from collections import Counter
+from contextlib import contextmanager
+
+from .execution import SampleOverloadError
+from .sqlalchemytools import execute
+
+__all__ = (
+    'PRIORITIES',
+    'Ticket',
+    'ExecutionScheduler',
+)
+
+# Приоритеты запросов: меньше - раньше
+PRIORITIES = {
+    'interactive': 0,
+    'export': 1,
+}
+
+
+class Ticket:
+    """ Место запроса в очереди планировщика """
+    __slots__ = ('sample', 'user', 'priority', 'granted')
+
+    def __init__(self, sample, user, priority: str):
+        self.sample = sample
+        self.user = user
+        self.priority = priority
+        self.granted = False
+
+
+class ExecutionScheduler:
+    """
+        Потокобезопасный планировщик выполнения запросов в пределах процесса
+
+    :param max_concurrent: сколько запросов выполняется одновременно
+    :param per_sample: сколько запросов одной СВД выполняется одновременно (None - без ограничения)
+    :param per_user: сколько запросов одного пользователя выполняется одновременно (None - без ограничения)
+    :param max_queue: сколько запросов может ждать выполнения
+    :param queue_timeout: сколько секунд запрос ждёт выполнения
+    """
+
+    def __init__(self, max_concurrent: int = 8, per_sample: int = None, per_user: int = None,
+                 max_queue: int = 100, queue_timeout: float = 30, clock=monotonic):
+        for name, value in (('max_concurrent', max_concurrent), ('per_sample', per_sample), ('per_user', per_user)):
+            if value is not None and value < 1:
+                raise ValueError(f"'{name}' must be positive.")
+        self.max_concurrent = max_concurrent
+        self.per_sample = per_sample
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self._cond = Condition()
+        self._queue = []  # heap (приоритет, порядковый номер, Ticket)
+        self._seq = count()
+        self._running = 0
+        self._running_samples = Counter()
+        self._running_users = Counter()
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def stats(self) -> dict:
+        """ Метрики: выполняется, глубина очереди, принято/отклонено/не дождались, время ожидания в очереди """
+        with self._cond:
+            return {
+                'running': self._running,
+                'queue_depth': len(self._queue),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+            }
+
+    def _can_run(self, ticket: Ticket) -> bool:
+        return (
+            self._running < self.max_concurrent
+            and (self.per_sample is None or ticket.sample is None
+                 or self._running_samples[ticket.sample] < self.per_sample)
+            and (self.per_user is None or ticket.user is None
+                 or self._running_users[ticket.user] < self.per_user)
+        )
+
+    def _dispatch(self) -> None:
+        """ Запустить ожидающие запросы в порядке приоритета, насколько позволяют ограничения """
+        if not self._queue:
+            return
+        waiting = []
+        for entry in sorted(self._queue):
+            ticket = entry[2]
+            # Запрос, упёршийся в ограничение СВД или пользователя, не задерживает остальные
+            if self._can_run(ticket):
+                self._grant(ticket)
+            else:
+                waiting.append(entry)
+        if len(waiting) != len(self._queue):
+            self._queue = waiting
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def _grant(self, ticket: Ticket) -> None:
+        ticket.granted = True
+        self._running += 1
+        if ticket.sample is not None:
+            self._running_samples[ticket.sample] += 1
+        if ticket.user is not None:
+            self._running_users[ticket.user] += 1
+        self.admitted += 1
+
+    def acquire(self, sample=None, user=None, priority: str = 'interactive', timeout: float = None) -> Ticket:
+        """
+            Дождаться разрешения на выполнение запроса
+
+        :param sample: идентификатор СВД (например, имя)
+        :param user: идентификатор пользователя
+        :param priority: один из PRIORITIES
+        :param timeout: сколько секунд ждать (по-умолчанию - queue_timeout)
+        :return: Ticket, который необходимо вернуть через release
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"'priority' must be in {tuple(PRIORITIES)}")
+        ticket = Ticket(sample, user, priority)
+        started = self.clock()
+        deadline = started + (self.queue_timeout if timeout is None else timeout)
+        with self._cond:
+            if not self._queue and self._can_run(ticket):
+                self._grant(ticket)
+                return ticket
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise SampleOverloadError("Очередь выполнения запросов заполнена")
+            entry = (PRIORITIES[priority], next(self._seq), ticket)
+            heapq.heappush(self._queue, entry)
+            self._dispatch()
+            while not ticket.granted:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self.timeouts += 1
+                    raise SampleOverloadError("Запрос не дождался выполнения в очереди")
+                self._cond.wait(remaining)
+            waited = self.clock() - started
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """ Запрос выполнен: освободить место для ожидающих """
+        with self._cond:
+            if not ticket.granted:
+                return
+            ticket.granted = False
+            self._running -= 1
+            if ticket.sample is not None:
+                self._running_samples[ticket.sample] -= 1
+                if not self._running_samples[ticket.sample]:
+                    del self._running_samples[ticket.sample]
+            if ticket.user is not None:
+                self._running_users[ticket.user] -= 1
+                if not self._running_users[ticket.user]:
+                    del self._running_users[ticket.user]
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, sample=None, user=None, priority: str = 'interactive', timeout: float = None):
+        """ Выполнение блока кода с разрешения планировщика (см. acquire) """
+        ticket = self.acquire(sample, user, priority, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def execute(self, sample_meta, params: dict, options: dict, db_settings: dict,
+                sample=None, user=None, priority: str = 'interactive', **execute_options):
+        """ Выполнить СВД (см. datasample.execute) с разрешения планировщика """
+        with self.slot(sample, user, priority):
+            return execute(sample_meta, params, options, db_settings, **execute_options)
@@ -0,0 +1,356 @@
+"""
+    Выполнение СВД на нескольких БД с одинаковой схемой (шардах) с объединением результата
+
+Запрос выполняется на всех шардах параллельно (каждый шард - в своём потоке и пуле соединений):
+    - запрос без агрегатов выполняется на шардах как есть (с сортировкой, limit и keyset-курсором after),
+      результаты сливаются с учётом сортировки order (merge отсортированных последовательностей)
+      и обрезаются до limit;
+    - запрос с агрегатами на шардах выполняется как частичная группировка по полям group:
+      sum, min и max полей и для avg - sum и count, затем группы шардов объединяются
+      (сумма сумм, минимум минимумов, avg = сумма сумм / сумма количеств),
+      после чего применяются having, after, order и limit;
+      avg вычисляется с тем же количеством знаков после запятой, что и avg PostgreSQL.
+Строки шардов сравниваются в Python, порядок строк которого не совпадает с правилами сортировки
+(collation) БД, поэтому сортировка по текстовым полям и min/max текстовых полей на шардах не поддерживаются.
+
+Длительность и количество строк по каждому шарду возвращаются в ShardTiming
+и передаются в замеры (datasample.instrumentation) с меткой shard.
+"""
+from decimal import Decimal
+from functools import cmp_to_key
+from heapq import merge
+from itertools import islice
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import perf_counter
+from typing import Sequence, Union
+from sqlalchemy.sql import text, select
+
+from .elements import Sample, CompiledSample, SampleElementError, compile_sample
+from .engines import get_engine
+from .execution import CancelHandle, SampleCancelledError, guarded
+from .instrumentation import current_labels, span
+from .sqlalchemytools import compose
+from .validators import check_params, check_options
+
+__all__ = (
+    'ShardTiming',
+    'ShardedResult',
+    'shard_name',
+    'execute_shards',
+    'merge_rows',
+    'merge_groups',
+)
+
+# Выполнение запроса на шарде: номер шарда, имя БД, длительность в секундах, строк, имя класса исключения
+ShardTiming = namedtuple('ShardTiming', ('shard', 'database', 'duration', 'rows', 'error'))
+# Объединённый результат: строки и замеры по шардам
+ShardedResult = namedtuple('ShardedResult', ('rows', 'timings'))
+
+# Алиас подзапроса в запросе частичной группировки
+SHARD_ALIAS = '_shard'
+# Как часто проверяется отмена запроса, пока шарды выполняются, секунд
+CANCEL_POLL = 0.1
+# Агрегаты частичной группировки, по которым вычисляется агрегат поля
+PARTIAL_AGGREGATES = {'sum': ('sum',), 'min': ('min',), 'max': ('max',), 'avg': ('sum', 'count')}
+# Типы полей, значения которых сравниваются по правилам сортировки БД
+COLLATED_CTYPES = ('String',)
+# Наименьшее количество значащих цифр частного numeric в PostgreSQL (NUMERIC_MIN_SIG_DIGITS)
+NUMERIC_MIN_SIG_DIGITS = 16
+
+
+def shard_name(db_settings: dict) -> str:
+    """ Имя шарда для замеров и сообщений: host:port/name """
+    return f"{db_settings.get('HOST') or ''}:{db_settings.get('PORT') or 5432}/{db_settings.get('NAME') or ''}"
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _compare(left, right) -> int:
+    """ Сравнение значений как в PostgreSQL по-умолчанию: NULL больше любого значения """
+    if left is None or right is None:
+        return (left is None) - (right is None)
+    return (left > right) - (left < right)
+
+
+def _row_comparator(positions: Sequence[int], directions: Sequence[str]):
+    def compare(left, right) -> int:
+        for position, direct in zip(positions, directions):
+            result = _compare(left[position], right[position])
+            if result:
+                return -result if direct == 'desc' else result
+        return 0
+    return compare
+
+
+def _matches(value, operation: str, args: Sequence) -> bool:
+    """ Проверка значения операцией фильтра (NULL не удовлетворяет сравнениям, как в SQL) """
+    if operation == 'is null':
+        return value is None
+    if operation == 'is not null':
+        return value is not None
+    if value is None:
+        return False
+    if operation == 'in':
+        return value in args
+    if operation == 'not in':
+        return value not in args
+    if operation == 'between':
+        return args[0] <= value <= args[1]
+    if operation == 'not between':
+        return not args[0] <= value <= args[1]
+    return {
+        '=': value == args[0], '!=': value != args[0],
+        '<': value < args[0], '<=': value <= args[0], '>': value > args[0], '>=': value >= args[0],
+    }[operation]
+
+
+def _output_fields(sample: CompiledSample, options: dict, aggregated: bool) -> list:
+    """ Поля результата шарда: поля выборки и поля сортировки, которых нет среди них (удаляются после слияния) """
+    fields = [[field_name, operation] for field_name, operation in options['fields']]
+    for field_name, operation in fields:
+        if operation in ('min', 'max') and sample.fields[field_name]['ctype'] in COLLATED_CTYPES:
+            raise SampleElementError({
+                'options[fields]': [f"при выполнении на шардах {operation} текстового поля '{field_name}' "
+                                    f"не поддерживается"],
+            })
+    selected = {field_name for field_name, _ in fields}
+    for field_name, _ in options.get('order', []):
+        if sample.fields[field_name]['ctype'] in COLLATED_CTYPES:
+            raise SampleElementError({
+                'options[order]': [f"при выполнении на шардах сортировка по текстовому полю '{field_name}' "
+                                   f"не поддерживается"],
+            })
+        if field_name not in selected:
+            if aggregated and sample.fields[field_name].get('calc'):
+                raise SampleElementError({
+                    'options[order]': [f"при выполнении на шардах поле '{field_name}' должно входить в 'fields'"],
+                })
+            fields.append([field_name, None])
+            selected.add(field_name)
+    return fields
+
+
+def _partial_query(sample: CompiledSample, params: dict, options: dict, fields: list):
+    """ Запрос частичной группировки: группировка результата запроса без агрегатов по полям group """
+    group = list(options.get('group', []))
+    for field_name, operation in fields:
+        if not operation and field_name not in group:
+            raise SampleElementError({
+                'options[group]': [f"при выполнении на шардах поле '{field_name}' должно входить в 'group'"],
+            })
+    for field_name, *_ in options.get('having', []):
+        if not dict(fields).get(field_name):
+            raise SampleElementError({
+                'options[having]': [f"при выполнении на шардах поле '{field_name}' должно входить в 'fields' "
+                                    f"с агрегатом"],
+            })
+    # Подзапрос без агрегатов с фильтрами исходного запроса
+    base_fields = list(dict.fromkeys([*(field_name for field_name, _ in options['fields']), *group, *dict(fields)]))
+    base_options = {'fields': [[field_name, None] for field_name in base_fields]}
+    if 'filters' in options:
+        base_options['filters'] = options['filters']
+    base, kwargs = compose(sample, params, base_options)
+    columns = [f'{SHARD_ALIAS}.{_quote(field_name)}' for field_name in group]
+    for field_name, operation in fields:
+        if operation:
+            columns.extend(f'{aggregate}({SHARD_ALIAS}.{_quote(field_name)}) '
+                           f'AS {_quote(f"{field_name}__{aggregate}")}'
+                           for aggregate in PARTIAL_AGGREGATES[operation])
+    query = select([text(column) for column in columns]).select_from(base.alias(SHARD_ALIAS))
+    if group:
+        query = query.group_by(text(', '.join(f'{SHARD_ALIAS}.{_quote(field_name)}' for field_name in group)))
+    return query, kwargs
+
+
+def _sum(values):
+    values = [value for value in values if value is not None]
+    return sum(values[1:], values[0]) if values else None
+
+
+def _extreme(values, function):
+    values = [value for value in values if value is not None]
+    return function(values) if values else None
+
+
+def _numeric_digit(value: Decimal) -> tuple:
+    """ Вес и значение первой ненулевой цифры numeric PostgreSQL (основание 10000), для нуля - (0, 0) """
+    if not value:
+        return 0, 0
+    weight = value.copy_abs().adjusted() // 4
+    return weight, int(value.copy_abs().scaleb(-4 * weight))
+
+
+def _average(total, count):
+    """
+        avg по сумме и количеству: для целых и numeric - с точностью numeric_div PostgreSQL
+
+    Количество знаков после запятой - как select_div_scale PostgreSQL: не меньше NUMERIC_MIN_SIG_DIGITS
+    значащих цифр частного и не меньше знаков после запятой суммы, округление половины - от нуля.
+    """
+    if total is None or not count:
+        return None
+    if isinstance(total, float):
+        return total / count
+    total = Decimal(total)
+    weight1, first1 = _numeric_digit(total)
+    weight2, first2 = _numeric_digit(Decimal(count))
+    scale = max(0, -total.as_tuple().exponent)
+    rscale = NUMERIC_MIN_SIG_DIGITS - (weight1 - weight2 - (first1 <= first2)) * 4
+    rscale = min(max(rscale, scale, 0), 1000)
+    # Частное в целых единицах rscale-го знака, без ограничения точности контекста Decimal
+    sign, digits, exponent = total.as_tuple()
+    quotient, remainder = divmod(int(''.join(map(str, digits))) * 10 ** (exponent + rscale), count)
+    if 2 * remainder >= count:
+        quotient += 1
+    return Decimal((sign if quotient else 0, tuple(map(int, str(quotient))), -rscale))
+
+
+def merge_groups(shard_rows: Sequence[Sequence], group: Sequence[str], fields: Sequence) -> list:
+    """
+        Объединить результаты частичной группировки шардов
+
+    :param shard_rows: строки запросов частичной группировки по шардам
+    :param group: поля группировки (первые колонки строк)
+    :param fields: поля результата [[имя, агрегат], ...]
+    :return: строки с колонками в порядке fields
+    """
+    groups = dict()
+    for rows in shard_rows:
+        for row in rows:
+            groups.setdefault(tuple(row[:len(group)]), []).append(row)
+    merged = []
+    for key, rows in groups.items():
+        values = dict(zip(group, key))
+        position = len(group)
+        row = []
+        for field_name, operation in fields:
+            if not operation:
+                row.append(values[field_name])
+                continue
+            partial = [[shard_row[position + i] for shard_row in rows]
+                       for i in range(len(PARTIAL_AGGREGATES[operation]))]
+            position += len(PARTIAL_AGGREGATES[operation])
+            if operation == 'sum':
+                row.append(_sum(partial[0]))
+            elif operation == 'min':
+                row.append(_extreme(partial[0], min))
+            elif operation == 'max':
+                row.append(_extreme(partial[0], max))
+            else:
+                row.append(_average(_sum(partial[0]), _sum(partial[1])))
+        merged.append(tuple(row))
+    return merged
+
+
+def merge_rows(shard_rows: Sequence[Sequence], options: dict, fields: Sequence, aggregated: bool = False) -> list:
+    """
+        Объединить результаты шардов с учётом having, after, order и limit
+
+    :param shard_rows: строки шардов (для запроса без агрегатов - уже отсортированные по order)
+    :param options: настройки выборки
+    :param fields: поля строк [[имя, агрегат], ...] (options['fields'] и добавленные поля сортировки)
+    :param aggregated: строки - объединённые группы (having, after и order применяются здесь)
+    """
+    # Позиции полей в строке (для повторяющегося поля - последняя, как в compose)
+    positions = {field_name: position for position, (field_name, _) in enumerate(fields)}
+    order = options.get('order', [])
+    compare = _row_comparator([positions[field_name] for field_name, _ in order], [direct for _, direct in order])
+    if aggregated:
+        rows = shard_rows[0] if shard_rows else []
+        for field_name, operation, args in options.get('having', []):
+            rows = [row for row in rows if _matches(row[positions[field_name]], operation, args)]
+        if 'after' in options:
+            after = [None] * len(fields)
+            for (field_name, _), value in zip(order, options['after']):
+                after[positions[field_name]] = value
+            rows = [row for row in rows if compare(row, after) > 0]
+        rows = sorted(rows, key=cmp_to_key(compare)) if order else rows
+    elif order:
+        rows = merge(*shard_rows, key=cmp_to_key(compare))
+    else:
+        rows = (row for rows in shard_rows for row in rows)
+    rows = list(islice(rows, options['limit']) if 'limit' in options else rows)
+    width = len(options['fields'])
+    return rows if width == len(fields) else [tuple(row[:width]) for row in rows]
+
+
+def _execute_shard(shard: int, db_settings: dict, query, kwargs: dict, timeout: float, cancel: CancelHandle,
+                   labels: dict) -> tuple:
+    labels = {**labels, 'shard': shard_name(db_settings)}
+    engine = get_engine(db_settings)
+    started = perf_counter()
+    rows, error = [], None
+    try:
+        with engine.connect() as conn, guarded(engine, conn.connection, timeout, cancel):
+            with span('execute', labels):
+                result = conn.execute(query, **kwargs)
+            with span('fetch', labels) as fetch_span:
+                rows = result.fetchall()
+                fetch_span.add(rows=len(rows))
+    except Exception as e:
+        error = e
+    timing = ShardTiming(shard, shard_name(db_settings), perf_counter() - started, len(rows),
+                         type(error).__name__ if error is not None else None)
+    return rows, timing, error
+
+
+def execute_shards(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+                   shards: Sequence[dict], timeout: float = None, cancel: CancelHandle = None) -> ShardedResult:
+    """
+        Выполнить запрос на шардах параллельно и объединить результаты
+
+    Если запрос на одном из шардов завершился ошибкой, запросы на остальных шардах отменяются
+    и исключение шарда передаётся вызывающему.
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param shards: список db_settings шардов
+    :param timeout: ограничение времени выполнения запроса на каждом шарде в секундах
+    :param cancel: объект datasample.CancelHandle для отмены запросов на всех шардах
+    :return: ShardedResult(строки, замеры по шардам)
+    """
+    if not shards:
+        raise ValueError("'shards' must be not empty list of db_settings.")
+    sample = compile_sample(sample_meta)
+    check_params(params, sample)
+    check_options(options, sample)
+    # Группировка без агрегатов тоже объединяется по группам: иначе ключи групп шардов повторяются
+    aggregated = bool(options.get('group')) or any(operation for _, operation in options['fields'])
+    fields = _output_fields(sample, options, aggregated)
+    if aggregated:
+        query, kwargs = _partial_query(sample, params, options, fields)
+    else:
+        query, kwargs = compose(sample, params, {**options, 'fields': fields})
+
+    labels = current_labels()
+    # У каждого шарда свой объект отмены: общий cancel и ошибка шарда отменяют запросы на всех шардах
+    handles = [CancelHandle() for _ in shards]
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [pool.submit(_execute_shard, shard, db_settings, query, kwargs, timeout, handle, labels)
+                   for shard, (db_settings, handle) in enumerate(zip(shards, handles))]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL, return_when=FIRST_COMPLETED)
+            failed = any(future.result()[2] is not None for future in done)
+            if failed or (cancel is not None and cancel.cancelled):
+                for handle in handles:
+                    handle.cancel()
+                wait(pending)
+                break
+    results = [future.result() for future in futures]
+    timings = [timing for _, timing, _ in results]
+    if cancel is not None and cancel.cancelled:
+        raise SampleCancelledError("Выполнение запроса отменено")
+    errors = [error for _, _, error in results if error is not None]
+    if errors:
+        # Исходная ошибка шарда, а не отмена остальных шардов из-за неё
+        raise next((error for error in errors if not isinstance(error, SampleCancelledError)), errors[0])
+
+    shard_rows = [rows for rows, _, _ in results]
+    if aggregated:
+        shard_rows = [merge_groups(shard_rows, options.get('group', []), fields)]
+    return ShardedResult(merge_rows(shard_rows, options, fields, aggregated), timings)
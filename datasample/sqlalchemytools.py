@@ -1,44 +1,227 @@
 """
     Модуль преобразования СВД + значения параметров + Настройки в SQL
 """
-from typing import Sequence  # , List, Tuple, Dict, DefaultDict, Set, FrozenSet, Union
-from sqlalchemy import create_engine
-from sqlalchemy.sql import text, select
+from uuid import uuid4
+from collections import namedtuple
+from typing import Sequence, Tuple, Union  # , List, Dict, DefaultDict, Set, FrozenSet
+from psycopg2.extensions import register_type
+from sqlalchemy import Integer
+from sqlalchemy.sql import text, select, bindparam
 
-from .elements import Sample, Field, OPERATIONS_ARGS
+from .elements import Sample, CompiledSample, OPERATIONS_ARGS, SampleElementError, compile_sample
+from .engines import get_engine
+from .execution import CancelHandle, guarded
+from .instrumentation import current_labels, span, timed
+from .rollup import ROLLUP_ALIAS, match_rollup, rollup_identifier, rollup_aggregate
 from .validators import check_params, check_options
 
 __all__ = (
     'execute',
+    'execute_iter',
     'compose',
+    'next_cursor',
+    'compile_query',
+    'fetch_batches',
+    'PlanSummary',
+    'explain',
+    'options_shape',
 )
 
+# Оценка планировщика PostgreSQL для запроса: стоимость, количество строк, средняя ширина строки в байтах
+PlanSummary = namedtuple('PlanSummary', ('total_cost', 'rows', 'width'))
 
-def execute(sample_meta: dict, params: dict, options: dict, db_settings: dict):
+
+def execute(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+            db_settings: Union[dict, Sequence[dict]], result_format: str = 'rows', timeout: float = None,
+            cancel: CancelHandle = None, **format_options):
     """
         Выполнить запрос согласно параметризации
 
-    :param sample_meta: описатель схемы доступа к данным
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
     :param params: значения параметров согласно схемы
     :param options: значения настроек согласно схемы
-    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param db_settings: database connection settings like django.conf.settings.DATABASES,
+                        параметры пула соединений можно перекрыть в db_settings['POOL'];
+                        список db_settings - выполнить на шардах (см. datasample.shards.execute_shards)
+    :param result_format: 'rows' - список строк,
+                          'columnar' - словарь ИмяПоля:numpy.ndarray (см. datasample.columnar.execute_columnar),
+                          'arrow' - pyarrow.Table (см. datasample.arrow.execute_arrow)
+    :param timeout: ограничение времени выполнения запроса в секундах (SampleTimeoutError при превышении)
+    :param cancel: объект datasample.CancelHandle для отмены запроса из другого потока (SampleCancelledError)
+    :param format_options: дополнительные параметры формата результата
     :return:
     """
-    # db_settings = dbs if dbs else settings.DATABASES.get('default')
-    engine = create_engine(
-        f"postgresql:/"
-        f"/{db_settings.get('USER')}"
-        f":{db_settings.get('PASSWORD')}"  # f":{db_settings.get('PASSWORD')}" 
-        f"@{db_settings.get('HOST')}"
-        f":{db_settings.get('PORT') if db_settings.get('PORT') else '5432'}"
-        f"/{db_settings.get('NAME')}"
-    )
-    conn = engine.connect()
+    if isinstance(db_settings, (list, tuple)):
+        if result_format != 'rows':
+            raise ValueError("На шардах поддерживается только формат результата 'rows'")
+        from .shards import execute_shards
+        return execute_shards(sample_meta, params, options, db_settings, timeout=timeout, cancel=cancel).rows
+    if result_format == 'columnar':
+        from .columnar import execute_columnar
+        return execute_columnar(sample_meta, params, options, db_settings,
+                                timeout=timeout, cancel=cancel, **format_options)
+    if result_format == 'arrow':
+        from .arrow import execute_arrow
+        return execute_arrow(sample_meta, params, options, db_settings,
+                             timeout=timeout, cancel=cancel, **format_options)
+    if result_format != 'rows':
+        raise ValueError(f"Неизвестный формат результата {repr(result_format)}")
+    query, kwargs = compose(sample_meta, params, options)
+    engine = get_engine(db_settings)
+    # Соединение берётся из пула и возвращается в него сразу после выборки данных
+    with engine.connect() as conn, guarded(engine, conn.connection, timeout, cancel):
+        with span('execute'):
+            result = conn.execute(query, **kwargs)
+        with span('fetch') as fetch_span:
+            rows = result.fetchall()
+            fetch_span.add(rows=len(rows))
+        return rows
+
+
+def execute_iter(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict, db_settings: dict,
+                 batch_size: int = 1000, batches: bool = False, timeout: float = None, cancel: CancelHandle = None):
+    """
+        Выполнить запрос согласно параметризации и отдавать строки по мере чтения из БД
+
+    Выборка читается через именованный (server-side) курсор PostgreSQL порциями по batch_size строк,
+    поэтому потребление памяти не зависит от размера результата.
+    Валидация и компоновка запроса выполняются сразу при вызове, а не при первой итерации.
+
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
+    :param params: значения параметров согласно схемы
+    :param options: значения настроек согласно схемы
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param batch_size: количество строк, читаемых из курсора за одно обращение к БД
+    :param batches: отдавать порции строк (списки) вместо отдельных строк
+    :param timeout: ограничение времени выполнения каждого обращения к БД в секундах
+    :param cancel: объект datasample.CancelHandle для отмены запроса
+    :return: генератор строк или порций строк
+    """
+    if batch_size < 1:
+        raise ValueError("'batch_size' must be positive.")
+    query, kwargs = compose(sample_meta, params, options)
+    return _iter_rows(get_engine(db_settings), query, kwargs, batch_size, batches, timeout, cancel,
+                      current_labels())
+
+
+def _iter_rows(engine, query, kwargs: dict, batch_size: int, batches: bool, timeout: float, cancel: CancelHandle,
+               labels: dict):
+    # Курсор и соединение закрываются в finally в том числе тогда,
+    # когда потребитель прекратил итерацию досрочно (GeneratorExit при закрытии генератора)
+    with engine.connect() as conn, guarded(engine, conn.connection, timeout, cancel):
+        with span('execute', labels):
+            result = conn.execution_options(stream_results=True).execute(query, **kwargs)
+        # В fetch учитывается только время чтения из БД, без времени обработки строк потребителем
+        fetch_span = span('fetch', labels)
+        error = None
+        try:
+            while True:
+                with fetch_span.measure():
+                    rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                fetch_span.add(rows=len(rows))
+                if batches:
+                    yield rows
+                else:
+                    yield from rows
+        except Exception as e:
+            error = type(e)
+            raise
+        finally:
+            result.close()
+            fetch_span.finish(error)
+
+
+def fetch_batches(query, kwargs: dict, db_settings: dict, batch_size: int = 10000, typecasters: Sequence = (),
+                  timeout: float = None, cancel: CancelHandle = None):
+    """
+        Читать результат запроса compose порциями кортежей напрямую из именованного курсора psycopg2
+
+    В отличие от execute_iter строки не оборачиваются в объекты SQLAlchemy.
+
+    :param query: запрос, полученный из compose
+    :param kwargs: bindary variables, полученные из compose
+    :param db_settings: database connection settings like django.conf.settings.DATABASES
+    :param batch_size: количество строк, читаемых из курсора за одно обращение к БД
+    :param typecasters: преобразователи типов psycopg2 (psycopg2.extensions.new_type) только для этого курсора
+    :param timeout: ограничение времени выполнения каждого обращения к БД в секундах
+    :param cancel: объект datasample.CancelHandle для отмены запроса
+    :return: генератор списков кортежей
+    """
+    engine = get_engine(db_settings)
+    sql, binds = compile_query(query, kwargs, engine.dialect)
+    return _fetch_batches(engine, sql, binds, batch_size, typecasters, timeout, cancel, current_labels())
+
+
+def _fetch_batches(engine, sql: str, binds: dict, batch_size: int, typecasters: Sequence, timeout: float,
+                   cancel: CancelHandle, labels: dict):
+    conn = engine.raw_connection()
+    fetch_span = span('fetch', labels)
+    error = None
+    try:
+        with guarded(engine, conn, timeout, cancel), conn.cursor(name=f'datasample_{uuid4().hex}') as cursor:
+            for typecaster in typecasters:
+                register_type(typecaster, cursor)
+            cursor.itersize = batch_size
+            with span('execute', labels):
+                cursor.execute(sql, binds)
+            while True:
+                with fetch_span.measure():
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                fetch_span.add(rows=len(rows))
+                yield rows
+        conn.rollback()
+    except Exception as e:
+        error = type(e)
+        raise
+    finally:
+        conn.close()
+        fetch_span.finish(error)
+
+
+def explain(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict,
+            db_settings: dict) -> PlanSummary:
+    """
+        Оценить стоимость запроса планировщиком PostgreSQL (EXPLAIN без выполнения запроса)
+
+    Параметры - как у execute.
+    """
     query, kwargs = compose(sample_meta, params, options)
-    return conn.execute(query, **kwargs).fetchall()
+    engine = get_engine(db_settings)
+    sql, binds = compile_query(query, kwargs, engine.dialect)
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", binds)
+            plan = cursor.fetchone()[0][0]['Plan']
+        conn.rollback()
+    finally:
+        conn.close()
+    return PlanSummary(plan['Total Cost'], plan['Plan Rows'], plan['Plan Width'])
+
+
+def options_shape(options: dict) -> dict:
+    """
+        Форма настроек запроса: настройки без значений операндов фильтров и курсора страницы
+
+    Запросы одной формы имеют одинаковый план, поэтому оценку explain можно кэшировать по форме.
+    """
+    return {
+        'fields': options['fields'],
+        'group': options.get('group', []),
+        'order': options.get('order', []),
+        'filters': [[field_name, operation] for field_name, operation, *_ in options.get('filters', [])],
+        'having': [[field_name, operation] for field_name, operation, *_ in options.get('having', [])],
+        'after': 'after' in options,
+        'limit': options.get('limit'),
+    }
 
 
-def compose(sample_meta: dict, params: dict, options: dict):
+@timed('compose')
+def compose(sample_meta: Union[dict, Sample, CompiledSample], params: dict, options: dict):
     """ Компиляция схемы и настроек запроса
 
     для использования в sqlalchemy.sql.select
@@ -47,23 +230,28 @@ def compose(sample_meta: dict, params: dict, options: dict):
     (как Back-End так и Fron-End) для проверки в тестах
     корректности сочетания значений настроек и параметров с описанием схемы доступа к данным.
 
-    :param sample_meta: описатель схемы доступа к данным
+    :param sample_meta: описатель схемы доступа к данным, объект Sample или CompiledSample
     :param params: значения параметров согласно схемы
     :param options: значения настроек согласно схемы
     :return: tuple(
         query: str, - текст SQL-запроса с использованием bindary variables в нотации :BINDNAME
-        dict(<bind_name>: <bind_value>), - словарь bindary variables
+        dict(<bind_name>: <bind_value>), - словарь bindary variables: значения параметров
+                                           операндов фильтров/отсевов (_filter_<N>, _having_<N>)
+                                           курсора keyset-пагинации (_after_<N>) и LIMIT (_limit)
     )
     """
-    # Валидируем описание СВД
-    sample = Sample(sample_meta)
-    # Валидируем параметры на соответсвие СВД
-    check_params(params, sample)
-    # Валидируем настроки на соответствие СВД
-    check_options(options, sample)
+    with span('validate'):
+        # Валидируем описание СВД (скомпилированная СВД уже провалидирована)
+        sample = compile_sample(sample_meta)
+        # Валидируем параметры на соответсвие СВД
+        check_params(params, sample)
+        # Валидируем настроки на соответствие СВД
+        check_options(options, sample)
 
     # Поля для SQL-фразы SELECT
     column_fields = [name for name, *_ in options['fields']]
+    # Поля для SQL-фразы WHERE
+    filter_fields = [field for field, *_ in options['filters']] if 'filters' in options else []
     # Поля для SQL-фразы GROUP BY
     group_fields = options['group'] if 'group' in options else []
     # Поля для SQL-фразы HAVING
@@ -71,35 +259,54 @@ def compose(sample_meta: dict, params: dict, options: dict):
     # Поля для SQL-фразы ORDER BY
     order_fields = [field for field, *_ in options['order']] if 'order' in options else []
     # Все используемые поля
-    using_fields = {*column_fields, *group_fields, *having_fields, *order_fields}
+    using_fields = {*column_fields, *filter_fields, *group_fields, *having_fields, *order_fields}
 
-    fields = dict()  # Все используемые поля в словаре ИмяПоля:ЭлементПоля
-    for field_name in using_fields:
-        fields[field_name] = Field(field_name, **sample.fields)
+    # Готовые фрагменты SQL используемых полей в словарях ИмяПоля:ФрагментSQL
+    index = sample.field_index
+    aliases = {field_name: sample.sql_aliases[index[field_name]] for field_name in using_fields}
+    # Запрос с группировкой, который покрывает предагрегат СВД, выполняется по предагрегату
+    rollup = match_rollup(sample, options)
+    if rollup is None:
+        identifiers = {field_name: sample.sql_identifiers[index[field_name]] for field_name in using_fields}
+        columns = {field_name: sample.sql_columns[index[field_name]] for field_name in using_fields}
+        tables = sample.sql_tables(using_fields)
+
+        def aggregate(field_name: str, operation: str) -> str:
+            return f'{operation}({identifiers[field_name]})'
+    else:
+        identifiers = {field_name: rollup_identifier(field_name) for field_name in using_fields}
+        columns = {field_name: f'{identifiers[field_name]} AS {aliases[field_name]}' for field_name in using_fields}
+        tables = text(f'"{rollup.table}" AS "{ROLLUP_ALIAS}"')
+        aggregate = rollup_aggregate
 
     #
     # Сосавляем текст SQL-запроса
     #
     query = select([  # SELECT
         text(
-            f'{operation}({fields[field_name].sql_identifier}) AS {fields[field_name].sql_alias} ' if operation
-            else fields[field_name].sql_column
+            f'{aggregate(field_name, operation)} AS {aliases[field_name]} ' if operation
+            else columns[field_name]
         )
         for field_name, operation in options['fields'] if field_name in column_fields
     ]
     ).select_from(  # FROM
-        sample.sql_tables(using_fields)
+        tables
     )
 
+    # Значения операндов фильтров и отсевов передаются только через bindary variables,
+    # поэтому одинаковая по структуре настройка всегда даёт идентичный текст SQL-запроса
+    binds = dict()
+
     # WHERE
     if 'filters' in options:
         filters = []
-        for field_name, operation, args in options['filters']:
+        for i, (field_name, operation, args) in enumerate(options['filters']):
+            sql_args, op_binds = sql_op_binds(operation, args, f'_filter_{i}')
             filters.append(
-                f'{fields[field_name].sql_identifier} '
-                f'{operation} '
-                f'{sql_op_args(operation, args, fields[field_name].state["ctype"])}'
+                f'{identifiers[field_name]} '
+                f'{sql_args}'
             )
+            binds.update(op_binds)
         query = query.where(text(
             '\n  AND '.join(filters)
         ))
@@ -107,46 +314,118 @@ def compose(sample_meta: dict, params: dict, options: dict):
     # GROUP BY
     if 'group' in options:
         query = query.group_by(text(', '.join([
-            f'{fields[field_name].sql_identifier}'
+            f'{identifiers[field_name]}'
             for field_name in options['group']
         ])))
 
+    # Функции агрегации полей фразы SELECT
+    column_operations = {field_name: operation for field_name, operation in options['fields']}
+
     # HAVING
     if 'having' in options:
         havings = []
-        for field_name, operation, args in options['having']:
-            operation_for_column = options['fields'][column_fields.index('amount_11')][1]
+        for i, (field_name, operation, args) in enumerate(options['having']):
+            operation_for_column = column_operations.get(field_name)
             if operation_for_column:
-                having_identifier = f'{operation_for_column}({fields[field_name].sql_identifier})'
+                having_identifier = aggregate(field_name, operation_for_column)
             else:
-                having_identifier = fields[field_name].sql_identifier
+                having_identifier = identifiers[field_name]
+            sql_args, op_binds = sql_op_binds(operation, args, f'_having_{i}')
             havings.append(
                 f'{having_identifier} '
-                f'{operation} '
-                f'{sql_op_args(operation, args, fields[field_name].state["ctype"])}'
+                f'{sql_args}'
             )
+            binds.update(op_binds)
         query = query.having(text(
             '\n  AND '.join(havings)
         ))
 
+    # Keyset-пагинация: строки строго после курсора в порядке сортировки (WHERE (a, b) > (:a, :b)).
+    # Для запросов с группировкой условие накладывается в HAVING, так как может содержать агрегаты
+    if 'after' in options:
+        keys = []
+        for i, ((field_name, direct), value) in enumerate(zip(options['order'], options['after'])):
+            operation_for_column = column_operations.get(field_name)
+            keys.append(aggregate(field_name, operation_for_column) if operation_for_column
+                        else identifiers[field_name])
+            binds[f'_after_{i}'] = value
+        keyset = (f"({', '.join(keys)}) "
+                  f"{'<' if options['order'][0][1] == 'desc' else '>'} "
+                  f"({', '.join(f':_after_{i}' for i in range(len(keys)))})")
+        query = query.having(text(keyset)) if 'group' in options else query.where(text(keyset))
+
     # ORDER BY
     if 'order' in options:
         query = query.order_by(text(', '.join([
-            f'{fields[field_name].sql_alias} {direct}'
+            f'{aliases[field_name]} {direct}'
             for field_name, direct in options['order']
         ])))
 
-    kwargs = {**params}
+    # LIMIT (значение передаётся bindary variable, поэтому текст запроса от него не зависит)
+    if 'limit' in options:
+        query = query.limit(bindparam('_limit', type_=Integer))
+        binds['_limit'] = options['limit']
+
+    conflicts = binds.keys() & params.keys()
+    if conflicts:
+        raise SampleElementError({
+            'params': [f"имена параметров зарезервированы для операндов фильтров: {conflicts}"],
+        })
+    kwargs = {**params, **binds}
     return query, kwargs
 
 
-def sql_op_args(op: str, args: Sequence, ctype: str) -> str:
-    """ Транслировать значения операндов в строку """
+def compile_query(query, kwargs: dict, dialect) -> Tuple[str, dict]:
+    """
+        Скомпилировать запрос compose в текст и параметры для DBAPI-курсора
+
+    Используется там, где запрос выполняется непосредственно через psycopg2 (COPY, именованные курсоры).
+
+    :param query: запрос, полученный из compose
+    :param kwargs: bindary variables, полученные из compose
+    :param dialect: диалект SQLAlchemy (engine.dialect)
+    :return: tuple(текст запроса в paramstyle драйвера, словарь параметров)
+    """
+    compiled = query.compile(dialect=dialect)
+    return str(compiled), compiled.construct_params(kwargs)
+
+
+def next_cursor(rows: Sequence, options: dict):
+    """
+        Курсор следующей страницы для keyset-пагинации
+
+    Значения полей сортировки последней строки страницы, которые передаются в options['after']
+    для получения следующей страницы. Поля сортировки должны входить в options['fields'],
+    а их набор - однозначно определять строку и не содержать NULL, иначе строки на границе страниц теряются.
+
+    :param rows: строки страницы, полученные с options['limit']
+    :param options: настройки, с которыми получена страница
+    :return: список значений полей сортировки или None, если страница последняя
+    """
+    if 'limit' not in options or len(rows) < options['limit'] or not rows:
+        return None
+    column_fields = [field_name for field_name, *_ in options['fields']]
+    last = tuple(rows[-1])
+    return [last[column_fields.index(field_name)] for field_name, _ in options['order']]
+
+
+def sql_op_binds(op: str, args: Sequence, bind_name: str) -> Tuple[str, dict]:
+    """
+        Транслировать операцию и её операнды в SQL c bindary variables
+
+    Коллекции для 'in'/'not in' передаются одной переменной-массивом: '= ANY(:bind)' / '!= ALL(:bind)'.
+
+    :param op: операция
+    :param args: операнды
+    :param bind_name: имя bindary variable (для нескольких операндов к имени добавляется номер операнда)
+    :return: tuple(текст операции с операндами, dict(<bind_name>: <bind_value>))
+    """
     if OPERATIONS_ARGS[op] == tuple():
-        return ''
+        return op, dict()
     if OPERATIONS_ARGS[op] == ('<ctype>',):
-        return repr(args[0])
+        return f"{op} :{bind_name}", {bind_name: args[0]}
     if OPERATIONS_ARGS[op] == ('<collection>',):
-        return f"({','.join([repr(arg) for arg in args])})"
+        return f"{'= ANY' if op == 'in' else '!= ALL'}(:{bind_name})", {bind_name: list(args)}
     if op in ('between', 'not between'):
-        return f"{args[0]} and {args[1]}"
+        return f"{op} :{bind_name}_1 and :{bind_name}_2", {f"{bind_name}_1": args[0], f"{bind_name}_2": args[1]}
+    raise ValueError(f"Недопустимая операция {repr(op)}")
@@ -1,6 +1,22 @@
+from .test_advisor import *
+from .test_arrow import *
+from .test_cache import *
+from .test_columnar import *
+from .test_compiled import *
 from .test_compose import *
+from .test_engines import *
 from .test_execute import *
+from .test_execution import *
+from .test_export import *
 from .test_fields import *
+from .test_guard import *
+from .test_instrumentation import *
+from .test_iter import *
+from .test_materialize import *
 from .test_options import *
 from .test_params import *
+from .test_replicas import *
+from .test_rollup import *
 from .test_samples import *
+from .test_scheduler import *
+from .test_shards import *
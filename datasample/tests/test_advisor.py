@@ -0,0 +1,131 @@
+import unittest
+
+from datasample.engines import get_engine
+from datasample.advisor import advise_indexes, index_candidates, _has_hypopg
+from datasample.execution import SampleExecutionError
+
+__all__ = (
+    'IndexCandidatesTestCase',
+    'AdviseIndexesTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+SAMPLE_METADATA = {
+    'tables': {'main': "select a, b, c, a + b as total from advisor_test where c >= :MIN_C"},
+    'fields': {
+        'a': {'ctype': 'Integer', 'key': True, 'filtered': ('=', 'in'), 'ordered': True},
+        'b': {'ctype': 'Integer', 'key': True, 'filtered': ('=', '<', 'between'), 'ordered': True},
+        'c': {'ctype': 'Decimal', 'calc': ('sum',)},
+        'total': {'ctype': 'Integer', 'key': True, 'filtered': ('=',)},
+    },
+    'params': {'MIN_C': {'ctype': 'Integer'}},
+}
+ORIGINS = {'a': ('advisor_test', 'a'), 'b': ('advisor_test', 'b'), 'x': ('other', 'x')}
+
+
+class IndexCandidatesTestCase(unittest.TestCase):
+    def test_single(self):
+        options = {'fields': [['a', None]], 'filters': [['a', '=', [1]]], 'order': [['b', 'asc']]}
+        self.assertListEqual(index_candidates(options, ORIGINS), [
+            ('advisor_test', ('a',)),
+            ('advisor_test', ('b',)),
+            ('advisor_test', ('a', 'b')),
+        ])
+
+    def test_range_after_equality(self):
+        options = {'fields': [['a', None]], 'filters': [['b', '<', [1]], ['a', 'in', [[1, 2]]]],
+                   'order': [['x', 'asc']]}
+        self.assertIn(('advisor_test', ('a', 'b')), index_candidates(options, ORIGINS))
+        self.assertNotIn(('other', ('a', 'x')), index_candidates(options, ORIGINS))
+
+    def test_unknown_origin(self):
+        options = {'fields': [['total', None]], 'filters': [['total', '=', [1]]]}
+        self.assertListEqual(index_candidates(options, ORIGINS), [])
+
+    def test_max_columns(self):
+        origins = {name: ('t', name) for name in 'pqrs'}
+        options = {'fields': [['p', None]], 'filters': [[name, '=', [1]] for name in 'pqrs']}
+        self.assertIn(('t', ('p', 'q')), index_candidates(options, origins, max_columns=2))
+
+
+class AdviseIndexesTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        conn = get_engine(DB_SETTINGS).raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("drop table if exists advisor_test")
+                cursor.execute("create table advisor_test (id serial primary key, a int, b int, c numeric)")
+                cursor.execute("insert into advisor_test (a, b, c) "
+                               "select i % 1000, i % 97, i from generate_series(1, 50000) as i")
+                cursor.execute("analyze advisor_test")
+            conn.commit()
+        finally:
+            conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        conn = get_engine(DB_SETTINGS).raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("drop table advisor_test")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def test_advise(self):
+        workload = [
+            ({'MIN_C': 0}, {'fields': [['a', None], ['b', None]], 'filters': [['a', '=', [5]]]}, 10),
+            # Та же форма настроек - учитывается весом
+            ({'MIN_C': 0}, {'fields': [['a', None], ['b', None]], 'filters': [['a', '=', [7]]]}, 5),
+            ({'MIN_C': 0}, {'fields': [['total', None]], 'filters': [['total', '=', [5]]]}, 1),
+            # Не проходит валидацию - пропускается
+            ({'MIN_C': 0}, {'fields': [['unknown', None]]}, 100),
+        ]
+        advices = advise_indexes(SAMPLE_METADATA, workload, DB_SETTINGS, method='transaction')
+        self.assertEqual(len(advices), 1)
+        advice = advices[0]
+        self.assertEqual(advice.table, 'advisor_test')
+        self.assertTupleEqual(advice.columns, ('a',))
+        self.assertEqual(advice.queries, 15)
+        self.assertGreater(advice.gain, 0.5)
+        self.assertLess(advice.cost_after, advice.cost_before)
+        self.assertEqual(advice.statement,
+                         "CREATE INDEX CONCURRENTLY IF NOT EXISTS advisor_test_a_idx ON advisor_test (a);")
+
+    def test_existing_index(self):
+        conn = get_engine(DB_SETTINGS).raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("create index advisor_test_a_b on advisor_test (a, b)")
+            conn.commit()
+            workload = [({'MIN_C': 0}, {'fields': [['a', None]], 'filters': [['a', '=', [5]]]}, 1)]
+            self.assertListEqual(advise_indexes(SAMPLE_METADATA, workload, DB_SETTINGS, method='transaction'), [])
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute("drop index advisor_test_a_b")
+            conn.commit()
+            conn.close()
+
+    def test_method(self):
+        with self.assertRaises(ValueError):
+            advise_indexes(SAMPLE_METADATA, [], DB_SETTINGS, method='unknown')
+
+    def test_auto_without_hypopg(self):
+        """ Без hypopg auto не переходит к построению индексов в транзакции """
+        conn = get_engine(DB_SETTINGS).raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                hypopg = _has_hypopg(cursor)
+        finally:
+            conn.close()
+        if hypopg:
+            self.skipTest('hypopg is installed')
+        workload = [({'MIN_C': 0}, {'fields': [['a', None]], 'filters': [['a', '=', [5]]]}, 1)]
+        for method in ('auto', 'hypopg'):
+            with self.subTest(method=method), self.assertRaises(SampleExecutionError):
+                advise_indexes(SAMPLE_METADATA, workload, DB_SETTINGS, method=method)
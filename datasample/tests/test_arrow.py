@@ -0,0 +1,73 @@
+import io
+import unittest
+
+from datasample import execute, write_arrow
+from datasample.arrow import iter_arrow_stream
+from .test_columnar import SAMPLE_METADATA
+
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+__all__ = (
+    'ArrowOutputTestCase',
+)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ArrowOutputTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {
+            'fields': [['num', None], ['amount', None], ['even', None], ['name', None], ['day', None]],
+            'order': [['num', 'asc']],
+        }
+
+    def test_schema(self):
+        table = execute(SAMPLE_METADATA, {'ROWS': 4}, self.options, self.db_settings,
+                        result_format='arrow', batch_size=3)
+        self.assertEqual(table.schema.names, ['num', 'amount', 'even', 'name', 'day'])
+        self.assertEqual(str(table.schema.field('amount').type), 'double')
+        self.assertEqual(table.schema.field('day').type, pyarrow.date32())
+        self.assertEqual(table.schema.field('num').metadata[b'ctype'], b'Integer')
+        self.assertEqual(table.column('amount').to_pylist(), [1.5, 3.0, None, 6.0])
+        self.assertEqual(table.column('even').to_pylist(), [False, True, False, None])
+        self.assertEqual(table.column('num').num_chunks, 2)
+
+    def test_bigint_sum(self):
+        """ sum по bigint (numeric в PostgreSQL) больше 2**53 - int64 без потери точности """
+        table = execute(SAMPLE_METADATA, {'ROWS': 2}, {'fields': [['big', 'sum']]}, self.db_settings,
+                        result_format='arrow')
+        self.assertEqual(table.schema.field('big').type, pyarrow.int64())
+        self.assertEqual(table.column('big').to_pylist(), [18014398509481983])
+
+    def test_stream(self):
+        sink = io.BytesIO()
+        self.assertEqual(write_arrow(SAMPLE_METADATA, {'ROWS': 5}, self.options, self.db_settings, sink), 5)
+        table = pyarrow.ipc.open_stream(sink.getvalue()).read_all()
+        self.assertEqual(table.column('name').to_pylist(), ['n1', 'n2', 'n3', 'n4', 'n5'])
+
+    def test_stream_chunks(self):
+        chunks = list(iter_arrow_stream(SAMPLE_METADATA, {'ROWS': 5}, self.options, self.db_settings, batch_size=2))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(pyarrow.ipc.open_stream(b''.join(chunks)).read_all().num_rows, 5)
+
+    def test_empty_stream(self):
+        chunks = list(iter_arrow_stream(SAMPLE_METADATA, {'ROWS': 0}, self.options, self.db_settings))
+        self.assertEqual(pyarrow.ipc.open_stream(b''.join(chunks)).read_all().num_rows, 0)
+
+    def test_feather(self):
+        sink = io.BytesIO()
+        write_arrow(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, sink, format='feather')
+        table = pyarrow.feather.read_table(pyarrow.BufferReader(sink.getvalue()))
+        self.assertEqual(table.column('num').to_pylist(), [1, 2, 3])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_arrow(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, io.BytesIO(), format='csv')
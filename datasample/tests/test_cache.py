@@ -0,0 +1,92 @@
+import unittest
+
+from datasample.cache import ResultCache, fingerprint, result_key
+
+__all__ = (
+    'ResultCacheTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1',
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(max_bytes=1024, ttl=10, sample_ttl={'short': 1}, clock=self.clock)
+
+    def test_fingerprint(self):
+        """ Отпечаток не зависит от порядка ключей и пароля БД """
+        self.assertEqual(fingerprint({'a': 1, 'b': [1, 2]}), fingerprint({'b': [1, 2], 'a': 1}))
+        self.assertEqual(
+            result_key('sample', 1, {'YEAR': 2019}, {'fields': [['a', None]]}, DB_SETTINGS),
+            result_key('sample', 1, {'YEAR': 2019}, {'fields': [['a', None]]}, {**DB_SETTINGS, 'PASSWORD': 'x'}),
+        )
+        self.assertNotEqual(
+            result_key('sample', 1, {'YEAR': 2019}, {}, DB_SETTINGS),
+            result_key('sample', 2, {'YEAR': 2019}, {}, DB_SETTINGS),
+        )
+
+    def test_hit_miss(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', 'sample', [[1, 'a']])
+        self.assertEqual(self.cache.get('key'), [(1, 'a')])
+        self.cache.set('empty', 'sample', [])
+        self.assertEqual(self.cache.get('empty'), [])
+        self.assertEqual(self.cache.stats['hits'], 2)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_copy(self):
+        """ Изменение выданного результата не затрагивает кэш """
+        rows = self.cache.set('key', 'sample', [[1, 'a']])
+        rows.append((2, 'b'))
+        rows = self.cache.get('key')
+        rows.clear()
+        self.assertEqual(self.cache.get('key'), [(1, 'a')])
+
+    def test_ttl(self):
+        self.cache.set('key', 'sample', [(1,)])
+        self.cache.set('short_key', 'short', [(1,)])
+        self.clock.now = 5
+        self.assertIsNone(self.cache.get('short_key'))
+        self.assertIsNotNone(self.cache.get('key'))
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.stats['entries'], 0)
+
+    def test_lru_eviction(self):
+        """ Вытесняется давно не использованный результат, когда суммарный размер превышает max_bytes """
+        self.cache.max_bytes = 400  # вмещает два результата по 40 строк
+        rows = [(i,) for i in range(40)]
+        self.cache.set('first', 'sample', rows)
+        self.cache.set('second', 'sample', rows)
+        self.cache.get('first')
+        self.cache.set('third', 'sample', rows)
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertEqual(self.cache.stats['evictions'], 1)
+        self.assertLessEqual(self.cache.stats['bytes'], 400)
+
+    def test_too_large(self):
+        self.cache.set('key', 'sample', [(i,) for i in range(1000)])
+        self.assertEqual(self.cache.stats['entries'], 0)
+
+    def test_invalidate(self):
+        self.cache.set('key1', 'sample', [(1,)])
+        self.cache.set('key2', 'sample', [(2,)])
+        self.cache.set('other', 'other', [(3,)])
+        self.cache.invalidate('sample')
+        self.assertIsNone(self.cache.get('key1'))
+        self.assertIsNone(self.cache.get('key2'))
+        self.assertIsNotNone(self.cache.get('other'))
@@ -0,0 +1,88 @@
+import unittest
+from decimal import Decimal
+
+from datasample import execute
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = (
+    'ColumnarExecuteTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': """
+        select i as num,
+            case when i % 3 = 0 then null else i * 1.5 end as amount,
+            case when i % 4 = 0 then null else i % 2 = 0 end as even,
+            'n' || i as name,
+            date '2020-01-01' + i as day,
+            (i + 9007199254740990)::bigint as big
+        from generate_series(1, :ROWS) as i
+    """},
+    'fields': {
+        'num': {'ctype': 'Integer', 'key': True, 'ordered': True},
+        'amount': {'ctype': 'Decimal', 'calc': ['sum', 'avg']},
+        'even': {'ctype': 'Boolean', 'key': True, 'ordered': True},
+        'name': {'ctype': 'String'},
+        'day': {'ctype': 'Date'},
+        'big': {'ctype': 'Integer', 'calc': ['sum']},
+    },
+    'params': {'ROWS': {'ctype': 'Integer'}},
+}
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class ColumnarExecuteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {
+            'fields': [['num', None], ['amount', None], ['even', None], ['name', None], ['day', None]],
+            'order': [['num', 'asc']],
+        }
+
+    def execute(self, rows, options=None, **format_options):
+        return execute(SAMPLE_METADATA, {'ROWS': rows}, options or self.options, self.db_settings,
+                       result_format='columnar', batch_size=3, **format_options)
+
+    def test_dtypes(self):
+        result = self.execute(7)
+        self.assertEqual(list(result), ['num', 'amount', 'even', 'name', 'day'])
+        self.assertEqual(result['num'].dtype, numpy.int64)
+        self.assertEqual(result['num'].tolist(), [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(result['amount'].dtype, numpy.float64)
+        self.assertEqual(numpy.isnan(result['amount']).tolist(), [False, False, True, False, False, True, False])
+        self.assertEqual(result['even'].dtype, numpy.bool_)
+        self.assertEqual(result['even'].mask.tolist(), [False, False, False, True, False, False, False])
+        self.assertEqual(result['name'].tolist(), ['n1', 'n2', 'n3', 'n4', 'n5', 'n6', 'n7'])
+        self.assertEqual(str(result['day'][0]), '2020-01-02')
+
+    def test_exact_decimal_and_fixed_strings(self):
+        result = self.execute(3, decimal='exact', string_width=4)
+        self.assertEqual(result['amount'].tolist(), [Decimal('1.5'), Decimal('3.0'), None])
+        self.assertEqual(result['name'].dtype, numpy.dtype('U4'))
+
+    def test_aggregate(self):
+        result = self.execute(6, {'fields': [['even', None], ['amount', 'avg']], 'group': ['even'],
+                                  'order': [['even', 'asc']]})
+        self.assertEqual(result['amount'].dtype, numpy.float64)
+        self.assertEqual(len(result['even']), 3)
+
+    def test_bigint_sum(self):
+        """ sum по bigint (numeric в PostgreSQL) больше 2**53 - без потери точности """
+        for decimal in ('float', 'exact'):
+            with self.subTest(decimal=decimal):
+                result = self.execute(2, {'fields': [['big', 'sum']]}, decimal=decimal)
+                self.assertEqual(result['big'].dtype, numpy.int64)
+                self.assertEqual(result['big'].tolist(), [18014398509481983])
+
+    def test_empty(self):
+        result = self.execute(0)
+        self.assertEqual(len(result['num']), 0)
+        self.assertEqual(result['amount'].dtype, numpy.float64)
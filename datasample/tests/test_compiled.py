@@ -0,0 +1,65 @@
+import pickle
+import unittest
+from threading import Thread
+
+from datasample import Sample, CompiledSample, compose
+from .test_compose import SIMPLE_SCHEMA_METADATA
+
+__all__ = (
+    'CompiledSampleTestCase',
+)
+
+OPTIONS = {
+    'fields': (('document_id', None), ('amount', 'sum')),
+    'filters': (('document_id', 'in', (1, 2)),),
+    'group': ('document_id',),
+    'order': (('document_id', 'asc'),),
+}
+
+
+class CompiledSampleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = None
+        self.compiled = Sample(SIMPLE_SCHEMA_METADATA).compile()
+
+    def test_fragments(self):
+        """ Фрагменты SQL подготовлены по описанию полей """
+        i = self.compiled.field_index['amount']
+        self.assertEqual(self.compiled.field_names[i], 'amount')
+        self.assertEqual(self.compiled.sql_identifiers[i], ''' "main"."amount_total" ''')
+        self.assertEqual(self.compiled.sql_columns[i], ''' "main"."amount_total"  AS  "amount"  ''')
+        self.assertEqual(self.compiled.sql_froms[self.compiled.table_index['main']],
+                         f'''({SIMPLE_SCHEMA_METADATA['tables']['main']}) AS "main"''')
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.compiled.field_names = ()
+        with self.assertRaises(TypeError):
+            self.compiled.fields['amount']['hidden'] = True
+        self.assertIsInstance(self.compiled.fields['amount']['calc'], tuple)
+
+    def test_compose_equal(self):
+        """ compose даёт одинаковый результат для описания СВД и скомпилированной СВД """
+        query, kwargs = compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, OPTIONS)
+        compiled_query, compiled_kwargs = compose(self.compiled, {'YEAR': 2019}, OPTIONS)
+        self.assertEqual(str(query), str(compiled_query))
+        self.assertDictEqual(kwargs, compiled_kwargs)
+
+    def test_pickle(self):
+        compiled = pickle.loads(pickle.dumps(self.compiled))
+        self.assertIsInstance(compiled, CompiledSample)
+        self.assertEqual(compiled.sql_columns, self.compiled.sql_columns)
+        self.assertDictEqual(compiled.state, self.compiled.state)
+
+    def test_threads(self):
+        """ Один объект CompiledSample используется из нескольких потоков """
+        results = []
+        threads = [
+            Thread(target=lambda: results.append(str(compose(self.compiled, {'YEAR': 2019}, OPTIONS)[0])))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(results)), 1)
@@ -1,6 +1,6 @@
 import unittest
 
-from datasample import compose
+from datasample import compose, next_cursor, SampleElementError
 from .fixtures import (
     ETALON_FULL_SCHEMA_METADATA,
     ETALON_FULL_OPTIONS,
@@ -13,6 +13,8 @@ from .fixtures import (
 
 __all__ = (
     'SmokeComposeTestCase',
+    'BindsComposeTestCase',
+    'KeysetComposeTestCase',
 )
 
 PARAMS_POSITIVE = {
@@ -34,3 +36,133 @@ class SmokeComposeTestCase(unittest.TestCase):
                                 ETALON_FULL_OPTIONS,)
         self.assertIsNotNone(query)
         self.assertIsNotNone(kwargs)
+
+
+SIMPLE_SCHEMA_METADATA = {
+    'tables': {
+        'main': "select document_id, amount_total from datamart_dmallocationplan where year = :YEAR",
+    },
+    'fields': {
+        'document_id': {
+            'ctype': 'Integer',
+            'key': True,
+            'filtered': ('=', 'in', 'not in', 'between'),
+            'ordered': True,
+        },
+        'amount': {
+            'ctype': 'Decimal',
+            'calc': ('sum', 'min', 'max'),
+            'filtered': ('>=', 'is null'),
+            'having': ('>=',),
+            'expression': 'amount_total',
+        },
+    },
+    'params': {
+        'YEAR': {'ctype': 'Integer'},
+    },
+}
+
+
+class BindsComposeTestCase(unittest.TestCase):
+    """ Операнды фильтров и отсевов передаются через bindary variables """
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def compose_filters(self, filters):
+        return compose(SIMPLE_SCHEMA_METADATA,
+                       {'YEAR': 2019},
+                       {'fields': (('document_id', None), ('amount', None)), 'filters': filters})
+
+    def test_filters_binds(self):
+        query, kwargs = self.compose_filters((
+            ('document_id', 'in', (1, 2)),
+            ('document_id', 'not in', [3]),
+            ('document_id', 'between', (10, 20)),
+            ('amount', '>=', (100.5,)),
+            ('amount', 'is null', ()),
+        ))
+        self.assertIn('= ANY(:_filter_0)', str(query))
+        self.assertIn('!= ALL(:_filter_1)', str(query))
+        self.assertIn('between :_filter_2_1 and :_filter_2_2', str(query))
+        self.assertIn('>= :_filter_3', str(query))
+        self.assertDictEqual(kwargs, {
+            'YEAR': 2019,
+            '_filter_0': [1, 2],
+            '_filter_1': [3],
+            '_filter_2_1': 10,
+            '_filter_2_2': 20,
+            '_filter_3': 100.5,
+        })
+
+    def test_same_shape_same_sql(self):
+        """ Одинаковая по структуре настройка даёт идентичный текст запроса """
+        query1, kwargs1 = self.compose_filters((('document_id', '=', (1,)), ('amount', '>=', (1.0,))))
+        query2, kwargs2 = self.compose_filters((('document_id', '=', (2,)), ('amount', '>=', (2.0,))))
+        self.assertEqual(str(query1), str(query2))
+        self.assertNotEqual(kwargs1, kwargs2)
+
+    def test_having_binds(self):
+        query, kwargs = compose(SIMPLE_SCHEMA_METADATA,
+                                {'YEAR': 2019},
+                                {'fields': (('document_id', None), ('amount', 'sum')),
+                                 'group': ('document_id',),
+                                 'having': (('amount', '>=', (1000,)),)})
+        self.assertIn('>= :_having_0', str(query))
+        self.assertEqual(kwargs['_having_0'], 1000)
+
+
+class KeysetComposeTestCase(unittest.TestCase):
+    """ LIMIT и keyset-пагинация по полям сортировки """
+
+    def setUp(self):
+        self.maxDiff = None
+        self.options = {
+            'fields': (('document_id', None), ('amount', None)),
+            'order': (('document_id', 'asc'),),
+            'limit': 2,
+        }
+
+    def test_limit(self):
+        query, kwargs = compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, self.options)
+        self.assertIn('LIMIT :_limit', str(query))
+        self.assertEqual(kwargs['_limit'], 2)
+
+    def test_after(self):
+        query, kwargs = compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, {**self.options, 'after': (10,)})
+        self.assertIn('WHERE ( "main"."document_id" ) > (:_after_0)', str(query))
+        self.assertEqual(kwargs['_after_0'], 10)
+
+    def test_after_group(self):
+        """ Для запросов с группировкой курсор накладывается в HAVING """
+        query, kwargs = compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, {
+            'fields': (('document_id', None), ('amount', 'sum')),
+            'group': ('document_id',),
+            'order': (('document_id', 'desc'),),
+            'limit': 2,
+            'after': (10,),
+        })
+        self.assertIn('HAVING ( "main"."document_id" ) < (:_after_0)', str(query))
+
+    def test_after_negative(self):
+        with self.assertRaises(SampleElementError) as context:
+            compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, {
+                'fields': (('amount', None),),
+                'order': (('document_id', 'asc'),),
+                'limit': 0,
+                'after': (1, 2),
+            })
+        self.assertSetEqual(set(context.exception.errors), {'options[limit]', 'options[after]'})
+        self.assertEqual(len(context.exception.errors['options[after]']), 2)
+        for options in (
+            {'fields': (('document_id', None),), 'after': (1,)},
+            {'fields': (('document_id', None),), 'order': (), 'after': ()},
+            {'fields': (('document_id', None),), 'order': (('document_id', 'asc'),), 'after': (None,)},
+        ):
+            with self.subTest(options=options), self.assertRaises(SampleElementError) as context:
+                compose(SIMPLE_SCHEMA_METADATA, {'YEAR': 2019}, options)
+            self.assertSetEqual(set(context.exception.errors), {'options[after]'})
+
+    def test_next_cursor(self):
+        self.assertEqual(next_cursor([(1, 1.0), (2, 2.0)], self.options), [2])
+        self.assertIsNone(next_cursor([(1, 1.0)], self.options))
@@ -0,0 +1,42 @@
+import unittest
+
+from datasample.engines import EngineRegistry
+
+__all__ = (
+    'EngineRegistryTestCase',
+)
+
+
+class EngineRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = EngineRegistry(pool_size=2)
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1',
+        }
+
+    def tearDown(self):
+        self.registry.close_all()
+
+    def test_same_engine_for_equal_settings(self):
+        """ Одинаковые (после нормализации) настройки дают один и тот же Engine """
+        engine = self.registry.get(self.db_settings)
+        self.assertIs(engine, self.registry.get({**self.db_settings, 'PORT': '5432', 'PASSWORD': ''}))
+        self.assertEqual(len(self.registry), 1)
+
+    def test_pool_options(self):
+        """ Параметры пула реестра и их перекрытие в db_settings['POOL'] """
+        self.assertEqual(self.registry.get(self.db_settings).pool.size(), 2)
+        engine = self.registry.get({**self.db_settings, 'POOL': {'pool_size': 7}})
+        self.assertEqual(engine.pool.size(), 7)
+        self.assertEqual(len(self.registry), 2)
+
+    def test_configure_negative(self):
+        with self.assertRaises(ValueError):
+            self.registry.configure(unknown_option=1)
+
+    def test_close_all(self):
+        self.registry.get(self.db_settings)
+        self.registry.close_all()
+        self.assertEqual(len(self.registry), 0)
@@ -0,0 +1,60 @@
+import io
+import unittest
+from threading import Timer
+
+from datasample import execute, execute_iter, export_csv, CancelHandle, SampleTimeoutError, SampleCancelledError
+
+__all__ = (
+    'TimeoutCancelTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': "select i as num, pg_sleep(:DELAY)::text as slept from generate_series(1, 3) as i"},
+    'fields': {
+        'num': {'ctype': 'Integer'},
+        'slept': {'ctype': 'String'},
+    },
+    'params': {'DELAY': {'ctype': 'Decimal'}},
+}
+
+
+class TimeoutCancelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {'fields': [['num', None], ['slept', None]]}
+
+    def test_timeout(self):
+        with self.assertRaises(SampleTimeoutError):
+            execute(SAMPLE_METADATA, {'DELAY': 1.0}, self.options, self.db_settings, timeout=0.1)
+        with self.assertRaises(SampleTimeoutError):
+            list(execute_iter(SAMPLE_METADATA, {'DELAY': 1.0}, self.options, self.db_settings, timeout=0.1))
+        with self.assertRaises(SampleTimeoutError):
+            export_csv(SAMPLE_METADATA, {'DELAY': 1.0}, self.options, self.db_settings, io.BytesIO(), timeout=0.1)
+
+    def test_timeout_is_not_kept_in_pool(self):
+        execute(SAMPLE_METADATA, {'DELAY': 0.0}, self.options, self.db_settings, timeout=0.1)
+        rows = execute(SAMPLE_METADATA, {'DELAY': 0.1}, self.options, self.db_settings)
+        self.assertEqual(len(rows), 3)
+
+    def test_invalid_timeout(self):
+        with self.assertRaises(ValueError):
+            execute(SAMPLE_METADATA, {'DELAY': 0.0}, self.options, self.db_settings, timeout=0)
+
+    def test_cancel(self):
+        cancel = CancelHandle()
+        timer = Timer(0.2, cancel.cancel)
+        timer.start()
+        with self.assertRaises(SampleCancelledError):
+            execute(SAMPLE_METADATA, {'DELAY': 1.0}, self.options, self.db_settings, cancel=cancel)
+        timer.join()
+        self.assertTrue(cancel.cancelled)
+
+    def test_cancel_before_execute(self):
+        cancel = CancelHandle()
+        self.assertFalse(cancel.cancel())
+        with self.assertRaises(SampleCancelledError):
+            execute(SAMPLE_METADATA, {'DELAY': 0.0}, self.options, self.db_settings, cancel=cancel)
@@ -0,0 +1,71 @@
+import io
+import json
+import unittest
+
+from datasample import export_csv, write_result
+
+__all__ = (
+    'ExportCsvTestCase',
+    'WriteResultTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': "select i as num, 'name, ' || i as name from generate_series(1, :ROWS) as i"},
+    'fields': {
+        'num': {'ctype': 'Integer', 'label': 'Номер', 'ordered': True},
+        'name': {'ctype': 'String', 'label': 'Наименование'},
+    },
+    'params': {'ROWS': {'ctype': 'Integer'}},
+}
+
+
+class ExportCsvTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = None
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {'fields': [['num', None], ['name', None]], 'order': [['num', 'desc']]}
+
+    def test_binary(self):
+        fileobj = io.BytesIO()
+        export_csv(SAMPLE_METADATA, {'ROWS': 2}, self.options, self.db_settings, fileobj)
+        self.assertEqual(fileobj.getvalue().decode(), 'Номер,Наименование\n2,"name, 2"\n1,"name, 1"\n')
+
+    def test_text(self):
+        fileobj = io.StringIO()
+        export_csv(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, fileobj)
+        self.assertEqual(len(fileobj.getvalue().splitlines()), 4)
+
+
+class WriteResultTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {'fields': [['num', None], ['name', None]], 'order': [['num', 'asc']]}
+
+    def test_csv_progress(self):
+        progress = []
+        rows = write_result(SAMPLE_METADATA, {'ROWS': 5}, self.options, self.db_settings, io.BytesIO(),
+                            format='csv', progress=progress.append, batch_size=2)
+        self.assertEqual(rows, 5)
+        self.assertListEqual(progress, [2, 4])
+
+    def test_ndjson(self):
+        fileobj = io.BytesIO()
+        progress = []
+        rows = write_result(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, fileobj,
+                            format='ndjson', progress=progress.append, batch_size=2)
+        self.assertEqual(rows, 3)
+        self.assertListEqual(progress, [2, 3])
+        lines = fileobj.getvalue().decode().splitlines()
+        self.assertDictEqual(json.loads(lines[0]), {'num': 1, 'name': 'name, 1'})
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_result(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, io.BytesIO(), format='xml')
@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import patch
+
+from datasample import explain, CostGuard, SampleBudgetError
+from datasample.guard import check_budget
+from datasample.sqlalchemytools import PlanSummary, options_shape
+
+__all__ = (
+    'ExplainTestCase',
+    'CostGuardTestCase',
+)
+
+SAMPLE_METADATA = {
+    # Планировщик оценивает результат generate_series в 1000 строк независимо от аргументов
+    'tables': {'main': "select i as num from generate_series(1, :ROWS) as i"},
+    'fields': {
+        'num': {'ctype': 'Integer', 'ordered': True, 'filtered': ('<=', '>')},
+    },
+    'params': {'ROWS': {'ctype': 'Integer'}},
+}
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+OPTIONS = {'fields': [['num', None]], 'filters': [['num', '>', [0]]]}
+
+
+class ExplainTestCase(unittest.TestCase):
+    def test_explain(self):
+        plan = explain(SAMPLE_METADATA, {'ROWS': 10}, OPTIONS, DB_SETTINGS)
+        self.assertGreater(plan.total_cost, 0)
+        self.assertGreater(plan.rows, 0)
+
+    def test_options_shape(self):
+        self.assertEqual(
+            options_shape({'fields': [['num', None]], 'filters': [['num', '>', [0]]]}),
+            options_shape({'fields': [['num', None]], 'filters': [['num', '>', [5]]]}),
+        )
+        self.assertNotEqual(
+            options_shape({'fields': [['num', None]], 'filters': [['num', '>', [0]]]}),
+            options_shape({'fields': [['num', None]], 'filters': [['num', '<=', [0]]]}),
+        )
+
+
+class CostGuardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.plan_rows = explain(SAMPLE_METADATA, {'ROWS': 10}, OPTIONS, DB_SETTINGS).rows
+
+    def check(self, guard, budget=None, options=OPTIONS):
+        return guard.check(SAMPLE_METADATA, {'ROWS': 10}, options, DB_SETTINGS,
+                           name='numbers', revision=1, budget=budget)
+
+    def test_no_budget(self):
+        """ Без бюджета запрос не оценивается """
+        with patch('datasample.guard.explain') as explain_mock:
+            decision = CostGuard().check(SAMPLE_METADATA, {'ROWS': 10}, OPTIONS, DB_SETTINGS)
+        self.assertEqual(decision.action, 'allow')
+        explain_mock.assert_not_called()
+
+    def test_allow(self):
+        decision = self.check(CostGuard({'max_rows': self.plan_rows}))
+        self.assertEqual(decision.action, 'allow')
+        self.assertIs(decision.options, OPTIONS)
+
+    def test_reject(self):
+        with self.assertRaises(SampleBudgetError) as cm:
+            self.check(CostGuard({'max_rows': self.plan_rows - 1}))
+        self.assertEqual(cm.exception.plan.rows, self.plan_rows)
+
+    def test_sample_budget(self):
+        """ Бюджет СВД перекрывает общий """
+        guard = CostGuard({'max_rows': self.plan_rows - 1})
+        self.assertEqual(self.check(guard, budget={'max_rows': self.plan_rows}).action, 'allow')
+        self.assertEqual(self.check(guard, budget={'on_exceed': 'queue'}).action, 'queue')
+
+    def test_cap(self):
+        guard = CostGuard({'max_rows': 1, 'on_exceed': 'cap', 'cap_rows': 100})
+        decision = self.check(guard)
+        self.assertEqual(decision.action, 'cap')
+        self.assertEqual(decision.options['limit'], 100)
+        self.assertNotIn('limit', OPTIONS)
+        self.assertEqual(self.check(guard, options={**OPTIONS, 'limit': 10}).options['limit'], 10)
+
+    def test_plan_cache(self):
+        guard = CostGuard({'max_rows': self.plan_rows})
+        self.check(guard)
+        with patch('datasample.guard.explain', return_value=PlanSummary(1.0, 1, 4)) as explain_mock:
+            guard.check(SAMPLE_METADATA, {'ROWS': 20}, {**OPTIONS, 'filters': [['num', '>', [5]]]}, DB_SETTINGS,
+                        name='numbers', revision=1)
+            explain_mock.assert_not_called()
+            guard.check(SAMPLE_METADATA, {'ROWS': 20}, OPTIONS, DB_SETTINGS, name='numbers', revision=2)
+            explain_mock.assert_called_once()
+        self.assertDictEqual(guard.stats, {'plans': 2, 'hits': 1, 'misses': 2})
+
+    def test_check_budget(self):
+        for budget in ({'unknown': 1}, {'on_exceed': 'drop'}, {'max_cost': -1}, {'max_rows': True}):
+            with self.assertRaises(ValueError):
+                check_budget(budget)
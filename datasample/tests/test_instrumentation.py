@@ -0,0 +1,114 @@
+import io
+import unittest
+
+from datasample import execute, execute_iter, export_csv, PrometheusSink, set_sink, labels
+from datasample.instrumentation import NOOP_SPAN, MetricsSink, span
+
+__all__ = (
+    'InstrumentationTestCase',
+    'PrometheusSinkTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': "select i as num from generate_series(1, :ROWS) as i"},
+    'fields': {
+        'num': {'ctype': 'Integer', 'label': 'Номер', 'ordered': True},
+    },
+    'params': {'ROWS': {'ctype': 'Integer'}},
+}
+
+
+class ListSink(MetricsSink):
+    def __init__(self):
+        self.spans = []
+
+    def record(self, span):
+        self.spans.append(span)
+
+    def phases(self):
+        return [span.phase for span in self.spans]
+
+    def get(self, phase):
+        return next(span for span in self.spans if span.phase == phase)
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_settings = {
+            'NAME': 'postgres',
+            'USER': 'postgres',
+            'HOST': '127.0.0.1'
+        }
+        self.options = {'fields': [['num', None]], 'order': [['num', 'asc']]}
+        self.sink = ListSink()
+        set_sink(self.sink)
+
+    def tearDown(self):
+        set_sink(None)
+
+    def test_disabled(self):
+        set_sink(None)
+        self.assertIs(span('fetch'), NOOP_SPAN)
+        with span('fetch') as s:
+            s.add(rows=1)
+        self.assertListEqual(self.sink.spans, [])
+
+    def test_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            with span('compose'):
+                1 / 0
+        self.assertEqual(self.sink.spans[0].error, 'ZeroDivisionError')
+
+    def test_execute(self):
+        with labels(sample='numbers', version='1.0', revision=3):
+            rows = execute(SAMPLE_METADATA, {'ROWS': 5}, self.options, self.db_settings)
+        self.assertEqual(len(rows), 5)
+        self.assertListEqual(self.sink.phases(), ['validate', 'compose', 'execute', 'fetch'])
+        self.assertEqual(self.sink.get('fetch').rows, 5)
+        for s in self.sink.spans:
+            self.assertDictEqual(s.labels, {'sample': 'numbers', 'version': '1.0', 'revision': 3})
+            self.assertGreaterEqual(s.duration, 0)
+
+    def test_execute_iter(self):
+        """ Метки запоминаются при вызове, хотя строки читаются вне блока labels """
+        with labels(sample='numbers'):
+            rows = execute_iter(SAMPLE_METADATA, {'ROWS': 5}, self.options, self.db_settings, batch_size=2)
+        self.assertEqual(len(list(rows)), 5)
+        fetch = self.sink.get('fetch')
+        self.assertEqual(fetch.rows, 5)
+        self.assertDictEqual(fetch.labels, {'sample': 'numbers'})
+        self.assertIsNone(fetch.error)
+
+    def test_export_csv(self):
+        fileobj = io.BytesIO()
+        export_csv(SAMPLE_METADATA, {'ROWS': 3}, self.options, self.db_settings, fileobj)
+        fetch = self.sink.get('fetch')
+        self.assertEqual(fetch.rows, 3)
+        self.assertEqual(fetch.bytes, len('1\n2\n3\n'))
+
+
+class PrometheusSinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sink = PrometheusSink(buckets=(0.1, 1))
+        set_sink(self.sink)
+
+    def tearDown(self):
+        set_sink(None)
+
+    def test_render(self):
+        with labels(sample='a"b', version='1'):
+            with span('fetch') as s:
+                s.add(rows=10, bytes=100)
+            with self.assertRaises(ValueError):
+                with span('fetch'):
+                    raise ValueError
+        text = self.sink.render()
+        series = 'phase="fetch",sample="a\\"b",version="1",revision=""'
+        self.assertIn(f'datasample_phase_seconds_bucket{{{series},le="0.1"}} 2', text)
+        self.assertIn(f'datasample_phase_seconds_bucket{{{series},le="+Inf"}} 2', text)
+        self.assertIn(f'datasample_phase_seconds_count{{{series}}} 2', text)
+        self.assertIn(f'datasample_phase_rows_total{{{series}}} 10', text)
+        self.assertIn(f'datasample_phase_bytes_total{{{series}}} 100', text)
+        self.assertIn(f'datasample_phase_errors_total{{{series}}} 1', text)
+        self.sink.clear()
+        self.assertNotIn('phase="fetch"', self.sink.render())
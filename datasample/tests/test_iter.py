@@ -0,0 +1,88 @@
+import unittest
+
+import psycopg2
+
+from datasample import execute_iter, close_all
+from datasample.engines import get_engine
+
+__all__ = (
+    'ExecuteIterTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1',
+    # Отдельный пул из одного соединения: по нему видно, вернулось ли соединение
+    'POOL': {'pool_size': 1, 'max_overflow': 0},
+}
+SAMPLE_METADATA = {
+    'tables': {'main': "select i as num from generate_series(1, 5) as i"},
+    'fields': {'num': {'ctype': 'Integer', 'ordered': True}},
+    'params': {},
+}
+OPTIONS = {'fields': [['num', None]], 'order': [['num', 'asc']]}
+# Сеансы, читающие строки из именованного (server-side) курсора: последняя команда - FETCH
+FETCHING_SQL = ("select count(*) from pg_stat_activity "
+                "where state = 'idle in transaction' and query like 'FETCH FORWARD %% FROM %%'")
+
+
+def _fetching() -> int:
+    conn = psycopg2.connect(dbname=DB_SETTINGS['NAME'], user=DB_SETTINGS['USER'], host=DB_SETTINGS['HOST'])
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(FETCHING_SQL)
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+class ExecuteIterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = get_engine(DB_SETTINGS)
+
+    def tearDown(self):
+        close_all()
+
+    def assertReleased(self):
+        """ Соединение вернулось в пул, именованный курсор закрыт """
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute("select count(*) from pg_cursors").scalar(), 0)
+
+    def test_batches(self):
+        iterator = execute_iter(SAMPLE_METADATA, {}, OPTIONS, DB_SETTINGS, batch_size=2, batches=True)
+        # Соединение берётся из пула при первой итерации
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        first = next(iterator)
+        self.assertListEqual([tuple(row) for row in first], [(1,), (2,)])
+        # Строки читаются из server-side курсора, соединение занято до конца итерации
+        self.assertEqual(self.engine.pool.checkedout(), 1)
+        self.assertEqual(_fetching(), 1)
+        self.assertListEqual([[tuple(row) for row in batch] for batch in iterator], [[(3,), (4,)], [(5,)]])
+        self.assertReleased()
+
+    def test_rows(self):
+        rows = execute_iter(SAMPLE_METADATA, {}, OPTIONS, DB_SETTINGS, batch_size=2)
+        self.assertListEqual([tuple(row) for row in rows], [(1,), (2,), (3,), (4,), (5,)])
+        self.assertReleased()
+
+    def test_close(self):
+        """ Потребитель прекратил итерацию после первой порции """
+        iterator = execute_iter(SAMPLE_METADATA, {}, OPTIONS, DB_SETTINGS, batch_size=2, batches=True)
+        next(iterator)
+        iterator.close()
+        self.assertEqual(_fetching(), 0)
+        self.assertReleased()
+
+    def test_break(self):
+        def consume():
+            for batch in execute_iter(SAMPLE_METADATA, {}, OPTIONS, DB_SETTINGS, batch_size=2, batches=True):
+                return batch
+
+        self.assertEqual(len(consume()), 2)
+        self.assertReleased()
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            execute_iter(SAMPLE_METADATA, {}, OPTIONS, DB_SETTINGS, batch_size=0)
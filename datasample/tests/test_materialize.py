@@ -0,0 +1,73 @@
+import unittest
+
+from datasample import execute
+from datasample.materialize import (check_materialize, materialized_sample, create_views, refresh_views, drop_views,
+                                    find_views)
+
+__all__ = (
+    'CheckMaterializeTestCase',
+    'MaterializedViewsTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+SAMPLE_METADATA = {
+    'tables': {
+        'main': "select i as num, i / 4 as grp from generate_series(1, 10) as i",
+        'limits': "select i as top from generate_series(1, :TOP) as i",
+    },
+    'fields': {
+        'num': {'ctype': 'Integer', 'key': True, 'ordered': True, 'filtered': ('<=',)},
+        'grp': {'ctype': 'Integer', 'key': True, 'ordered': True},
+        'top': {'ctype': 'Integer', 'key': True, 'table': 'limits'},
+    },
+    'params': {'TOP': {'ctype': 'Integer'}},
+}
+VIEWS = {'main': 'datasample_test_mv_main'}
+
+
+class CheckMaterializeTestCase(unittest.TestCase):
+    def test_check(self):
+        materialize = {'tables': {'main': ['num']}, 'refresh_interval': 3600}
+        self.assertDictEqual(check_materialize(materialize, SAMPLE_METADATA), materialize)
+        self.assertDictEqual(check_materialize(None, SAMPLE_METADATA), {})
+
+    def test_negative(self):
+        for materialize in (
+            {'unknown': 1},
+            {'tables': ['main']},
+            {'tables': {'other': []}},
+            {'tables': {'limits': []}},  # подзапрос с параметром
+            {'tables': {'main': 'num'}},
+            {'refresh_interval': 0},
+            {'refresh_interval': True},
+        ):
+            with self.subTest(materialize=materialize), self.assertRaises(ValueError):
+                check_materialize(materialize, SAMPLE_METADATA)
+
+    def test_materialized_sample(self):
+        sample = materialized_sample(SAMPLE_METADATA, VIEWS)
+        self.assertEqual(sample.tables['main'], 'select * from "datasample_test_mv_main"')
+        self.assertEqual(sample.tables['limits'], SAMPLE_METADATA['tables']['limits'])
+        self.assertDictEqual(sample.fields['num'], materialized_sample(SAMPLE_METADATA, {}).fields['num'])
+
+
+class MaterializedViewsTestCase(unittest.TestCase):
+    def tearDown(self):
+        drop_views(VIEWS.values(), DB_SETTINGS)
+
+    def test_views(self):
+        options = {'fields': [['num', None]], 'filters': [['num', '<=', [3]]], 'order': [['num', 'asc']]}
+        for materialize in ({'tables': {'main': ['num']}}, {'tables': {'main': []}}):
+            with self.subTest(materialize=materialize):
+                create_views(SAMPLE_METADATA, VIEWS, materialize, DB_SETTINGS)
+                self.assertListEqual(find_views('datasample_test_mv_', DB_SETTINGS), ['datasample_test_mv_main'])
+                sample = materialized_sample(SAMPLE_METADATA, VIEWS)
+                self.assertListEqual([row[0] for row in execute(sample, {'TOP': 1}, options, DB_SETTINGS)], [1, 2, 3])
+                refresh_views(VIEWS, materialize, DB_SETTINGS)
+                self.assertEqual(len(execute(sample, {'TOP': 1}, options, DB_SETTINGS)), 3)
+        drop_views(VIEWS.values(), DB_SETTINGS)
+        self.assertListEqual(find_views('datasample_test_mv_', DB_SETTINGS), [])
@@ -0,0 +1,159 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from datasample import execute, execute_iter
+from datasample.instrumentation import Span, MetricsSink
+from datasample.replicas import PRIMARY, ReplicaRouter
+
+__all__ = (
+    'ReplicaRouterTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+# Недоступная реплика: соединение отклоняется
+DOWN_SETTINGS = {**DB_SETTINGS, 'PORT': '1'}
+PRIMARY_SETTINGS = {**DB_SETTINGS, 'POOL': {'pool_size': 1}}
+SAMPLE_METADATA = {
+    'tables': {'main': "select i as num from generate_series(1, 3) as i"},
+    'fields': {'num': {'ctype': 'Integer', 'key': True}},
+    'params': {},
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def router(self, replicas: dict, **kwargs) -> ReplicaRouter:
+        return ReplicaRouter(PRIMARY_SETTINGS, replicas, clock=self.clock, **kwargs)
+
+    def test_choose(self):
+        self.assertEqual(self.router({}).choose().name, PRIMARY)
+        router = self.router({'r1': DB_SETTINGS})
+        # Выбор не ждёт проверки: до её окончания - основная БД
+        with mock.patch.object(router, 'check'):
+            self.assertEqual(router.choose().name, PRIMARY)
+        router = self.router({'r1': DB_SETTINGS})
+        router.refresh(wait=True)
+        route = router.choose()
+        self.assertEqual(route.name, 'r1')
+        self.assertIs(route.db_settings, DB_SETTINGS)
+        self.assertEqual(router.choose(primary=True), (PRIMARY, PRIMARY_SETTINGS))
+        self.assertDictEqual({key: value for key, value in router.stats['r1'].items() if key != 'latency'},
+                             {'available': True, 'lag': 0.0, 'error': None})
+        self.assertGreater(router.stats['r1']['latency'], 0)
+
+    def test_latency(self):
+        router = self.router({'r1': DB_SETTINGS, 'r2': DB_SETTINGS}, alpha=0.5)
+        router.refresh(wait=True)
+        router.observe('r1', 10.0)
+        self.assertEqual(router.choose().name, 'r2')
+        # Задержка r2 по замерам выполнения (приёмник замеров) выросла - выбирается r1
+        for _ in range(5):
+            span = Span(MetricsSink(), 'execute', {'replica': 'r2'})
+            span.duration = 100.0
+            router.record(span)
+        self.assertEqual(router.choose().name, 'r1')
+        self.assertAlmostEqual(router.stats['r2']['latency'], 100.0, delta=4)
+
+    def test_fallback(self):
+        router = self.router({'r1': DOWN_SETTINGS}, check_interval=5, failure_backoff=30)
+        router.refresh(wait=True)
+        self.assertEqual(router.choose().name, PRIMARY)
+        self.assertFalse(router.stats['r1']['available'])
+        self.assertIn('OperationalError', router.stats['r1']['error'])
+
+        router = self.router({'r1': DB_SETTINGS}, failure_backoff=30)
+        router.refresh(wait=True)
+        router.observe('r1', 0, 'OperationalError')
+        self.assertEqual(router.choose().name, PRIMARY)
+        self.clock.now = 31
+        router.refresh(wait=True)
+        self.assertEqual(router.choose().name, 'r1')
+        # Ошибки выполнения запроса (не соединения) реплику не исключают
+        router.observe('r1', 0, 'SampleTimeoutError')
+        self.assertEqual(router.choose().name, 'r1')
+
+    def test_lag(self):
+        router = self.router({'r1': DB_SETTINGS}, max_lag=30, check_interval=5)
+        with mock.patch('datasample.replicas.LAG_SQL', 'select 60'):
+            router.refresh(wait=True)
+            self.assertEqual(router.choose().name, PRIMARY)
+        self.assertEqual(router.stats['r1']['lag'], 60)
+        # До следующей проверки используется её результат
+        self.clock.now = 4
+        self.assertEqual(router.choose().name, PRIMARY)
+        self.clock.now = 5
+        router.refresh(wait=True)
+        self.assertEqual(router.choose().name, 'r1')
+
+    def test_check_timeout(self):
+        router = self.router({'r1': DB_SETTINGS}, check_timeout=0.5)
+        with mock.patch('datasample.replicas.psycopg2.connect', wraps=psycopg2.connect) as connect, \
+                mock.patch('datasample.replicas.LAG_SQL', 'select pg_sleep(2)'):
+            router.refresh(wait=True)
+        self.assertEqual(connect.call_args[1]['connect_timeout'], 1)
+        self.assertEqual(connect.call_args[1]['options'], '-c statement_timeout=500')
+        self.assertIn('statement timeout', router.stats['r1']['error'])
+        self.assertEqual(router.choose().name, PRIMARY)
+
+    def test_execute(self):
+        router = self.router({'r1': DB_SETTINGS})
+        options = {'fields': [['num', None]]}
+        self.assertEqual(len(router.execute(SAMPLE_METADATA, {}, options)), 3)
+        self.assertEqual(len(router.execute(SAMPLE_METADATA, {}, options, primary=True)), 3)
+
+    def test_retry(self):
+        """ Запрос, соединение которого с репликой не удалось, повторяется на основной БД """
+        router = self.router({'r1': DB_SETTINGS}, failure_backoff=30)
+        router.refresh(wait=True)
+        # Реплика прошла проверку, но стала недоступна
+        router._replicas['r1'].db_settings = DOWN_SETTINGS
+        options = {'fields': [['num', None]]}
+        self.assertEqual(len(router.execute(SAMPLE_METADATA, {}, options)), 3)
+        self.assertFalse(router.stats['r1']['available'])
+        self.clock.now = 31
+        router._replicas['r1'].checked = self.clock.now
+        routes = []
+
+        def run(route):
+            routes.append(route.name)
+            return execute(SAMPLE_METADATA, {}, options, route.db_settings)
+
+        self.assertEqual(len(router.run(run)), 3)
+        self.assertListEqual(routes, ['r1', PRIMARY])
+
+        self.clock.now = 62
+        router._replicas['r1'].checked = self.clock.now
+        routes.clear()
+
+        def iterate(route):
+            routes.append(route.name)
+            return execute_iter(SAMPLE_METADATA, {}, options, route.db_settings)
+
+        self.assertEqual(len(list(router.iterate(iterate))), 3)
+        self.assertListEqual(routes, ['r1', PRIMARY])
+        # Ошибки, не связанные с соединением, не повторяются
+        with self.assertRaises(ZeroDivisionError):
+            router.run(lambda route: 1 / 0, primary=True)
+
+    def test_negative(self):
+        for kwargs in ({'alpha': 0}, {'alpha': 1.5}, {'max_lag': -1}, {'check_interval': -1}):
+            with self.subTest(kwargs=kwargs), self.assertRaises(ValueError):
+                self.router({}, **kwargs)
+        with self.assertRaises(ValueError):
+            self.router({PRIMARY: DB_SETTINGS})
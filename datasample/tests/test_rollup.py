@@ -0,0 +1,120 @@
+import unittest
+
+from datasample import compose, execute
+from datasample.rollup import (Rollup, check_rollups, rollup_sql, with_rollups, match_rollup, create_rollup,
+                               refresh_rollup, drop_rollups, find_rollups)
+
+__all__ = (
+    'CheckRollupsTestCase',
+    'MatchRollupTestCase',
+    'RollupTablesTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+SAMPLE_METADATA = {
+    'tables': {
+        'main': "select i as num, i % 3 as grp, i / 4 as part, i * 10 as amount from generate_series(1, 10) as i",
+        'limits': "select i as top from generate_series(1, :TOP) as i",
+    },
+    'fields': {
+        'num': {'ctype': 'Integer', 'key': True, 'ordered': True, 'filtered': ('<=',)},
+        'grp': {'ctype': 'Integer', 'key': True, 'ordered': True, 'filtered': ('=',)},
+        'part': {'ctype': 'Integer', 'key': True, 'ordered': True, 'filtered': ('>=',)},
+        'amount': {'ctype': 'Integer', 'calc': ('sum', 'avg', 'min', 'max'), 'ordered': True, 'having': ('>',)},
+        'top': {'ctype': 'Integer', 'key': True, 'table': 'limits'},
+    },
+    'params': {'TOP': {'ctype': 'Integer'}},
+}
+TABLE = 'datasample_test_rollup'
+ROLLUPS = [
+    Rollup('datasample_test_rollup_wide', ('grp', 'part'), ('amount',), 6),
+    Rollup(TABLE, ('grp',), ('amount',), 3),
+]
+OPTIONS = {'fields': [['grp', None], ['amount', 'sum']], 'group': ['grp'], 'order': [['grp', 'asc']]}
+
+
+class CheckRollupsTestCase(unittest.TestCase):
+    def test_check(self):
+        rollups = [{'name': 'by_grp', 'keys': ['grp', 'part'], 'measures': ['amount'], 'incremental': 'part'}]
+        self.assertListEqual(check_rollups(rollups, SAMPLE_METADATA), rollups)
+        self.assertListEqual(check_rollups(None, SAMPLE_METADATA), [])
+
+    def test_negative(self):
+        for rollups in (
+            {'name': 'by_grp'},
+            [{'name': 'by grp', 'keys': ['grp']}],
+            [{'name': 'by_grp', 'keys': ['grp']}, {'name': 'by_grp', 'keys': ['part']}],
+            [{'name': 'by_grp', 'keys': []}],
+            [{'name': 'by_grp', 'keys': ['amount']}],
+            [{'name': 'by_grp', 'keys': ['grp'], 'measures': ['part']}],
+            [{'name': 'by_grp', 'keys': ['grp'], 'incremental': 'part'}],
+            [{'name': 'by_top', 'keys': ['top']}],  # подзапрос с параметром
+            [{'name': 'by_grp', 'keys': ['grp'], 'unknown': 1}],
+        ):
+            with self.subTest(rollups=rollups), self.assertRaises(ValueError):
+                check_rollups(rollups, SAMPLE_METADATA)
+
+
+class MatchRollupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sample = with_rollups(SAMPLE_METADATA, ROLLUPS)
+
+    def test_match(self):
+        # Наименьший подходящий предагрегат
+        self.assertEqual(match_rollup(self.sample, OPTIONS), ROLLUPS[1])
+        options = {**OPTIONS, 'filters': [['part', '>=', [1]]], 'having': [['amount', '>', [0]]]}
+        self.assertEqual(match_rollup(self.sample, options), ROLLUPS[0])
+        options = {'fields': [['grp', None], ['amount', 'avg']], 'group': ['grp'], 'order': [['amount', 'desc']]}
+        self.assertEqual(match_rollup(self.sample, options), ROLLUPS[1])
+
+    def test_no_match(self):
+        for options in (
+            {'fields': [['grp', None], ['amount', None]]},  # без группировки
+            {'fields': [['num', None], ['amount', 'sum']], 'group': ['num']},  # ключа нет в предагрегатах
+            {'fields': [['grp', None], ['amount', 'sum']], 'group': ['grp'], 'filters': [['num', '<=', [3]]]},
+        ):
+            with self.subTest(options=options):
+                self.assertIsNone(match_rollup(self.sample, options))
+        self.assertIsNone(match_rollup(with_rollups(SAMPLE_METADATA, ()), OPTIONS))
+
+    def test_compose(self):
+        query, _ = compose(self.sample, {'TOP': 1}, OPTIONS)
+        sql = str(query)
+        self.assertIn(f'FROM "{TABLE}" AS "_rollup"', sql)
+        self.assertIn('sum("_rollup"."amount__sum")', sql)
+        self.assertNotIn('generate_series', sql)
+        query, _ = compose(self.sample, {'TOP': 1}, {**OPTIONS, 'fields': [['grp', None], ['amount', 'avg']]})
+        self.assertIn('sum("_rollup"."amount__count")', str(query))
+
+
+class RollupTablesTestCase(unittest.TestCase):
+    def tearDown(self):
+        drop_rollups([TABLE], DB_SETTINGS)
+
+    def test_rollup(self):
+        self.assertEqual(create_rollup(SAMPLE_METADATA, TABLE, ['grp', 'part'], ['amount'], DB_SETTINGS), 9)
+        self.assertListEqual(find_rollups('datasample_test_rollup', DB_SETTINGS), [TABLE])
+        sample = with_rollups(SAMPLE_METADATA, [Rollup(TABLE, ('grp', 'part'), ('amount',), 9)])
+        for operation in ('sum', 'min', 'max', 'avg'):
+            options = {**OPTIONS, 'fields': [['grp', None], ['amount', operation]]}
+            with self.subTest(operation=operation):
+                self.assertListEqual([tuple(row) for row in execute(sample, {'TOP': 1}, options, DB_SETTINGS)],
+                                     [tuple(row) for row in execute(SAMPLE_METADATA, {'TOP': 1}, options,
+                                                                    DB_SETTINGS)])
+        # Пересчёт последних групп по incremental и полный пересчёт
+        self.assertEqual(refresh_rollup(SAMPLE_METADATA, TABLE, ['grp', 'part'], ['amount'], DB_SETTINGS, 'part'), 9)
+        self.assertEqual(refresh_rollup(SAMPLE_METADATA, TABLE, ['grp', 'part'], ['amount'], DB_SETTINGS), 9)
+        self.assertListEqual([tuple(row) for row in execute(sample, {'TOP': 1}, OPTIONS, DB_SETTINGS)],
+                             [(0, 180), (1, 220), (2, 150)])
+        drop_rollups([TABLE], DB_SETTINGS)
+        self.assertListEqual(find_rollups('datasample_test_rollup', DB_SETTINGS), [])
+
+    def test_sql(self):
+        sql = rollup_sql(SAMPLE_METADATA, ['grp'], ['amount'], 'grp')
+        self.assertIn('i %% 3', sql)
+        self.assertIn('>= %(watermark)s', sql)
+        self.assertIn('GROUP BY  "main"."grp"', sql)
@@ -10,6 +10,7 @@ from .fixtures import ETALON_FULL_SCHEMA_METADATA
 __all__ = (
     'SmokeSampleTestCase',
     'CheckFieldsOfSampleTestCase',
+    'SampleIndexesTestCase',
 )
 
 
@@ -96,3 +97,40 @@ class SmokeSampleTestCase(unittest.TestCase):
             self.assertDictEqual(sample.__getstate__(), ETALON_FULL_SCHEMA_METADATA)
         except SampleElementError as e:
             print(e)
+
+
+class SampleIndexesTestCase(unittest.TestCase):
+    """ Индексы возможностей полей строятся один раз на состояние СВД """
+
+    def setUp(self):
+        self.maxDiff = None
+        self.sample_metadata = {
+            'tables': {'main': 'select 1'},
+            'fields': {
+                'document_id': {'ctype': 'Integer', 'key': True, 'filtered': ('=', 'in'), 'hidden': True},
+                'amount': {'ctype': 'Decimal', 'calc': ('sum',), 'having': ('>',), 'ordered': True,
+                           'mandatory': True},
+            },
+            'params': {'YEAR': {'ctype': 'Integer'}},
+        }
+        self.sample = Sample(self.sample_metadata)
+
+    def test_indexes(self):
+        indexes = self.sample.indexes
+        self.assertIs(indexes, self.sample.indexes)
+        self.assertEqual(indexes.visible, {'amount'})
+        self.assertEqual(indexes.mandatory, {'amount'})
+        self.assertEqual(indexes.keys, {'document_id'})
+        self.assertEqual(indexes.having, {'amount'})
+        self.assertEqual(indexes.ordered, {'amount'})
+        self.assertEqual(indexes.filter_ops['document_id'], {'=', 'in'})
+        self.assertEqual(indexes.filter_ops['amount'], frozenset())
+        self.assertEqual(indexes.param_types['YEAR'], (int,))
+
+    def test_indexes_rebuild(self):
+        """ Изменение состояния СВД сбрасывает индексы """
+        indexes = self.sample.indexes
+        self.sample_metadata['fields']['document_id']['hidden'] = False
+        self.sample.state = self.sample_metadata
+        self.assertIsNot(indexes, self.sample.indexes)
+        self.assertEqual(self.sample.indexes.visible, {'amount', 'document_id'})
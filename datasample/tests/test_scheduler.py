@@ -0,0 +1,80 @@
+import unittest
+from time import sleep
+from threading import Thread
+
+from datasample import ExecutionScheduler, SampleOverloadError
+
+__all__ = (
+    'ExecutionSchedulerTestCase',
+)
+
+
+class ExecutionSchedulerTestCase(unittest.TestCase):
+    def run_waiting(self, scheduler, results, name, **kwargs):
+        """ Запустить ожидание места в отдельном потоке, результат - в results по мере получения места """
+        def target():
+            try:
+                with scheduler.slot(**kwargs):
+                    results.append(name)
+            except SampleOverloadError:
+                results.append(f'{name}:overload')
+        thread = Thread(target=target)
+        thread.start()
+        sleep(0.05)
+        return thread
+
+    def test_global_limit_and_priority(self):
+        scheduler = ExecutionScheduler(max_concurrent=1)
+        results = []
+        ticket = scheduler.acquire()
+        threads = [
+            self.run_waiting(scheduler, results, 'export', priority='export'),
+            self.run_waiting(scheduler, results, 'interactive', priority='interactive'),
+        ]
+        self.assertEqual(scheduler.stats['queue_depth'], 2)
+        scheduler.release(ticket)
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(results, ['interactive', 'export'])
+        self.assertEqual(scheduler.stats['running'], 0)
+        self.assertEqual(scheduler.stats['admitted'], 3)
+
+    def test_per_sample_limit(self):
+        """ Запрос упёршейся в ограничение СВД не задерживает запросы других СВД """
+        scheduler = ExecutionScheduler(max_concurrent=3, per_sample=1)
+        results = []
+        ticket = scheduler.acquire(sample='a')
+        blocked = self.run_waiting(scheduler, results, 'a', sample='a')
+        self.run_waiting(scheduler, results, 'b', sample='b').join()
+        self.assertListEqual(results, ['b'])
+        scheduler.release(ticket)
+        blocked.join()
+        self.assertListEqual(results, ['b', 'a'])
+
+    def test_per_user_limit(self):
+        scheduler = ExecutionScheduler(max_concurrent=3, per_user=1, queue_timeout=0.1)
+        with scheduler.slot(user=1):
+            with self.assertRaises(SampleOverloadError):
+                scheduler.acquire(user=1)
+            scheduler.release(scheduler.acquire(user=2))
+        self.assertEqual(scheduler.stats['timeouts'], 1)
+        self.assertEqual(scheduler.stats['queue_depth'], 0)
+
+    def test_queue_full(self):
+        scheduler = ExecutionScheduler(max_concurrent=1, max_queue=1, queue_timeout=1)
+        results = []
+        ticket = scheduler.acquire()
+        waiting = self.run_waiting(scheduler, results, 'waiting')
+        with self.assertRaises(SampleOverloadError):
+            scheduler.acquire()
+        scheduler.release(ticket)
+        waiting.join()
+        self.assertListEqual(results, ['waiting'])
+        self.assertEqual(scheduler.stats['rejected'], 1)
+        self.assertGreater(scheduler.stats['wait_max'], 0)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            ExecutionScheduler(max_concurrent=0)
+        with self.assertRaises(ValueError):
+            ExecutionScheduler().acquire(priority='urgent')
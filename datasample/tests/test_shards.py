@@ -0,0 +1,153 @@
+import unittest
+from decimal import Decimal
+
+import psycopg2
+
+from datasample import execute, close_all, CancelHandle, SampleCancelledError, SampleElementError
+from datasample.shards import execute_shards, merge_rows
+
+__all__ = (
+    'MergeRowsTestCase',
+    'ShardsTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1'
+}
+SHARD_NAMES = ('datasample_test_shard_1', 'datasample_test_shard_2')
+SHARDS = [{**DB_SETTINGS, 'NAME': name} for name in SHARD_NAMES]
+# Шард 1: num 1..6, шард 2: num 7..10
+SHARD_DATA = ((1, 6), (7, 10))
+SAMPLE_METADATA = {
+    'tables': {'main': "select num, grp, amount, square, label from datasample_shard_data"},
+    'fields': {
+        'num': {'ctype': 'Integer', 'key': True, 'ordered': True, 'filtered': ('<=', '>=')},
+        'grp': {'ctype': 'Integer', 'key': True, 'ordered': True},
+        'amount': {'ctype': 'Integer', 'calc': ('sum', 'avg', 'min', 'max'), 'ordered': True, 'having': ('>',)},
+        'square': {'ctype': 'Integer', 'calc': ('avg',)},
+        'label': {'ctype': 'String', 'calc': ('min', 'max'), 'ordered': True},
+    },
+    'params': {},
+}
+
+
+def _admin(sql: str) -> None:
+    conn = psycopg2.connect(dbname=DB_SETTINGS['NAME'], user=DB_SETTINGS['USER'], host=DB_SETTINGS['HOST'])
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+class MergeRowsTestCase(unittest.TestCase):
+    def test_merge(self):
+        fields = [['num', None], ['grp', None]]
+        options = {'fields': [['num', None]], 'order': [['grp', 'asc'], ['num', 'desc']], 'limit': 4}
+        # Строки шардов отсортированы по order, NULL - после остальных значений
+        rows = merge_rows([[(3, 0), (1, 1), (2, None)], [(5, 0), (6, 1), (4, 1)]], options, fields)
+        self.assertListEqual(rows, [(5,), (3,), (6,), (4,)])
+
+    def test_having(self):
+        fields = [['grp', None], ['amount', 'sum']]
+        options = {'fields': fields, 'group': ['grp'], 'having': [['amount', '>', [10]]],
+                   'order': [['amount', 'desc']], 'after': [40]}
+        self.assertListEqual(merge_rows([[(0, 50), (1, 5), (2, 30), (3, None), (4, 40)]], options, fields, True),
+                             [(2, 30)])
+
+
+class ShardsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        for name, (first, last) in zip(SHARD_NAMES, SHARD_DATA):
+            _admin(f"drop database if exists {name}")
+            _admin(f"create database {name}")
+            conn = psycopg2.connect(dbname=name, user=DB_SETTINGS['USER'], host=DB_SETTINGS['HOST'])
+            with conn, conn.cursor() as cursor:
+                cursor.execute("create table datasample_shard_data as "
+                               "select i as num, i %% 3 as grp, i * 10 as amount, i * i as square, "
+                               "'n' || i as label from generate_series(%s, %s) as i", (first, last))
+            conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        close_all()
+        for name in SHARD_NAMES:
+            _admin(f"drop database if exists {name}")
+
+    def setUp(self):
+        # Эталон - тот же запрос по всем данным в одной БД
+        _admin("create table datasample_shard_data as "
+               "select i as num, i % 3 as grp, i * 10 as amount, i * i as square, 'n' || i as label "
+               "from generate_series(1, 10) as i")
+
+    def tearDown(self):
+        _admin("drop table if exists datasample_shard_data")
+
+    def assertSameAsSingle(self, options: dict):
+        rows = execute(SAMPLE_METADATA, {}, options, SHARDS)
+        self.assertListEqual([tuple(row) for row in rows],
+                             [tuple(row) for row in execute(SAMPLE_METADATA, {}, options, DB_SETTINGS)])
+        return rows
+
+    def test_select(self):
+        for options in (
+            {'fields': [['num', None], ['amount', None]], 'order': [['num', 'desc']], 'limit': 5},
+            {'fields': [['num', None]], 'order': [['grp', 'asc'], ['num', 'asc']]},
+            {'fields': [['num', None]], 'filters': [['num', '>=', [5]]], 'order': [['num', 'asc']],
+             'limit': 3, 'after': [5]},
+        ):
+            with self.subTest(options=options):
+                self.assertSameAsSingle(options)
+        rows = execute(SAMPLE_METADATA, {}, {'fields': [['num', None]]}, SHARDS)
+        self.assertListEqual(sorted(row[0] for row in rows), list(range(1, 11)))
+
+    def test_group(self):
+        for operation in ('sum', 'min', 'max', 'avg'):
+            options = {'fields': [['grp', None], ['amount', operation]], 'group': ['grp'],
+                       'order': [['grp', 'asc']]}
+            with self.subTest(operation=operation):
+                self.assertSameAsSingle(options)
+        # Группировка без агрегатов: ключ группы, найденный на нескольких шардах, - одна строка
+        rows = self.assertSameAsSingle({'fields': [['grp', None]], 'group': ['grp'], 'order': [['grp', 'asc']]})
+        self.assertListEqual([tuple(row) for row in rows], [(0,), (1,), (2,)])
+        rows = self.assertSameAsSingle({'fields': [['amount', 'avg']]})
+        self.assertEqual(rows[0][0], Decimal(55))
+        self.assertSameAsSingle({'fields': [['grp', None], ['amount', 'sum']], 'group': ['grp'],
+                                 'filters': [['num', '<=', [8]]], 'having': [['amount', '>', [100]]],
+                                 'order': [['amount', 'desc']], 'limit': 1})
+
+    def test_average_scale(self):
+        """ Бесконечная дробь avg округляется до того же количества знаков, что и в PostgreSQL """
+        # Квадраты 5..10 на обоих шардах: 355 / 6
+        rows = self.assertSameAsSingle({'fields': [['square', 'avg']], 'filters': [['num', '>=', [5]]]})
+        self.assertEqual(str(rows[0][0]), '59.1666666666666667')
+        rows = self.assertSameAsSingle({'fields': [['grp', None], ['square', 'avg']], 'group': ['grp'],
+                                        'order': [['grp', 'asc']]})
+        self.assertEqual(str(rows[2][1]), '31.0000000000000000')
+
+    def test_timings(self):
+        result = execute_shards(SAMPLE_METADATA, {}, {'fields': [['num', None]]}, SHARDS)
+        self.assertListEqual([(timing.shard, timing.rows, timing.error) for timing in result.timings],
+                             [(0, 6, None), (1, 4, None)])
+        self.assertTrue(all(timing.duration > 0 for timing in result.timings))
+        self.assertEqual(result.timings[1].database, '127.0.0.1:5432/datasample_test_shard_2')
+
+    def test_errors(self):
+        for options in (
+            {'fields': [['grp', None], ['amount', 'sum']], 'group': ['grp'], 'order': [['num', 'asc']]},
+            # Порядок строк в Python не совпадает с collation БД
+            {'fields': [['label', None]], 'order': [['label', 'asc']]},
+            {'fields': [['grp', None], ['label', 'max']], 'group': ['grp']},
+        ):
+            with self.subTest(options=options), self.assertRaises(SampleElementError):
+                execute_shards(SAMPLE_METADATA, {}, options, SHARDS)
+        with self.assertRaises(ValueError):
+            execute(SAMPLE_METADATA, {}, {'fields': [['num', None]]}, SHARDS, result_format='columnar')
+        cancel = CancelHandle()
+        cancel.cancel()
+        with self.assertRaises(SampleCancelledError):
+            execute(SAMPLE_METADATA, {}, {'fields': [['num', None]]}, SHARDS, cancel=cancel)
@@ -1,5 +1,7 @@
+from typing import Union
+
 from .utils import add_message
-from .elements import Sample, CTYPES, SampleElementError, check_op_args
+from .elements import Sample, CompiledSample, SampleElementError, check_op_args
 
 __all__ = (
     'check_params',
@@ -7,29 +9,31 @@ __all__ = (
 )
 
 
-def check_params(params: dict, sample: Sample) -> bool:
+def check_params(params: dict, sample: Union[Sample, CompiledSample]) -> bool:
     """
         Проверить параметры на соответсвие описанию схемы выборки
 
     :param params: словарь значений параметров
-    :param sample: объект Описание схемы выборки данных
+    :param sample: объект Описание схемы выборки данных (Sample или CompiledSample)
     :return: True или вызов исключения
     """
     messages = dict()
-    for param_name, param_state in sample.params.items():
+    for param_name, param_types in sample.indexes.param_types.items():
         if param_name not in params:
             raise ValueError(f"Parameter '{param_name}' is not defined.")
-        elif not isinstance(params[param_name], CTYPES[param_state['ctype']]):
+        elif not isinstance(params[param_name], param_types):
             messages[f"params[{param_name}]"] = \
-                f"Incorect type: given {type(params[param_name])} but waiting one of {CTYPES[param_state['ctype']]}"
+                f"Incorect type: given {type(params[param_name])} but waiting one of {param_types}"
     if messages:
         raise SampleElementError(messages)
     return True
 
 
-def check_options(options: dict, sample: Sample):
+def check_options(options: dict, sample: Union[Sample, CompiledSample]):
     """ Проверить настройки на соответсвие описанию схемы выборки """
     messages = dict()
+    # Индексы возможностей полей строятся в СВД один раз, а не при каждой проверке
+    indexes = sample.indexes
 
     # Поля должны быть из описания схемы, не скрытые, и обязательные
     if 'fields' in options.keys():
@@ -49,17 +53,14 @@ def check_options(options: dict, sample: Sample):
                             f"'{field}' описание поля может быть "
                             f"<field_name>:str | tuple(<field_name>:str, <operation>:str)")
 
-        # Допустимые поля СВД для использования в настройках
-        sample_fields = {name for name, state in sample.fields.items() if not state['hidden']}
-        # Не предусмотренные в СВД поля
-        unknown_fields = options_fields - sample_fields
+        # Не предусмотренные в СВД поля (допустимы только не скрытые поля)
+        unknown_fields = options_fields - indexes.visible
         if unknown_fields:
             add_message(messages,
                         'options[fields]',
                         f"не известные поля: {unknown_fields}")
         # Обязательныве поля, которые отсутствуют в настройках
-        mandatory_absent_fields = \
-            {name for name, state in sample.fields.items() if state['mandatory']} - options_fields
+        mandatory_absent_fields = indexes.mandatory - options_fields
         if mandatory_absent_fields:
             add_message(messages,
                         'options[fields]',
@@ -72,14 +73,14 @@ def check_options(options: dict, sample: Sample):
     if 'filters' in options.keys():
         for field_name, operation, args in options['filters']:
             # В фильтрации могут участвовать только известные поля
-            if field_name not in sample.fields.keys():
+            if field_name not in indexes.filter_ops:
                 add_message(messages,
                             'options[filters]',
                             f"не известное поле в фильтре: {field_name}")
 
             # В фильтрации могут участвовать только поля с признаком фильтарции
             # и допустимой для этого типа операцией сравнения
-            elif bool(sample.fields[field_name]['filtered']) and operation not in sample.fields[field_name]['filtered']:
+            elif indexes.filter_ops[field_name] and operation not in indexes.filter_ops[field_name]:
                 add_message(messages,
                             f"options[filters][{field_name}]",
                             f"не допустимая операция: {repr(operation)}")
@@ -99,8 +100,7 @@ def check_options(options: dict, sample: Sample):
                         f"'group' должно быть перечислением имён полей.")
         # Могут входить только ключевые поля
         order_fields = {*options['group']}
-        sample_orders = {name for name, state in sample.fields.items() if state['key']}
-        unknown_orders = order_fields - sample_orders
+        unknown_orders = order_fields - indexes.keys
         if unknown_orders:
             add_message(messages,
                         'options[group]',
@@ -113,15 +113,15 @@ def check_options(options: dict, sample: Sample):
                         f"'having' должно быть перечислением имён полей.")
         # Могут входить только вычислимые поля
         having_fields = {descriptor[0] for descriptor in options['having']}
-        sample_calcs = {name for name, state in sample.fields.items() if state['having']}
-        unknown_havings = having_fields - sample_calcs
+        unknown_havings = having_fields - indexes.having
         if unknown_havings:
             add_message(messages,
                         'options[having]',
                         f"не известные или недопустимые для отсева поля: {unknown_havings}")
         # Только допустимые операции
         for field_name, operation, args in options['having']:
-            if bool(sample.fields[field_name]['having']) and operation not in sample.fields[field_name]['having']:
+            having_ops = indexes.having_ops.get(field_name)
+            if having_ops and operation not in having_ops:
                 add_message(messages,
                             f"options[having][{field_name}]",
                             f"недопустимая операция: {repr(operation)}")
@@ -132,8 +132,7 @@ def check_options(options: dict, sample: Sample):
                         f"options[order]",
                         f"'order' должно быть перечислением имён полей.")
         order_fields = {field for field, *_ in options['order']}
-        sample_orders = {name for name, state in sample.fields.items() if state['ordered']}
-        unknown_orders = order_fields - sample_orders
+        unknown_orders = order_fields - indexes.ordered
         if unknown_orders:
             add_message(messages,
                         'options[order]',
@@ -144,6 +143,40 @@ def check_options(options: dict, sample: Sample):
                             f"options[order]",
                             f"неизвестный тип сортировки '{direct}' для поля {field_name}.")
 
+    if 'limit' in options.keys():
+        if not isinstance(options['limit'], int) or isinstance(options['limit'], bool) or options['limit'] < 1:
+            add_message(messages,
+                        'options[limit]',
+                        f"'limit' должно быть положительным целым числом.")
+
+    if 'after' in options.keys():
+        # Курсор keyset-пагинации - значения всех полей сортировки последней строки предыдущей страницы.
+        # Сравнение строк (a, b) > (:a, :b) корректно, только если набор полей сортировки уникален
+        # и не содержит NULL: иначе строки с равными ключами или NULL пропускаются между страницами
+        order = options.get('order') or ()
+        if not order:
+            add_message(messages,
+                        'options[after]',
+                        f"для 'after' должна быть задана непустая сортировка 'order'.")
+        elif not isinstance(options['after'], (tuple, list)) or len(options['after']) != len(order):
+            add_message(messages,
+                        'options[after]',
+                        f"'after' должно быть перечислением значений всех полей сортировки 'order'.")
+        elif any(value is None for value in options['after']):
+            add_message(messages,
+                        'options[after]',
+                        f"'after' не может содержать null: поля сортировки для курсора не должны допускать NULL.")
+        if len({direct for _, direct in order}) > 1:
+            add_message(messages,
+                        'options[after]',
+                        f"для 'after' все поля сортировки должны иметь одинаковое направление.")
+        column_fields = {field[0] if isinstance(field, (tuple, list)) else field for field in options.get('fields', ())}
+        absent_fields = {field for field, *_ in order} - column_fields
+        if absent_fields:
+            add_message(messages,
+                        'options[after]',
+                        f"поля сортировки должны входить в 'fields': {absent_fields}")
+
     if messages:
         raise SampleElementError(messages)
     return True
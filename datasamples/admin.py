@@ -1,13 +1,84 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
 
-from .models import Sample
+from .models import Sample, SampleJob, SampleExecution, SampleRollup
+from .materialize import refresh_sample
+from .querylog import latency_by_revision
 
 
 @admin.register(Sample)
 class SampleAdmin(admin.ModelAdmin):
-    readonly_fields = ('obj', 'src', 'revision', 'created', 'updated')
+    readonly_fields = ('obj', 'src', 'revision', 'created', 'updated', 'materialized_revision', 'refreshed')
     fieldsets = (
         (None, {'fields': ('name', 'description', 'created',)},),
         ('Change info', {'fields': ('publisher', 'version', 'author', 'revision', 'updated',)},),
+        ('Execution', {'fields': ('execution', 'materialized_revision', 'refreshed')},),
     )
     list_display = ('name', 'revision', 'author', 'version', 'publisher')
+    actions = ('refresh_views',)
+
+    def refresh_views(self, request, queryset):
+        """ Создать или обновить материализованные представления выбранных СВД (см. datasamples.materialize) """
+        refreshed = 0
+        for sample in queryset:
+            try:
+                refreshed += refresh_sample(sample, force=True)
+            except Exception as e:
+                self.message_user(request, f"{sample.name} {sample.version}: {e}", messages.ERROR)
+        self.message_user(request, f"Refreshed materialized views of {refreshed} samples")
+    refresh_views.short_description = "Обновить материализованные представления"
+
+
+@admin.register(SampleJob)
+class SampleJobAdmin(admin.ModelAdmin):
+    readonly_fields = ('rows_fetched', 'result_file', 'error', 'worker', 'created', 'started', 'heartbeat', 'finished')
+    list_display = ('pk', 'sample', 'user', 'format', 'status', 'rows_fetched', 'created', 'finished')
+    list_filter = ('status', 'format')
+
+
+@admin.register(SampleExecution)
+class SampleExecutionAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/datasamples/sampleexecution/change_list.html'
+    list_display = ('started', 'sample', 'revision', 'user', 'duration', 'rows', 'cached', 'slow', 'error')
+    list_filter = ('slow', 'cached', 'sample')
+    date_hierarchy = 'started'
+    readonly_fields = ('sample', 'revision', 'user', 'options_fingerprint', 'started', 'duration', 'phases',
+                       'rows', 'cached', 'error', 'slow', 'sql', 'binds', 'params', 'options')
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path('latency/', self.admin_site.admin_view(self.latency_view),
+                 name='datasamples_sampleexecution_latency'),
+        ] + super().get_urls()
+
+    def latency_view(self, request):
+        """ Перцентили длительности выполнения по СВД и revision (см. datasamples.querylog.latency_by_revision) """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = max(int(request.GET.get('days', 7)), 1)
+        except ValueError:
+            days = 7
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Длительность выполнения СВД за {days} дн.",
+            'days': days,
+            'stats': latency_by_revision(days),
+        }
+        return TemplateResponse(request, 'admin/datasamples/sampleexecution/latency.html', context)
+
+
+@admin.register(SampleRollup)
+class SampleRollupAdmin(admin.ModelAdmin):
+    list_display = ('sample', 'name', 'revision', 'table', 'rows', 'refreshed')
+    list_filter = ('sample',)
+    readonly_fields = ('sample', 'name', 'revision', 'table', 'keys', 'measures', 'rows', 'refreshed')
+
+    def has_add_permission(self, request):
+        return False
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ReposConfig(AppConfig):
     name = 'datasamples'
+
+    def ready(self):
+        from .metrics import install_sinks
+        # Замеры включаются при запуске, а не при первом обращении к /metrics
+        install_sinks()
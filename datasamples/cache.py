@@ -0,0 +1,184 @@
+"""
+    Кэш результатов выполнения СВД для Django-проекта
+
+Параметры задаются в settings.DATASAMPLE_RESULT_CACHE:
+    BACKEND      - 'local' - кэш в памяти процесса (datasample.cache.ResultCache),
+                   'django' - общий для всех процессов кэш на основе django.core.cache (DjangoResultCache)
+    MAX_BYTES    - максимальный размер кэша ('local') или одного сжатого результата ('django')
+    TTL          - время жизни результата в секундах (0 - кэш отключен)
+    SAMPLE_TTL   - словарь <имя СВД>: <время жизни результатов этой СВД>
+    CACHE_ALIAS  - алиас кэша из settings.CACHES для BACKEND='django'
+    LOCK_TIMEOUT - сколько секунд одинаковые запросы ждут результат выполняющегося запроса ('django')
+"""
+import zlib
+import pickle
+from uuid import uuid4
+from time import monotonic, sleep
+from threading import Lock
+from django.conf import settings
+from django.core.cache import caches
+
+from datasample.cache import ResultCache, result_key
+from datasample.sqlalchemytools import execute
+
+__all__ = (
+    'DjangoResultCache',
+    'get_result_cache',
+)
+
+
+class DjangoResultCache:
+    """
+        Общий для процессов кэш результатов на основе django.core.cache
+
+    Результаты хранятся сжатыми (zlib) в pickle-представлении.
+    Одинаковые запросы, выполняемые одновременно в разных процессах, объединяются (single-flight):
+    запрос к БД выполняет только получивший ключ блокировки, остальные ждут его результат в кэше.
+    Если результат не может быть сохранён (TTL <= 0 или сжатый результат больше max_bytes),
+    запросы выполняются без ожидания: ждать в кэше нечего.
+    Инвалидация СВД и очистка кэша выполняются сменой поколения ключей (СВД или всего кэша),
+    поэтому записи других пользователей того же кэша Django не затрагиваются, а старые записи удаляются по TTL.
+    """
+
+    def __init__(self, alias: str = 'default', ttl: float = 300, sample_ttl: dict = None,
+                 max_bytes: int = 1024 * 1024, lock_timeout: float = 60, wait_interval: float = 0.05,
+                 prefix: str = 'datasample'):
+        self.alias = alias
+        self.ttl = ttl
+        self.sample_ttl = dict(sample_ttl or {})
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self.wait_interval = wait_interval
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # сколько запросов получили результат, выполненный другим запросом
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
+
+    def _cache_key(self, key: str, name: str) -> str:
+        generations = self.cache.get_many([f'{self.prefix}:gen', f'{self.prefix}:gen:{name}'])
+        return (f"{self.prefix}:result:{generations.get(f'{self.prefix}:gen', 0)}:"
+                f"{name}:{generations.get(f'{self.prefix}:gen:{name}', 0)}:{key}")
+
+    def _bump(self, gen_key: str) -> None:
+        self.cache.add(gen_key, 0, None)
+        try:
+            self.cache.incr(gen_key)
+        except ValueError:  # ключ успели удалить между add и incr
+            self.cache.set(gen_key, 1, None)
+
+    def _load(self, key: str, name: str):
+        value = self.cache.get(self._cache_key(key, name))
+        return None if value is None else pickle.loads(zlib.decompress(value))
+
+    def get(self, key: str, name: str):
+        """ Получить результат СВД name по ключу или None """
+        rows = self._load(key, name)
+        if rows is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rows
+
+    def set(self, key: str, name: str, rows) -> list:
+        """ Сохранить результат выполнения СВД name. Возвращает сохранённое представление результата """
+        rows = [tuple(row) for row in rows]
+        ttl = self.sample_ttl.get(name, self.ttl)
+        if ttl <= 0:
+            return rows
+        value = zlib.compress(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        if len(value) <= self.max_bytes:
+            self.cache.set(self._cache_key(key, name), value, ttl)
+        else:
+            # Ожидающие одинаковые запросы не получат результат из кэша - пусть выполняются сами
+            self.cache.set(f'{self.prefix}:uncacheable:{key}', True, max(ttl, self.lock_timeout))
+        return rows
+
+    def invalidate(self, name: str) -> None:
+        """ Сделать недоступными все результаты СВД name во всех процессах """
+        self._bump(f'{self.prefix}:gen:{name}')
+
+    def clear(self) -> None:
+        """ Сделать недоступными все результаты этого кэша (другие записи кэша Django не удаляются) """
+        self._bump(f'{self.prefix}:gen')
+
+    def execute(self, name: str, revision, sample_meta, params: dict, options: dict, db_settings: dict,
+                **execute_options) -> list:
+        """
+            Выполнить СВД через кэш с объединением одновременных одинаковых запросов
+
+        :param name: имя СВД
+        :param revision: номер изменения описания СВД (любое JSON-совместимое значение)
+        :param execute_options: параметры выполнения запроса (timeout, cancel)
+        :return: список кортежей
+        """
+        key = result_key(name, revision, params, options, db_settings)
+        if self.sample_ttl.get(name, self.ttl) <= 0:
+            return self.set(key, name, execute(sample_meta, params, options, db_settings, **execute_options))
+        rows = self.get(key, name)
+        if rows is not None:
+            return rows
+        uncacheable_key = f'{self.prefix}:uncacheable:{key}'
+        lock_key = f'{self.prefix}:lock:{key}'
+        token = uuid4().hex
+        deadline = monotonic() + self.lock_timeout
+        # Результат уже оказался слишком большим для кэша - выполняем без ожидания
+        while monotonic() < deadline and not self.cache.get(uncacheable_key):
+            if self.cache.add(lock_key, token, self.lock_timeout):
+                try:
+                    # Результат мог появиться, пока мы ждали освобождения блокировки
+                    rows = self._load(key, name)
+                    if rows is None:
+                        rows = self.set(key, name, execute(sample_meta, params, options, db_settings,
+                                                           **execute_options))
+                    return rows
+                finally:
+                    if self.cache.get(lock_key) == token:
+                        self.cache.delete(lock_key)
+            sleep(self.wait_interval)
+            rows = self._load(key, name)
+            if rows is not None:
+                self.coalesced += 1
+                return rows
+        # Выполняющий запрос не уложился в lock_timeout или его результат не сохраняется в кэш -
+        # выполняем самостоятельно
+        return self.set(key, name, execute(sample_meta, params, options, db_settings, **execute_options))
+
+
+_lock = Lock()
+_result_cache = None
+
+
+def get_result_cache():
+    """ Кэш результатов процесса, создаётся при первом обращении по настройкам проекта """
+    global _result_cache
+    if _result_cache is None:
+        with _lock:
+            if _result_cache is None:
+                config = getattr(settings, 'DATASAMPLE_RESULT_CACHE', {})
+                if config.get('BACKEND', 'local') == 'django':
+                    _result_cache = DjangoResultCache(
+                        alias=config.get('CACHE_ALIAS', 'default'),
+                        ttl=config.get('TTL', 300),
+                        sample_ttl=config.get('SAMPLE_TTL'),
+                        max_bytes=config.get('MAX_BYTES', 1024 * 1024),
+                        lock_timeout=config.get('LOCK_TIMEOUT', 60),
+                    )
+                else:
+                    _result_cache = ResultCache(
+                        max_bytes=config.get('MAX_BYTES', 64 * 1024 * 1024),
+                        ttl=config.get('TTL', 300),
+                        sample_ttl=config.get('SAMPLE_TTL'),
+                    )
+    return _result_cache
@@ -0,0 +1,33 @@
+"""
+    Бюджет стоимости запросов СВД для Django-проекта
+
+Общий бюджет задаётся в settings.DATASAMPLE_COST_GUARD (см. datasample.guard.BUDGET_DEFAULTS):
+    MAX_COST, MAX_ROWS, ON_EXCEED, CAP_ROWS - параметры бюджета
+    MAX_PLANS - количество кэшируемых оценок запросов
+Бюджет конкретной СВД - Sample.execution['budget'] (ключи в нижнем регистре).
+"""
+from threading import Lock
+from django.conf import settings
+
+from datasample.guard import BUDGET_DEFAULTS, CostGuard
+
+__all__ = (
+    'get_cost_guard',
+)
+
+_lock = Lock()
+_cost_guard = None
+
+
+def get_cost_guard() -> CostGuard:
+    """ Проверка стоимости запросов процесса, создаётся при первом обращении по настройкам проекта """
+    global _cost_guard
+    if _cost_guard is None:
+        with _lock:
+            if _cost_guard is None:
+                config = getattr(settings, 'DATASAMPLE_COST_GUARD', {})
+                _cost_guard = CostGuard(
+                    budget={key: config[key.upper()] for key in BUDGET_DEFAULTS if key.upper() in config},
+                    max_plans=config.get('MAX_PLANS', 1024),
+                )
+    return _cost_guard
@@ -0,0 +1,235 @@
+"""
+    Фоновое выполнение СВД (SampleJob) без внешнего брокера
+
+Задания хранятся в БД проекта. Обработчики (python manage.py run_sample_jobs) забирают
+задания в порядке создания через SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько
+процессов не получат одно задание. Результат пишется во временный файл, который
+переименовывается в settings.DATASAMPLE_JOBS['RESULT_DIR'] только после успешной записи.
+Пока задание выполняется, обработчик периодически отмечает его (SampleJob.heartbeat): задание,
+обработчик которого перестал отмечаться (процесс упал или был убит), завершается с ошибкой.
+Обработчики также удаляют завершённые задания старше RETENTION вместе с файлами результатов
+и файлы в RESULT_DIR, не принадлежащие заданиям (например, недописанные файлы упавших обработчиков).
+
+Параметры задаются в settings.DATASAMPLE_JOBS:
+    RESULT_DIR        - каталог файлов результатов
+    WORKERS           - количество процессов-обработчиков
+    POLL_INTERVAL     - через сколько секунд проверять очередь, если заданий нет
+    PROGRESS_INTERVAL - как часто (в секундах) сохранять количество полученных строк
+    TIMEOUT           - ограничение времени одного обращения к БД в секундах (None - без ограничения)
+    STALE_AFTER       - через сколько секунд без отметки обработчика задание считается потерянным
+    RETENTION         - сколько секунд хранить завершённые задания и их результаты (None - не удалять)
+    CLEANUP_INTERVAL  - как часто (в секундах) обработчик ищет потерянные и устаревшие задания
+"""
+import os
+import socket
+import logging
+from time import monotonic, time
+from datetime import timedelta
+from threading import Event, Thread
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.transaction import atomic
+from django.utils.timezone import now
+
+from .models import SampleJob
+from .replicas import run_routed
+
+__all__ = (
+    'EXTENSIONS',
+    'CONTENT_TYPES',
+    'get_jobs_settings',
+    'result_path',
+    'claim_job',
+    'run_job',
+    'fail_stale_jobs',
+    'cleanup_jobs',
+    'work',
+)
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    'csv': 'csv',
+    'ndjson': 'ndjson',
+    'arrow': 'arrows',
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def get_jobs_settings() -> dict:
+    return {
+        'RESULT_DIR': os.path.join(settings.BASE_DIR, 'jobs'),
+        'WORKERS': 2,
+        'POLL_INTERVAL': 1,
+        'PROGRESS_INTERVAL': 1,
+        'TIMEOUT': None,
+        'STALE_AFTER': 300,
+        'RETENTION': 7 * 24 * 3600,
+        'CLEANUP_INTERVAL': 60,
+        **getattr(settings, 'DATASAMPLE_JOBS', {}),
+    }
+
+
+def result_path(job: SampleJob) -> str:
+    """ Полный путь к файлу результата задания """
+    return os.path.join(get_jobs_settings()['RESULT_DIR'], job.result_file)
+
+
+def claim_job(worker: str):
+    """ Забрать самое раннее задание из очереди. None - заданий нет """
+    with atomic():
+        job = (SampleJob.objects.select_for_update(skip_locked=True)
+               .filter(status=SampleJob.QUEUED).order_by('created', 'pk').first())
+        if job is None:
+            return None
+        job.status = SampleJob.RUNNING
+        job.started = job.heartbeat = now()
+        job.worker = worker
+        job.save(update_fields=['status', 'started', 'heartbeat', 'worker'])
+    return job
+
+
+def _heartbeat(pk: int, interval: float, stop: Event) -> None:
+    """ Отмечать выполняемое задание, пока не установлено stop (поток со своим соединением с БД) """
+    try:
+        while not stop.wait(interval):
+            SampleJob.objects.filter(pk=pk, status=SampleJob.RUNNING).update(heartbeat=now())
+    finally:
+        connection.close()
+
+
+def run_job(job: SampleJob) -> None:
+    """ Выполнить задание и записать результат в файл. Ошибка выполнения сохраняется в задании """
+    config = get_jobs_settings()
+    job.result_file = f"{job.pk}.{EXTENSIONS[job.format]}"
+    path = result_path(job)
+    part_path = f"{path}.part"
+    last_progress = monotonic()
+
+    def progress(rows: int):
+        nonlocal last_progress
+        if monotonic() - last_progress >= config['PROGRESS_INTERVAL']:
+            SampleJob.objects.filter(pk=job.pk).update(rows_fetched=rows)
+            last_progress = monotonic()
+
+    # Отметки чаще STALE_AFTER, чтобы выполняемое задание не сочли потерянным
+    stop_heartbeat = Event()
+    Thread(target=_heartbeat, args=(job.pk, config['STALE_AFTER'] / 3, stop_heartbeat), daemon=True).start()
+    try:
+        os.makedirs(config['RESULT_DIR'], exist_ok=True)
+        with open(part_path, 'wb') as fileobj:
+            def write(db_settings: dict) -> int:
+                # При повторе на основной БД после ошибки соединения с репликой результат пишется заново
+                fileobj.seek(0)
+                fileobj.truncate()
+                return job.sample.write_result(job.params, job.options, db_settings, fileobj, user=job.user_id,
+                                               format=job.format, progress=progress, timeout=config['TIMEOUT'])
+
+            job.rows_fetched = run_routed(job.sample, write)
+        os.replace(part_path, path)
+    except Exception as e:
+        logger.exception("Sample job %s failed", job.pk)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        job.status = SampleJob.FAILED
+        job.result_file = ''
+        job.error = str(e)
+    else:
+        job.status = SampleJob.DONE
+    finally:
+        stop_heartbeat.set()
+    job.finished = now()
+    job.save(update_fields=['status', 'rows_fetched', 'result_file', 'error', 'finished'])
+
+
+def fail_stale_jobs(stale_after: float = None) -> int:
+    """
+        Завершить с ошибкой выполняемые задания, обработчик которых не отмечался stale_after секунд
+
+    Такие задания не возвращаются в очередь: задание, из-за которого падает обработчик, не должно
+    выполняться повторно. Недописанные файлы результатов удаляет cleanup_jobs.
+    :return: количество завершённых заданий
+    """
+    stale_after = get_jobs_settings()['STALE_AFTER'] if stale_after is None else stale_after
+    deadline = now() - timedelta(seconds=stale_after)
+    stale = SampleJob.objects.filter(Q(heartbeat__lt=deadline) | Q(heartbeat__isnull=True, started__lt=deadline),
+                                     status=SampleJob.RUNNING)
+    count = stale.update(status=SampleJob.FAILED, result_file='', finished=now(),
+                         error=f"Обработчик задания не отвечал больше {stale_after} секунд")
+    if count:
+        logger.warning("%s stale sample jobs failed", count)
+    return count
+
+
+def cleanup_jobs(retention: float = None) -> int:
+    """
+        Удалить завершённые задания старше retention секунд с их файлами и файлы RESULT_DIR без заданий
+
+    Файлы без заданий удаляются, только если не изменялись дольше STALE_AFTER (их мог только что создать
+    обработчик). retention = None - завершённые задания не удаляются.
+    :return: количество удалённых заданий
+    """
+    config = get_jobs_settings()
+    retention = config['RETENTION'] if retention is None else retention
+    count = 0
+    if retention is not None:
+        expired = SampleJob.objects.filter(status__in=(SampleJob.DONE, SampleJob.FAILED),
+                                           finished__lt=now() - timedelta(seconds=retention))
+        for job in expired.exclude(result_file=''):
+            try:
+                os.remove(result_path(job))
+            except FileNotFoundError:
+                pass
+        count = len(expired.values_list('pk', flat=True))
+        expired.delete()
+    if not os.path.isdir(config['RESULT_DIR']):
+        return count
+    # Файлы готовых заданий и недописанные файлы выполняемых
+    known = set(SampleJob.objects.filter(status=SampleJob.DONE).values_list('result_file', flat=True))
+    known.update(f"{pk}.{EXTENSIONS[result_format]}.part" for pk, result_format in
+                 SampleJob.objects.filter(status=SampleJob.RUNNING).values_list('pk', 'format'))
+    modified_before = time() - config['STALE_AFTER']
+    for entry in os.scandir(config['RESULT_DIR']):
+        if entry.is_file() and entry.name not in known:
+            try:
+                if entry.stat().st_mtime < modified_before:
+                    os.remove(entry.path)
+            except FileNotFoundError:  # удалил другой обработчик
+                pass
+    return count
+
+
+def work(poll_interval: float = None, stop: Event = None, once: bool = False) -> int:
+    """
+        Цикл обработчика заданий
+
+    :param poll_interval: через сколько секунд проверять очередь, если заданий нет
+    :param stop: событие остановки обработчика (текущее задание выполняется до конца)
+    :param once: выполнить все задания из очереди и завершиться
+    :return: количество выполненных заданий
+    """
+    config = get_jobs_settings()
+    poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+    stop = stop or Event()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    done = 0
+    next_cleanup = monotonic()
+    while not stop.is_set():
+        if monotonic() >= next_cleanup:
+            fail_stale_jobs()
+            cleanup_jobs()
+            next_cleanup = monotonic() + config['CLEANUP_INTERVAL']
+        job = claim_job(worker)
+        if job is None:
+            if once:
+                break
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+        done += 1
+    return done
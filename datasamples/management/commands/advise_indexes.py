@@ -0,0 +1,59 @@
+import pickle
+from django.core.management.base import BaseCommand, CommandError
+
+import datasample
+from datasample.advisor import ADVISOR_METHODS, advise_indexes
+from datasamples.models import Sample
+from datasamples.querylog import execution_workload
+from datasamples.utils import get_db_settings
+
+
+class Command(BaseCommand):
+    help = ("Подобрать индексы по рабочей нагрузке СВД из журнала выполнений "
+            "(фильтры, группировки и сортировки настроек, см. datasample.advisor)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Имя СВД (по-умолчанию - все активные СВД)")
+        parser.add_argument('version', nargs='?', help="Версия СВД")
+        parser.add_argument('--days', type=int, default=7, help="За сколько последних дней брать выполнения")
+        parser.add_argument('--method', choices=ADVISOR_METHODS, default='auto',
+                            help="Способ оценки плана с индексом: hypopg - гипотетический индекс, "
+                                 "transaction - индекс в откатываемой транзакции (строится на БД, "
+                                 "выбирается только явно), auto - hypopg, если расширение установлено")
+        parser.add_argument('--min-gain', type=float, default=0.05,
+                            help="Наименьшая доля снижения стоимости нагрузки для рекомендации")
+        parser.add_argument('--max-columns', type=int, default=3, help="Наибольшее количество колонок индекса")
+        parser.add_argument('--sql', action='store_true', help="Вывести только команды создания индексов")
+
+    def handle(self, *args, **options):
+        samples = Sample.objects.filter(is_active=True, deleted=False).order_by('name', 'version')
+        if options['name']:
+            samples = samples.filter(name=options['name'])
+        if options['version']:
+            samples = samples.filter(version=options['version'])
+        if options['name'] and not samples:
+            raise CommandError(f"Active sample {options['name']} {options['version'] or ''} not found")
+
+        statements = dict()  # индекс может быть рекомендован нескольким СВД
+        for instance in samples:
+            workload = execution_workload(instance, options['days'])
+            if not workload:
+                continue
+            try:
+                advices = advise_indexes(pickle.loads(instance.obj), workload, get_db_settings(),
+                                         options['method'], options['min_gain'], options['max_columns'])
+            except (datasample.SampleElementError, datasample.SampleExecutionError) as e:
+                raise CommandError(f"{instance.name} {instance.version}: {e}")
+            if options['sql']:
+                statements.update((advice.statement, None) for advice in advices)
+                continue
+            self.stdout.write(f"{instance.name} {instance.version} (revision {instance.revision}): "
+                              f"{len(workload)} query shapes, {sum(weight for *_, weight in workload)} executions")
+            for advice in advices:
+                self.stdout.write(f"  {advice.statement}\n"
+                                  f"    gain {advice.gain:.1%}, cost {advice.cost_before:.0f} -> "
+                                  f"{advice.cost_after:.0f}, improves {advice.queries} executions")
+            if not advices:
+                self.stdout.write("  no indexes recommended")
+        for statement in statements:
+            self.stdout.write(statement)
@@ -0,0 +1,62 @@
+import sys
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+import datasample
+from datasamples.models import Sample
+from datasamples.replicas import read_route, run_routed
+
+
+class Command(BaseCommand):
+    help = "Выгрузить результат выполнения активной СВД в CSV через PostgreSQL COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Имя СВД")
+        parser.add_argument('version', help="Версия СВД")
+        parser.add_argument('--params', default='{}', help="Значения параметров в JSON")
+        parser.add_argument('--options', required=True, help="Настройки выборки в JSON или @<путь к JSON-файлу>")
+        parser.add_argument('--output', '-o', help="Файл для выгрузки (по-умолчанию - stdout)")
+        parser.add_argument('--timeout', type=float, help="Ограничение времени выгрузки в секундах")
+
+    @staticmethod
+    def load_json(value: str):
+        if value.startswith('@'):
+            with open(value[1:], encoding='utf-8') as f:
+                return json.load(f)
+        return json.loads(value)
+
+    def handle(self, *args, **options):
+        try:
+            instance = Sample.objects.get(name=options['name'], version=options['version'],
+                                          is_active=True, deleted=False)
+        except Sample.DoesNotExist:
+            raise CommandError(f"Active sample {options['name']} {options['version']} not found")
+        try:
+            params = self.load_json(options['params'])
+            sample_options = self.load_json(options['options'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            if options['output']:
+                def export(db_settings: dict) -> int:
+                    # При повторе на основной БД после ошибки соединения с репликой файл пишется заново
+                    output.seek(0)
+                    output.truncate()
+                    return instance.export_csv(params, sample_options, db_settings, output,
+                                               timeout=options['timeout'])
+
+                rows = run_routed(instance, export)
+            else:
+                # Выведенные в stdout строки не отменить - без повтора на основной БД
+                route = read_route(instance)
+                with datasample.labels(replica=route.name):
+                    rows = instance.export_csv(params, sample_options, route.db_settings, output,
+                                               timeout=options['timeout'])
+        except (datasample.SampleElementError, datasample.SampleExecutionError) as e:
+            raise CommandError(str(e))
+        finally:
+            if options['output']:
+                output.close()
+        # Без --output stdout занят выгрузкой
+        (self.stdout if options['output'] else self.stderr).write(f"{rows} rows exported")
@@ -0,0 +1,44 @@
+import logging
+from time import sleep
+from django.core.management.base import BaseCommand, CommandError
+
+from datasamples.rollups import refresh_rollups
+from datasamples.models import Sample
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Построить или обновить предагрегаты СВД (Sample.execution['rollups'], см. datasamples.rollups): "
+            "предагрегаты новой revision строятся, построенные обновляются по полю incremental")
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Имя СВД (по-умолчанию - все активные СВД)")
+        parser.add_argument('version', nargs='?', help="Версия СВД")
+        parser.add_argument('--full', action='store_true', help="Пересчитать все группы без учёта incremental")
+        parser.add_argument('--every', type=float,
+                            help="Обновлять предагрегаты каждые N секунд, не завершаясь (планировщик обновлений)")
+
+    def refresh(self, options) -> None:
+        samples = Sample.objects.filter(is_active=True, deleted=False).order_by('name', 'version')
+        if options['name']:
+            samples = samples.filter(name=options['name'])
+        if options['version']:
+            samples = samples.filter(version=options['version'])
+        if options['name'] and not samples:
+            raise CommandError(f"Active sample {options['name']} {options['version'] or ''} not found")
+        for sample in samples:
+            try:
+                if refresh_rollups(sample, options['full']):
+                    self.stdout.write(f"{sample.name} {sample.version}: rollups of revision "
+                                      f"{sample.revision} refreshed")
+            except Exception as e:
+                if not options['every']:
+                    raise CommandError(f"{sample.name} {sample.version}: {e}")
+                logger.exception("Failed to refresh rollups of sample %s %s", sample.name, sample.version)
+
+    def handle(self, *args, **options):
+        self.refresh(options)
+        while options['every']:
+            sleep(options['every'])
+            self.refresh({**options, 'full': False})
@@ -0,0 +1,45 @@
+import logging
+from time import sleep
+from django.core.management.base import BaseCommand, CommandError
+
+from datasamples.materialize import refresh_sample
+from datasamples.models import Sample
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Создать или обновить материализованные представления подзапросов таблиц СВД "
+            "(Sample.execution['materialize'], см. datasamples.materialize): представления новой revision "
+            "создаются, представления с истёкшим refresh_interval обновляются")
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Имя СВД (по-умолчанию - все активные СВД)")
+        parser.add_argument('version', nargs='?', help="Версия СВД")
+        parser.add_argument('--force', action='store_true', help="Обновить без учёта refresh_interval")
+        parser.add_argument('--every', type=float,
+                            help="Проверять СВД каждые N секунд, не завершаясь (планировщик обновлений)")
+
+    def refresh(self, options) -> None:
+        samples = Sample.objects.filter(is_active=True, deleted=False).order_by('name', 'version')
+        if options['name']:
+            samples = samples.filter(name=options['name'])
+        if options['version']:
+            samples = samples.filter(version=options['version'])
+        if options['name'] and not samples:
+            raise CommandError(f"Active sample {options['name']} {options['version'] or ''} not found")
+        for sample in samples:
+            try:
+                if refresh_sample(sample, options['force']):
+                    self.stdout.write(f"{sample.name} {sample.version}: views of revision "
+                                      f"{sample.materialized_revision} refreshed")
+            except Exception as e:
+                if not options['every']:
+                    raise CommandError(f"{sample.name} {sample.version}: {e}")
+                logger.exception("Failed to refresh views of sample %s %s", sample.name, sample.version)
+
+    def handle(self, *args, **options):
+        self.refresh(options)
+        while options['every']:
+            sleep(options['every'])
+            self.refresh({**options, 'force': False})
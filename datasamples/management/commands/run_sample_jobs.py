@@ -0,0 +1,50 @@
+import signal
+import multiprocessing
+from threading import Event
+from django.db import connections
+from django.core.management.base import BaseCommand
+
+import datasample
+from datasamples.jobs import get_jobs_settings, work
+
+
+def worker_main(poll_interval: float, once: bool):
+    """ Процесс-обработчик: SIGTERM/SIGINT завершают его после выполнения текущего задания """
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    work(poll_interval, stop, once)
+
+
+class Command(BaseCommand):
+    help = "Запустить обработчики фоновых выполнений СВД (datasamples.SampleJob)"
+
+    def add_arguments(self, parser):
+        config = get_jobs_settings()
+        parser.add_argument('--workers', type=int, default=config['WORKERS'], help="Количество процессов")
+        parser.add_argument('--poll-interval', type=float, default=config['POLL_INTERVAL'],
+                            help="Через сколько секунд проверять очередь, если заданий нет")
+        parser.add_argument('--once', action='store_true', help="Выполнить задания из очереди и завершиться")
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            worker_main(options['poll_interval'], options['once'])
+            return
+        # Соединения с БД и пулы datasample не должны наследоваться дочерними процессами
+        connections.close_all()
+        datasample.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=worker_main, args=(options['poll_interval'], options['once']), daemon=True)
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Запущено обработчиков: {len(processes)}")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # SIGINT из терминала получают и обработчики: дожидаемся завершения их текущих заданий
+            for process in processes:
+                process.join()
@@ -0,0 +1,99 @@
+"""
+    Материализованные представления подзапросов таблиц СВД для Django-проекта
+
+Настройка материализации СВД - Sample.execution['materialize'] (см. datasample.materialize),
+например {"tables": {"main": ["id"]}, "refresh_interval": 86400}.
+Представления создаются в БД выполнения СВД (datasamples.utils.get_db_settings) под именами
+<PREFIX>_<id СВД>_<revision>_<алиас таблицы>, поэтому при изменении revision создаются новые
+представления, а прежние удаляются. Пока представления текущей revision не созданы,
+СВД выполняется по исходным подзапросам.
+
+Параметры задаются в settings.DATASAMPLE_MATERIALIZE:
+    PREFIX  - префикс имён представлений
+    ON_SAVE - создавать представления сразу после сохранения СВД с новой revision или настройкой
+              (в процессе, сохранившем СВД, по завершении транзакции); по-умолчанию False -
+              представления создаёт очередной запуск python manage.py refresh_sample_views
+"""
+import pickle
+from django.conf import settings
+from django.utils.timezone import now
+
+from datasample.materialize import create_views, drop_views, find_views, refresh_views
+from .cache import get_result_cache
+from .utils import get_db_settings
+
+__all__ = (
+    'get_materialize_settings',
+    'view_prefix',
+    'view_names',
+    'materialize_sample',
+    'refresh_sample',
+    'drop_sample_views',
+)
+
+
+def get_materialize_settings() -> dict:
+    return {
+        'PREFIX': 'dsmv',
+        'ON_SAVE': False,
+        **getattr(settings, 'DATASAMPLE_MATERIALIZE', {}),
+    }
+
+
+def view_prefix(sample) -> str:
+    return f"{get_materialize_settings()['PREFIX']}_{sample.pk}_"
+
+
+def view_names(sample, revision: int = None) -> dict:
+    """ Имена представлений СВД для revision (по-умолчанию - текущей): <алиас таблицы>: <имя> """
+    revision = sample.revision if revision is None else revision
+    tables = (sample.execution or {}).get('materialize', {}).get('tables', {})
+    return {alias: f"{view_prefix(sample)}{revision}_{alias}"[:63] for alias in tables}
+
+
+def _mark(sample, **values) -> None:
+    """ Сохранить состояние материализации без Sample.save (revision и кэш не затрагиваются) """
+    type(sample).objects.filter(pk=sample.pk).update(**values)
+    for name, value in values.items():
+        setattr(sample, name, value)
+
+
+def materialize_sample(sample) -> None:
+    """ Создать представления текущей revision СВД и удалить прежние """
+    materialize = (sample.execution or {}).get('materialize', {})
+    names = view_names(sample)
+    create_views(pickle.loads(sample.obj), names, materialize, get_db_settings())
+    drop_views(set(find_views(view_prefix(sample), get_db_settings())) - set(names.values()), get_db_settings())
+    _mark(sample, materialized_revision=sample.revision, refreshed=now())
+    get_result_cache().invalidate(sample.name)
+
+
+def refresh_sample(sample, force: bool = False) -> bool:
+    """
+        Обновить представления СВД, если подошёл срок refresh_interval (force - без учёта срока)
+
+    Если представления текущей revision ещё не созданы - создать их.
+    :return: были ли представления созданы или обновлены
+    """
+    materialize = (sample.execution or {}).get('materialize', {})
+    if not materialize.get('tables'):
+        return False
+    if sample.materialized_revision != sample.revision:
+        materialize_sample(sample)
+        return True
+    interval = materialize.get('refresh_interval')
+    due = sample.refreshed is None or (interval is not None and
+                                       (now() - sample.refreshed).total_seconds() >= interval)
+    if not (force or due):
+        return False
+    refresh_views(view_names(sample), materialize, get_db_settings())
+    _mark(sample, refreshed=now())
+    get_result_cache().invalidate(sample.name)
+    return True
+
+
+def drop_sample_views(sample) -> None:
+    """ Удалить все представления СВД (например, когда материализация отключена) """
+    drop_views(find_views(view_prefix(sample), get_db_settings()), get_db_settings())
+    if sample.materialized_revision is not None:
+        _mark(sample, materialized_revision=None, refreshed=None)
@@ -0,0 +1,47 @@
+"""
+    Замеры этапов выполнения СВД для Django-проекта
+
+Параметры задаются в settings.DATASAMPLE_METRICS (см. datasample.instrumentation):
+    ENABLED - выполнять замеры (при False замеры отключены и /metrics отвечает 404)
+    BUCKETS - границы интервалов гистограммы длительности этапов в секундах
+Замеры собираются в пределах процесса и выдаются в формате Prometheus по адресу /metrics.
+Те же замеры используются журналом выполнений СВД (см. datasamples.querylog).
+"""
+from threading import Lock
+from django.conf import settings
+
+from datasample.instrumentation import DEFAULT_BUCKETS, MultiSink, PrometheusSink, set_sink
+from .querylog import QueryLogSink, get_query_log_settings
+from .replicas import get_replica_router
+
+__all__ = (
+    'get_metrics_sink',
+    'install_sinks',
+)
+
+_lock = Lock()
+_sink = None
+
+
+def get_metrics_sink():
+    """ Приёмник замеров для /metrics, создаётся при первом обращении. None - замеры отключены """
+    global _sink
+    config = getattr(settings, 'DATASAMPLE_METRICS', {})
+    if not config.get('ENABLED', False):
+        return None
+    if _sink is None:
+        with _lock:
+            if _sink is None:
+                _sink = PrometheusSink(buckets=config.get('BUCKETS', DEFAULT_BUCKETS))
+    return _sink
+
+
+def install_sinks() -> None:
+    """ Установить приёмники замеров по настройкам проекта (при запуске приложения) """
+    sinks = [sink for sink in (
+        get_metrics_sink(),
+        QueryLogSink() if get_query_log_settings()['ENABLED'] else None,
+        # Выбор реплик учитывает задержку выполнения СВД на них
+        get_replica_router(),
+    ) if sink is not None]
+    set_sink(sinks[0] if len(sinks) == 1 else MultiSink(*sinks) if sinks else None)
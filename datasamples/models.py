@@ -1,11 +1,26 @@
 import pickle
+import logging
 from django.db import models
 from django.contrib.postgres.fields import JSONField
 from django.contrib.auth import get_user_model
-from django.db.transaction import atomic
+from django.db.transaction import atomic, on_commit
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 
-__all__ = ('Sample',)
+import datasample
+from datasample.arrow import iter_arrow_stream
+from datasample.guard import check_budget
+from datasample.materialize import check_materialize, materialized_sample
+from datasample.rollup import check_rollups, with_rollups
+from .cache import get_result_cache
+from .guard import get_cost_guard
+from .materialize import get_materialize_settings, view_names, materialize_sample, drop_sample_views
+from .querylog import log_execution
+from .rollups import get_rollup_settings, build_rollups, current_rollups
+
+__all__ = ('Sample', 'SampleJob', 'SampleExecution', 'SampleRollup',)
+
+logger = logging.getLogger(__name__)
 
 
 class Sample(models.Model):
@@ -56,6 +71,27 @@ class Sample(models.Model):
     obj = models.BinaryField(help_text="бинарное представления объекта Sample")
     src = JSONField(help_text="Читабельное представление объекта Sample. "
                               "Автоматически генерируется из поля 'Sample.obj'")
+    execution = JSONField(default=dict,
+                          blank=True,
+                          verbose_name="Параметры выполнения",
+                          help_text="Например, бюджет стоимости запроса: "
+                                    "{\"budget\": {\"max_cost\": 1e6, \"on_exceed\": \"cap\"}}, "
+                                    "материализация подзапросов таблиц: "
+                                    "{\"materialize\": {\"tables\": {\"main\": [\"id\"]}, "
+                                    "\"refresh_interval\": 86400}}, "
+                                    "предагрегаты: {\"rollups\": [{\"name\": \"by_day\", \"keys\": [\"day\"], "
+                                    "\"measures\": [\"amount\"], \"incremental\": \"day\"}]}, "
+                                    "выполнение только на основной БД, а не на репликах: {\"pin_primary\": true}")
+    materialized_revision = models.BigIntegerField(null=True,
+                                                   blank=True,
+                                                   editable=False,
+                                                   verbose_name="Материализована revision",
+                                                   help_text="для какой revision созданы представления "
+                                                             "подзапросов таблиц (см. datasamples.materialize)")
+    refreshed = models.DateTimeField(null=True,
+                                     blank=True,
+                                     editable=False,
+                                     verbose_name="Представления обновлены")
 
     def __str__(self):
         return self.name
@@ -64,15 +100,42 @@ class Sample(models.Model):
         messages = dict()
         if not str(self.name).isidentifier():
             messages.update({"name": [f"name is not Python identifier."]})
+        try:
+            check_budget((self.execution or {}).get('budget'))
+        except (ValueError, AttributeError) as e:
+            messages.update({"execution": [str(e)]})
+        if not isinstance((self.execution or {}).get('pin_primary', False), bool):
+            messages.update({"execution": ["'pin_primary' must be boolean."]})
+        if not messages and self.obj:
+            try:
+                sample_meta = pickle.loads(self.obj)
+                check_materialize(self.execution.get('materialize'), sample_meta)
+                check_rollups(self.execution.get('rollups'), sample_meta)
+            except (ValueError, AttributeError, datasample.SampleElementError) as e:
+                messages.update({"execution": [str(e)]})
         if messages:
             raise ValidationError(messages)
 
     @atomic
     def save(self, **kwargs):
+        materialize = (self.execution or {}).get('materialize')
+        rollups = (self.execution or {}).get('rollups')
         if self.pk:
             old = type(self).objects.get(pk=self.pk)
+            # Состояние материализации меняется только в datasamples.materialize
+            self.materialized_revision, self.refreshed = old.materialized_revision, old.refreshed
             if bytes(self.obj) != bytes(old.obj):
                 self.revision = old.revision + 1
+                # Результаты прежней редакции СВД больше не нужны в кэше
+                on_commit(lambda name=old.name: get_result_cache().invalidate(name))
+            if materialize != (old.execution or {}).get('materialize'):
+                # Представления построены по прежней настройке - до пересоздания СВД читает исходные подзапросы
+                self.materialized_revision = None
+                if not (materialize or {}).get('tables') and old.materialized_revision is not None:
+                    on_commit(lambda: drop_sample_views(self))
+            if rollups != (old.execution or {}).get('rollups'):
+                # Предагрегаты построены по прежнему объявлению - до перестроения не используются
+                self.rollups.all().delete()
         else:
             self.revision = 1
         # Если объект новый, или изменилась схема,
@@ -81,3 +144,263 @@ class Sample(models.Model):
             obj = pickle.loads(self.obj)
             self.src = obj.__getstate__()
         super().save(**kwargs)
+        self._sample_meta = None
+        if (materialize or {}).get('tables') and self.materialized_revision != self.revision \
+                and get_materialize_settings()['ON_SAVE']:
+            on_commit(self._materialize)
+        if rollups and get_rollup_settings()['ON_SAVE'] and \
+                not self.rollups.filter(revision=self.revision).exists():
+            on_commit(self._build_rollups)
+
+    def _materialize(self):
+        try:
+            materialize_sample(self)
+        except Exception:
+            # СВД уже сохранена и выполняется по исходным подзапросам, представления пересоздаст refresh_sample_views
+            logger.exception("Failed to materialize sample %s %s", self.name, self.version)
+
+    def _build_rollups(self):
+        try:
+            build_rollups(self)
+        except Exception:
+            # Запросы выполняются по исходным подзапросам, предагрегаты построит refresh_sample_rollups
+            logger.exception("Failed to build rollups of sample %s %s", self.name, self.version)
+
+    @property
+    def sample_meta(self) -> datasample.CompiledSample:
+        """
+            Скомпилированное описание СВД для выполнения: с чтением из материализованных представлений,
+            если они созданы, и с предагрегатами текущей revision, если они построены
+
+        Вычисляется один раз для объекта (запрос API или задание загружают СВД один раз) и заново -
+        после сохранения или при изменении obj, revision, materialized_revision. Предагрегаты,
+        построенные после первого обращения, используются объектами, загруженными позже.
+        """
+        key = (bytes(self.obj), self.revision, self.materialized_revision)
+        cached = getattr(self, '_sample_meta', None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        sample_meta = pickle.loads(self.obj)
+        if self.materialized_revision is not None and self.materialized_revision == self.revision:
+            sample_meta = materialized_sample(sample_meta, view_names(self))
+        rollups = current_rollups(self) if (self.execution or {}).get('rollups') and self.pk else None
+        sample_meta = with_rollups(sample_meta, rollups) if rollups else datasample.compile_sample(sample_meta)
+        self._sample_meta = (key, sample_meta)
+        return sample_meta
+
+    @property
+    def metric_labels(self) -> dict:
+        """ Метки замеров выполнения СВД (см. datasample.instrumentation) """
+        return {'sample': self.name, 'version': self.version, 'revision': self.revision}
+
+    def execute(self, params: dict, options: dict, db_settings: dict, user=None, **kwargs) -> list:
+        """ Выполнить СВД через кэш результатов (см. datasample.cache.ResultCache.execute) с записью в журнал """
+        sample_meta = self.sample_meta
+        with log_execution(self, sample_meta, params, options, user) as record, \
+                datasample.labels(**self.metric_labels):
+            rows = get_result_cache().execute(self.name, [self.version, self.revision], sample_meta,
+                                              params, options, db_settings, **kwargs)
+            if record is not None:
+                record.rows = len(rows)
+            return rows
+
+    def check_cost(self, params: dict, options: dict, db_settings: dict):
+        """ Решение о выполнении по оценке стоимости запроса и бюджету СВД (см. datasample.guard.CostGuard) """
+        with datasample.labels(**self.metric_labels):
+            return get_cost_guard().check(self.sample_meta, params, options, db_settings, name=self.name,
+                                          revision=[self.version, self.revision],
+                                          budget=self.execution.get('budget'))
+
+    def execute_iter(self, params: dict, options: dict, db_settings: dict, **kwargs):
+        """ Выполнить СВД c чтением строк через server-side курсор (см. datasample.execute_iter) """
+        with datasample.labels(**self.metric_labels):
+            return datasample.execute_iter(self.sample_meta, params, options, db_settings, **kwargs)
+
+    def iter_arrow_stream(self, params: dict, options: dict, db_settings: dict, **kwargs):
+        """ Выполнить СВД с выдачей результата в формате Arrow IPC stream (см. datasample.arrow.iter_arrow_stream) """
+        with datasample.labels(**self.metric_labels):
+            return iter_arrow_stream(self.sample_meta, params, options, db_settings, **kwargs)
+
+    def export_csv(self, params: dict, options: dict, db_settings: dict, fileobj, user=None, **kwargs) -> int:
+        """ Выгрузить результат СВД в CSV через COPY (см. datasample.export_csv) с записью в журнал """
+        sample_meta = self.sample_meta
+        with log_execution(self, sample_meta, params, options, user) as record, \
+                datasample.labels(**self.metric_labels):
+            rows = datasample.export_csv(sample_meta, params, options, db_settings, fileobj, **kwargs)
+            if record is not None:
+                record.rows = rows
+            return rows
+
+    def write_result(self, params: dict, options: dict, db_settings: dict, fileobj, user=None, **kwargs) -> int:
+        """ Записать результат СВД в файл (см. datasample.write_result) с записью в журнал """
+        sample_meta = self.sample_meta
+        with log_execution(self, sample_meta, params, options, user) as record, \
+                datasample.labels(**self.metric_labels):
+            rows = datasample.write_result(sample_meta, params, options, db_settings, fileobj, **kwargs)
+            if record is not None:
+                record.rows = rows
+            return rows
+
+
+class SampleJob(models.Model):
+    """ Фоновое выполнение СВД с записью результата в файл (см. datasamples.jobs) """
+
+    class Meta:
+        verbose_name = "фоновое выполнение СВД"
+        verbose_name_plural = "фоновые выполнения СВД"
+        indexes = [models.Index(fields=['status', 'created'])]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Выполнено"),
+        (FAILED, "Ошибка"),
+    )
+    FORMATS = tuple((format, format) for format in datasample.output.OUTPUT_FORMATS)
+
+    sample = models.ForeignKey(Sample,
+                               related_name="jobs",
+                               on_delete=models.CASCADE,
+                               verbose_name="СВД")
+    user = models.ForeignKey(get_user_model(),
+                             related_name="sample_jobs",
+                             on_delete=models.SET_NULL,
+                             null=True,
+                             verbose_name="Пользователь")
+    params = JSONField(default=dict, verbose_name="Значения параметров")
+    options = JSONField(verbose_name="Настройки выборки")
+    format = models.CharField(max_length=8,
+                              choices=FORMATS,
+                              default='csv',
+                              verbose_name="Формат результата")
+    status = models.CharField(max_length=8,
+                              choices=STATUSES,
+                              default=QUEUED,
+                              verbose_name="Состояние")
+    rows_fetched = models.BigIntegerField(default=0,
+                                          verbose_name="Получено строк")
+    result_file = models.CharField(max_length=255,
+                                   blank=True,
+                                   verbose_name="Файл результата",
+                                   help_text="путь относительно settings.DATASAMPLE_JOBS['RESULT_DIR']")
+    error = models.TextField(blank=True,
+                             verbose_name="Ошибка")
+    worker = models.CharField(max_length=64,
+                              blank=True,
+                              verbose_name="Обработчик",
+                              help_text="host:pid процесса, выполняющего задание")
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name="Создано")
+    started = models.DateTimeField(null=True,
+                                   blank=True,
+                                   verbose_name="Начато")
+    heartbeat = models.DateTimeField(null=True,
+                                     blank=True,
+                                     verbose_name="Обработчик активен",
+                                     help_text="когда обработчик последний раз подтвердил выполнение задания")
+    finished = models.DateTimeField(null=True,
+                                    blank=True,
+                                    verbose_name="Завершено")
+
+    def __str__(self):
+        return f"{self.sample} #{self.pk}"
+
+
+class SampleExecution(models.Model):
+    """ Журнал выполнений СВД (см. datasamples.querylog) """
+
+    class Meta:
+        verbose_name = "выполнение СВД"
+        verbose_name_plural = "журнал выполнений СВД"
+        indexes = [
+            models.Index(fields=['sample', 'revision', 'started']),
+            models.Index(fields=['slow', 'started']),
+        ]
+
+    sample = models.ForeignKey(Sample,
+                               related_name="executions",
+                               on_delete=models.CASCADE,
+                               verbose_name="СВД")
+    revision = models.BigIntegerField(verbose_name="№ изменения",
+                                      help_text="№ изменения СВД на момент выполнения")
+    user = models.ForeignKey(get_user_model(),
+                             related_name="sample_executions",
+                             on_delete=models.SET_NULL,
+                             null=True,
+                             blank=True,
+                             verbose_name="Пользователь")
+    options_fingerprint = models.CharField(max_length=64,
+                                           verbose_name="Отпечаток настроек",
+                                           help_text="отпечаток формы настроек (без значений фильтров), "
+                                                     "см. datasample.sqlalchemytools.options_shape")
+    started = models.DateTimeField(verbose_name="Начато")
+    duration = models.FloatField(verbose_name="Длительность, с")
+    phases = JSONField(default=dict,
+                       blank=True,
+                       verbose_name="Этапы",
+                       help_text="длительность (seconds), строки и байты по этапам выполнения")
+    rows = models.BigIntegerField(null=True,
+                                  blank=True,
+                                  verbose_name="Строк")
+    cached = models.BooleanField(default=False,
+                                 verbose_name="Из кэша")
+    error = models.TextField(blank=True,
+                             verbose_name="Ошибка")
+    slow = models.BooleanField(default=False,
+                               verbose_name="Медленный запрос")
+    sql = models.TextField(blank=True,
+                           verbose_name="SQL",
+                           help_text="текст запроса, сохраняется для медленных запросов")
+    binds = JSONField(null=True,
+                      blank=True,
+                      encoder=DjangoJSONEncoder,
+                      verbose_name="Значения переменных",
+                      help_text="bindary variables запроса, сохраняются для медленных запросов")
+    params = JSONField(null=True,
+                       blank=True,
+                       encoder=DjangoJSONEncoder,
+                       verbose_name="Параметры",
+                       help_text="значения параметров выполнения (рабочая нагрузка для подбора индексов)")
+    options = JSONField(null=True,
+                        blank=True,
+                        encoder=DjangoJSONEncoder,
+                        verbose_name="Настройки",
+                        help_text="настройки выборки (рабочая нагрузка для подбора индексов)")
+
+    def __str__(self):
+        return f"{self.sample} #{self.pk}"
+
+
+class SampleRollup(models.Model):
+    """ Построенный предагрегат СВД (см. datasamples.rollups) """
+
+    class Meta:
+        unique_together = ('sample', 'name',)
+        verbose_name = "предагрегат СВД"
+        verbose_name_plural = "предагрегаты СВД"
+
+    sample = models.ForeignKey(Sample,
+                               related_name="rollups",
+                               on_delete=models.CASCADE,
+                               verbose_name="СВД")
+    name = models.CharField(max_length=32,
+                            verbose_name="Имя",
+                            help_text="имя предагрегата из Sample.execution['rollups']")
+    revision = models.BigIntegerField(verbose_name="№ изменения",
+                                      help_text="№ изменения СВД, по которой построен предагрегат")
+    table = models.CharField(max_length=63,
+                             verbose_name="Таблица")
+    keys = JSONField(default=list,
+                     verbose_name="Ключевые поля")
+    measures = JSONField(default=list,
+                         verbose_name="Вычисляемые поля")
+    rows = models.BigIntegerField(default=0,
+                                  verbose_name="Строк")
+    refreshed = models.DateTimeField(verbose_name="Обновлён")
+
+    def __str__(self):
+        return f"{self.sample} {self.name}"
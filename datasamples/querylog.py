@@ -0,0 +1,332 @@
+"""
+    Журнал выполнений СВД (SampleExecution) с сохранением медленных запросов
+
+Длительность этапов выполнения собирается через замеры datasample.instrumentation:
+выполнение помечается меткой execution (ExecutionRecord), приёмник QueryLogSink суммирует
+замеры этапов в записи. Запись передаётся в QueryLogWriter, который сохраняет записи
+в БД порциями в отдельном потоке, поэтому журнал не замедляет выполнение запросов.
+Для медленных запросов сохраняются текст SQL и значения bindary variables.
+Перцентили длительности по СВД и их изменение между revision - latency_by_revision
+(отображаются в администрировании журнала). Параметры и настройки выполнений - рабочая нагрузка
+для подбора индексов (execution_workload, datasample.advisor).
+
+Параметры задаются в settings.DATASAMPLE_QUERY_LOG:
+    ENABLED        - вести журнал
+    SLOW_SECONDS   - с какой длительности (в секундах) выполнение считается медленным
+    ASYNC          - сохранять записи в отдельном потоке (False - сразу, например, в тестах)
+    BATCH_SIZE     - сколько записей сохранять одной командой
+    FLUSH_INTERVAL - как часто (в секундах) сохранять накопившиеся записи
+    MAX_PENDING    - сколько записей может ждать сохранения (сверх - записи отбрасываются)
+Журнал процесса (get_query_log) создаётся заново при изменении настроек (override_settings).
+"""
+import atexit
+import logging
+from datetime import timedelta
+from time import perf_counter
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.db.models import Aggregate, Count, FloatField, Max, Q
+from django.utils.timezone import now
+from sqlalchemy.dialects import postgresql
+
+import datasample
+from datasample.cache import fingerprint
+from datasample.instrumentation import MetricsSink
+from datasample.sqlalchemytools import compose, compile_query, options_shape
+
+__all__ = (
+    'get_query_log_settings',
+    'ExecutionRecord',
+    'QueryLogSink',
+    'QueryLogWriter',
+    'get_query_log',
+    'start_execution',
+    'log_execution',
+    'Percentile',
+    'latency_by_revision',
+    'execution_workload',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_query_log_settings() -> dict:
+    return {
+        'ENABLED': False,
+        'SLOW_SECONDS': 1.0,
+        'ASYNC': True,
+        'BATCH_SIZE': 100,
+        'FLUSH_INTERVAL': 2,
+        'MAX_PENDING': 10000,
+        **getattr(settings, 'DATASAMPLE_QUERY_LOG', {}),
+    }
+
+
+class ExecutionRecord:
+    """ Одно выполнение СВД: собирает замеры этапов и по завершении передаётся в журнал """
+
+    def __init__(self, sample, sample_meta, params: dict, options: dict, user=None):
+        self.sample = sample
+        self.sample_meta = sample_meta
+        self.params = params
+        self.options = options
+        self.user = user
+        self.started = now()
+        self.phases = dict()
+        self.rows = None
+        self.error = ''
+        self._lock = Lock()
+        self._started = perf_counter()
+        self._finished = False
+
+    def add_span(self, span) -> None:
+        with self._lock:
+            phase = self.phases.setdefault(span.phase, {'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            phase['seconds'] += span.duration
+            phase['rows'] += span.rows
+            phase['bytes'] += span.bytes
+            if span.phase == 'fetch':
+                self.rows = (self.rows or 0) + span.rows
+
+    def finish(self, error: BaseException = None) -> None:
+        """ Завершить выполнение и передать запись в журнал (повторный вызов ничего не делает) """
+        if self._finished:
+            return
+        self._finished = True
+        duration = perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        get_query_log().submit(self.to_instance(duration))
+
+    def to_instance(self, duration: float):
+        from .models import SampleExecution
+        slow = duration >= get_query_log_settings()['SLOW_SECONDS']
+        sql, binds = '', None
+        if slow:
+            try:
+                query, kwargs = compose(self.sample_meta, self.params, self.options)
+                sql, binds = compile_query(query, kwargs, postgresql.dialect())
+            except Exception as e:
+                # Запрос, не прошедший валидацию, сохраняется без текста SQL
+                sql = f"-- {e}"
+        return SampleExecution(
+            sample_id=self.sample.pk,
+            revision=self.sample.revision,
+            user_id=getattr(self.user, 'pk', self.user),
+            options_fingerprint=fingerprint(options_shape(self.options)) if 'fields' in self.options else '',
+            started=self.started,
+            duration=duration,
+            phases=self.phases,
+            rows=self.rows,
+            cached=not self.error and 'execute' not in self.phases,
+            error=self.error,
+            slow=slow,
+            sql=sql,
+            binds=binds,
+            params=self.params,
+            options=self.options,
+        )
+
+
+class QueryLogSink(MetricsSink):
+    """ Приёмник замеров: передаёт замеры в ExecutionRecord из метки execution """
+
+    def record(self, span) -> None:
+        record = span.labels.get('execution')
+        if record is not None:
+            record.add_span(span)
+
+
+class QueryLogWriter:
+    """
+        Сохранение записей журнала порциями в отдельном потоке
+
+    Поток запускается при первой записи, в том числе заново в процессе, созданном через fork.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 2, max_pending: int = 10000,
+                 asynchronous: bool = True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self.dropped = 0
+        self._queue = Queue(max_pending)
+        self._lock = Lock()
+        self._thread = None
+
+    def submit(self, execution) -> None:
+        if not self.asynchronous:
+            self._save([execution])
+            return
+        try:
+            self._queue.put_nowait(execution)
+        except Full:
+            self.dropped += 1
+            return
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = Thread(target=self._run, name='datasample-query-log', daemon=True)
+                    self._thread.start()
+
+    def _take(self, timeout: float = None) -> list:
+        """ Порция записей из очереди: ждать первую запись не дольше timeout """
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except Empty:
+            pass
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take(self.flush_interval)
+            if batch:
+                close_old_connections()
+                self._save(batch)
+
+    def _save(self, batch: list) -> None:
+        from .models import SampleExecution
+        try:
+            SampleExecution.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Failed to save %s sample executions", len(batch))
+
+    def flush(self) -> None:
+        """ Сохранить все накопившиеся записи в вызывающем потоке """
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            self._save(batch)
+
+
+_lock = Lock()
+_query_log = None
+
+
+def get_query_log() -> QueryLogWriter:
+    """ Журнал процесса, создаётся при первом обращении по настройкам проекта """
+    global _query_log
+    if _query_log is None:
+        with _lock:
+            if _query_log is None:
+                config = get_query_log_settings()
+                _query_log = QueryLogWriter(
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    max_pending=config['MAX_PENDING'],
+                    asynchronous=config['ASYNC'],
+                )
+                atexit.register(_query_log.flush)
+    return _query_log
+
+
+def _reset_query_log(setting, **kwargs):
+    """ Изменились настройки журнала: сохранить накопившиеся записи, журнал создаётся заново """
+    global _query_log
+    if setting != 'DATASAMPLE_QUERY_LOG':
+        return
+    with _lock:
+        if _query_log is not None:
+            _query_log.flush()
+        _query_log = None
+
+
+setting_changed.connect(_reset_query_log)
+
+
+def start_execution(sample, sample_meta, params: dict, options: dict, user=None):
+    """
+        Начать запись выполнения СВД
+
+    Возвращает ExecutionRecord (None - журнал отключен). Замеры этапов попадают в запись,
+    если выполнение происходит в блоке datasample.labels(execution=<запись>).
+    По окончании выполнения необходимо вызвать finish.
+    """
+    if not get_query_log_settings()['ENABLED']:
+        return None
+    return ExecutionRecord(sample, sample_meta, params, options, user)
+
+
+@contextmanager
+def log_execution(sample, sample_meta, params: dict, options: dict, user=None):
+    """ Записать в журнал выполнение СВД в блоке кода (см. start_execution) """
+    record = start_execution(sample, sample_meta, params, options, user)
+    if record is None:
+        yield None
+        return
+    try:
+        with datasample.labels(execution=record):
+            yield record
+    except Exception as e:
+        record.finish(e)
+        raise
+    record.finish()
+
+
+class Percentile(Aggregate):
+    """ Перцентиль PostgreSQL: percentile_cont(<доля>) WITHIN GROUP (ORDER BY <выражение>) """
+    function = 'percentile_cont'
+    name = 'Percentile'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+def latency_by_revision(days: int = 7) -> list:
+    """
+        Перцентили длительности выполнения по СВД и revision за последние days дней
+
+    Учитываются выполнения без ошибок и не из кэша. Для каждой revision, кроме первой, change -
+    отношение p95 к p95 предыдущей revision той же СВД (1.5 - медленнее в полтора раза).
+    """
+    from .models import SampleExecution
+    stats = list(
+        SampleExecution.objects
+        .filter(started__gte=now() - timedelta(days=days), cached=False, error='')
+        .values('sample_id', 'sample__name', 'sample__version', 'revision')
+        .annotate(count=Count('pk'),
+                  slow=Count('pk', filter=Q(slow=True)),
+                  p50=Percentile('duration', 0.5),
+                  p95=Percentile('duration', 0.95),
+                  p99=Percentile('duration', 0.99))
+        .order_by('sample__name', 'sample__version', 'revision')
+    )
+    previous = None
+    for row in stats:
+        row['change'] = None
+        if previous is not None and previous['sample_id'] == row['sample_id'] and previous['p95']:
+            row['change'] = row['p95'] / previous['p95']
+        previous = row
+    return stats
+
+
+def execution_workload(sample, days: int = 7, revision: int = None) -> list:
+    """
+        Рабочая нагрузка СВД из журнала для подбора индексов (см. datasample.advisor.advise_indexes)
+
+    Выполнения текущей (или заданной) revision за последние days дней без ошибок и не из кэша
+    группируются по отпечатку формы настроек. Для каждой формы - параметры и настройки
+    последнего выполнения, вес - количество выполнений (по убыванию веса).
+    :return: [(params, options, weight)]
+    """
+    from .models import SampleExecution
+    groups = (
+        SampleExecution.objects
+        .filter(sample=sample, revision=sample.revision if revision is None else revision,
+                started__gte=now() - timedelta(days=days), cached=False, error='', options__isnull=False)
+        .values('options_fingerprint')
+        .annotate(count=Count('pk'), last=Max('pk'))
+    )
+    weights = {group['last']: group['count'] for group in groups}
+    executions = sorted(SampleExecution.objects.filter(pk__in=weights), key=lambda e: weights[e.pk], reverse=True)
+    return [(execution.params or {}, execution.options, weights[execution.pk]) for execution in executions]
@@ -0,0 +1,109 @@
+"""
+    Выполнение СВД на репликах для чтения для Django-проекта
+
+Параметры задаются в settings.DATASAMPLE_REPLICAS (см. datasample.replicas.ReplicaRouter):
+    DATABASES       - алиасы реплик из settings.DATABASES (пусто - все СВД выполняются на основной БД)
+    MAX_LAG         - допустимое отставание реплики, секунд
+    ALPHA           - коэффициент сглаживания задержки
+    CHECK_INTERVAL  - как часто проверять реплику, секунд
+    CHECK_TIMEOUT   - ограничение времени соединения и запроса проверки, секунд
+    FAILURE_BACKOFF - на сколько секунд исключать реплику после ошибки соединения
+Основная БД - datasamples.utils.get_db_settings. СВД, которой нужны свежие данные,
+закрепляется за основной БД настройкой Sample.execution['pin_primary'] = true.
+Материализованные представления, предагрегаты и подбор индексов всегда используют основную БД.
+run_routed и iter_routed повторяют на основной БД выполнение, соединение которого с репликой не удалось.
+"""
+from threading import Lock
+from typing import Callable, Iterator
+from django.conf import settings
+
+from datasample import labels
+from datasample.replicas import PRIMARY, Route, ReplicaRouter
+from .utils import get_db_settings
+
+__all__ = (
+    'get_replica_settings',
+    'get_replica_router',
+    'read_route',
+    'run_routed',
+    'iter_routed',
+)
+
+_lock = Lock()
+_router = None
+
+
+def get_replica_settings() -> dict:
+    return {
+        'DATABASES': [],
+        'MAX_LAG': 30,
+        'ALPHA': 0.3,
+        'CHECK_INTERVAL': 10,
+        'CHECK_TIMEOUT': 2,
+        'FAILURE_BACKOFF': 30,
+        **getattr(settings, 'DATASAMPLE_REPLICAS', {}),
+    }
+
+
+def get_replica_router():
+    """ Выбор реплик процесса, создаётся при первом обращении по настройкам проекта. None - реплик нет """
+    global _router
+    config = get_replica_settings()
+    if not config['DATABASES']:
+        return None
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = ReplicaRouter(
+                    primary=get_db_settings(),
+                    replicas={alias: settings.DATABASES[alias] for alias in config['DATABASES']},
+                    max_lag=config['MAX_LAG'],
+                    alpha=config['ALPHA'],
+                    check_interval=config['CHECK_INTERVAL'],
+                    check_timeout=config['CHECK_TIMEOUT'],
+                    failure_backoff=config['FAILURE_BACKOFF'],
+                )
+    return _router
+
+
+def read_route(sample=None) -> Route:
+    """ БД для выполнения СВД sample: реплика или основная БД, если реплик нет или СВД закреплена за ней """
+    router = get_replica_router()
+    if router is None:
+        return Route(PRIMARY, get_db_settings())
+    return router.choose(primary=_pin_primary(sample))
+
+
+def _pin_primary(sample) -> bool:
+    return bool(sample is not None and (sample.execution or {}).get('pin_primary'))
+
+
+def _labelled(function: Callable[[dict], object]) -> Callable[[Route], object]:
+    def call(route: Route):
+        with labels(replica=route.name):
+            return function(route.db_settings)
+    return call
+
+
+def run_routed(sample, function: Callable[[dict], object]):
+    """
+        Выполнить function(db_settings) для СВД sample на БД для чтения с меткой замеров replica
+
+    При ошибке соединения с репликой function вызывается повторно на основной БД.
+    """
+    router = get_replica_router()
+    if router is None:
+        return _labelled(function)(Route(PRIMARY, get_db_settings()))
+    return router.run(_labelled(function), primary=_pin_primary(sample))
+
+
+def iter_routed(sample, function: Callable[[dict], Iterator]) -> Iterator:
+    """
+        Итератор function(db_settings) для СВД sample на БД для чтения с меткой замеров replica
+
+    При ошибке соединения с репликой до первого элемента итерация начинается заново на основной БД.
+    """
+    router = get_replica_router()
+    if router is None:
+        return _labelled(function)(Route(PRIMARY, get_db_settings()))
+    return router.iterate(_labelled(function), primary=_pin_primary(sample))
@@ -0,0 +1,105 @@
+"""
+    Предагрегаты СВД для Django-проекта
+
+Предагрегаты объявляются в Sample.execution['rollups'] (см. datasample.rollup), например
+[{"name": "by_day", "keys": ["day", "region"], "measures": ["amount"], "incremental": "day"}].
+Таблицы предагрегатов создаются в БД выполнения СВД (datasamples.utils.get_db_settings) под именами
+<PREFIX>_<id СВД>_<revision>_<имя предагрегата>, построенные предагрегаты учитываются в SampleRollup.
+Пока предагрегаты текущей revision не построены, запросы выполняются по исходным подзапросам.
+
+Параметры задаются в settings.DATASAMPLE_ROLLUPS:
+    PREFIX  - префикс имён таблиц предагрегатов
+    ON_SAVE - строить предагрегаты сразу после сохранения СВД с новой revision или объявлением
+              (в процессе, сохранившем СВД, по завершении транзакции); по-умолчанию False -
+              предагрегаты строит очередной запуск python manage.py refresh_sample_rollups
+"""
+import pickle
+from django.conf import settings
+from django.utils.timezone import now
+
+from datasample.rollup import Rollup, create_rollup, refresh_rollup, drop_rollups, find_rollups
+from .cache import get_result_cache
+from .utils import get_db_settings
+
+__all__ = (
+    'get_rollup_settings',
+    'rollup_prefix',
+    'rollup_tables',
+    'build_rollups',
+    'refresh_rollups',
+    'drop_sample_rollups',
+    'current_rollups',
+)
+
+
+def get_rollup_settings() -> dict:
+    return {
+        'PREFIX': 'dsru',
+        'ON_SAVE': False,
+        **getattr(settings, 'DATASAMPLE_ROLLUPS', {}),
+    }
+
+
+def rollup_prefix(sample) -> str:
+    return f"{get_rollup_settings()['PREFIX']}_{sample.pk}_"
+
+
+def rollup_tables(sample, revision: int = None) -> dict:
+    """ Имена таблиц предагрегатов СВД для revision (по-умолчанию - текущей): <имя предагрегата>: <таблица> """
+    revision = sample.revision if revision is None else revision
+    return {rollup['name']: f"{rollup_prefix(sample)}{revision}_{rollup['name']}"[:63]
+            for rollup in (sample.execution or {}).get('rollups', [])}
+
+
+def build_rollups(sample) -> None:
+    """ Построить предагрегаты текущей revision СВД и удалить прежние """
+    sample_meta = pickle.loads(sample.obj)
+    tables = rollup_tables(sample)
+    for rollup in (sample.execution or {}).get('rollups', []):
+        rows = create_rollup(sample_meta, tables[rollup['name']], rollup['keys'], rollup['measures'],
+                             get_db_settings())
+        sample.rollups.update_or_create(name=rollup['name'], defaults={
+            'revision': sample.revision, 'table': tables[rollup['name']], 'keys': rollup['keys'],
+            'measures': rollup['measures'], 'rows': rows, 'refreshed': now(),
+        })
+    sample.rollups.exclude(name__in=tables).delete()
+    drop_rollups(set(find_rollups(rollup_prefix(sample), get_db_settings())) - set(tables.values()),
+                 get_db_settings())
+    get_result_cache().invalidate(sample.name)
+
+
+def refresh_rollups(sample, full: bool = False) -> bool:
+    """
+        Обновить предагрегаты СВД: по полю incremental - только последние группы, full - полностью
+
+    Если предагрегаты текущей revision ещё не построены - построить их.
+    :return: были ли предагрегаты построены или обновлены
+    """
+    declared = (sample.execution or {}).get('rollups', [])
+    if not declared:
+        return False
+    built = {rollup.name: rollup for rollup in sample.rollups.filter(revision=sample.revision)}
+    if set(built) != {rollup['name'] for rollup in declared}:
+        build_rollups(sample)
+        return True
+    sample_meta = pickle.loads(sample.obj)
+    for rollup in declared:
+        instance = built[rollup['name']]
+        instance.rows = refresh_rollup(sample_meta, instance.table, rollup['keys'], rollup['measures'],
+                                       get_db_settings(), None if full else rollup.get('incremental'))
+        instance.refreshed = now()
+        instance.save(update_fields=('rows', 'refreshed'))
+    get_result_cache().invalidate(sample.name)
+    return True
+
+
+def drop_sample_rollups(sample) -> None:
+    """ Удалить все таблицы предагрегатов СВД """
+    drop_rollups(find_rollups(rollup_prefix(sample), get_db_settings()), get_db_settings())
+    sample.rollups.all().delete()
+
+
+def current_rollups(sample) -> list:
+    """ Построенные предагрегаты текущей revision СВД для compose (см. datasample.rollup.with_rollups) """
+    return [Rollup(rollup.table, tuple(rollup.keys), tuple(rollup.measures), rollup.rows)
+            for rollup in sample.rollups.filter(revision=sample.revision)]
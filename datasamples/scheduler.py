@@ -0,0 +1,40 @@
+"""
+    Планировщик выполнения запросов СВД для Django-проекта
+
+Параметры задаются в settings.DATASAMPLE_SCHEDULER (см. datasample.scheduler.ExecutionScheduler),
+все ограничения - на процесс веб-сервера, а не на проект в целом:
+    MAX_CONCURRENT - сколько запросов выполняется одновременно в процессе
+    PER_SAMPLE     - сколько запросов одной СВД выполняется одновременно в процессе (None - без ограничения)
+    PER_USER       - сколько запросов одного пользователя выполняется одновременно в процессе
+                     (None - без ограничения)
+    MAX_QUEUE      - сколько запросов может ждать выполнения в процессе
+    QUEUE_TIMEOUT  - сколько секунд запрос ждёт выполнения
+"""
+from threading import Lock
+from django.conf import settings
+
+from datasample.scheduler import ExecutionScheduler
+
+__all__ = (
+    'get_scheduler',
+)
+
+_lock = Lock()
+_scheduler = None
+
+
+def get_scheduler() -> ExecutionScheduler:
+    """ Планировщик процесса, создаётся при первом обращении по настройкам проекта """
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                config = getattr(settings, 'DATASAMPLE_SCHEDULER', {})
+                _scheduler = ExecutionScheduler(
+                    max_concurrent=config.get('MAX_CONCURRENT', 8),
+                    per_sample=config.get('PER_SAMPLE'),
+                    per_user=config.get('PER_USER'),
+                    max_queue=config.get('MAX_QUEUE', 100),
+                    queue_timeout=config.get('QUEUE_TIMEOUT', 30),
+                )
+    return _scheduler
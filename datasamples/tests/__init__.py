@@ -1 +1,9 @@
+from .test_api import *
+from .test_cache import *
+from .test_check import *
 from .test_datasample import *
+from .test_jobs import *
+from .test_materialize import *
+from .test_querylog import *
+from .test_replicas import *
+from .test_rollups import *
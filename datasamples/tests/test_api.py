@@ -0,0 +1,184 @@
+import gzip
+import json
+import pickle
+import unittest
+from unittest.mock import patch
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+
+import datasample
+from datasamples.models import Sample, SampleExecution, SampleJob
+from datasamples.scheduler import get_scheduler
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+__all__ = (
+    'ApiExecuteTestCase',
+    'ApiCancelTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num, i % 2 = 0 as even from generate_series(1, 5) as i'},
+    'fields': {
+        'num': {'ctype': 'Integer', 'ordered': True, 'filtered': ('<=',)},
+        'even': {'ctype': 'Boolean'},
+    },
+    'params': {},
+}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class ApiExecuteTestCase(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user('reader', password='reader')
+        user.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.client.force_login(user)
+        Sample(name='numbers', version='1', description='', is_active=True,
+               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA))).save()
+        self.url = reverse('datasamples:api-execute', kwargs={'name': 'numbers', 'version': '1'})
+        self.body = {
+            'params': {},
+            'options': {
+                'fields': [['num', None], ['even', None]],
+                'filters': [['num', '<=', [3]]],
+                'order': [['num', 'asc']],
+            },
+        }
+
+    def tearDown(self):
+        # Пул соединений datasample держит соединения с тестовой БД, которую Django удаляет после тестов
+        datasample.close_all()
+
+    def post(self, body, url=None, **extra):
+        return self.client.post(url or self.url, json.dumps(body), content_type='application/json', **extra)
+
+    def test_ndjson(self):
+        response = self.post(self.body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertListEqual(rows, [
+            {'num': 1, 'even': False},
+            {'num': 2, 'even': True},
+            {'num': 3, 'even': False},
+        ])
+
+    def test_gzip(self):
+        response = self.post(self.body, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        # Несжатый ответ тоже зависит от Accept-Encoding
+        response = self.post(self.body)
+        b''.join(response.streaming_content)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_arrow(self):
+        response = self.post(self.body, url=self.url + '?format=arrow')
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pyarrow.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertDictEqual(table.to_pydict(), {'num': [1, 2, 3], 'even': [False, True, False]})
+
+    def set_budget(self, **budget):
+        Sample.objects.filter(name='numbers').update(execution={'budget': budget})
+
+    def test_budget_reject(self):
+        self.set_budget(max_cost=0.001)
+        response = self.post(self.body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('budget', response.json()['errors'])
+
+    def test_budget_cap(self):
+        self.set_budget(max_cost=0.001, on_exceed='cap', cap_rows=2)
+        lines = b''.join(self.post(self.body).streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_budget_queue(self):
+        """ Запрос сверх бюджета ставится в очередь фоновых заданий """
+        self.set_budget(max_cost=0.001, on_exceed='queue')
+        with patch.object(get_scheduler(), 'acquire') as acquire:
+            response = self.post(self.body)
+        acquire.assert_not_called()
+        self.assertEqual(response.status_code, 202)
+        job = SampleJob.objects.get(pk=response.json()['id'])
+        self.assertEqual((job.format, job.status, job.options), ('ndjson', SampleJob.QUEUED, self.body['options']))
+        self.assertEqual(response.json()['status_url'], reverse('datasamples:api-job-status', kwargs={'pk': job.pk}))
+        self.assertFalse(SampleExecution.objects.exists())
+
+    def test_overload(self):
+        scheduler = get_scheduler()
+        tickets = [scheduler.acquire() for _ in range(scheduler.max_concurrent)]
+        try:
+            with patch.object(scheduler, 'queue_timeout', 0.05):
+                response = self.post(self.body)
+        finally:
+            for ticket in tickets:
+                scheduler.release(ticket)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('overload', response.json()['errors'])
+
+    def test_scheduler_released(self):
+        b''.join(self.post(self.body).streaming_content)
+        self.assertEqual(get_scheduler().stats['running'], 0)
+        stats = self.client.get(reverse('datasamples:api-scheduler-stats')).json()
+        self.assertEqual(stats['running'], 0)
+
+    def test_metrics(self):
+        b''.join(self.post(self.body).streaming_content)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        series = 'phase="{}",sample="numbers",version="1",revision="1"'
+        for phase in ('validate', 'compose', 'execute', 'fetch', 'serialize'):
+            self.assertIn(f'datasample_phase_seconds_count{{{series.format(phase)}}}', text)
+        self.assertIn('datasample_scheduler_running 0', text)
+
+    @override_settings(DATASAMPLE_METRICS={'ENABLED': False})
+    def test_metrics_disabled(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.post(self.body, url=self.url + '?format=xml').status_code, 400)
+
+    def test_validation_errors(self):
+        response = self.post({'options': {'fields': [['unknown', None]]}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('options[fields]', response.json()['errors'])
+
+    def test_body_not_object(self):
+        for body in ([], 1, 'options'):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('request', response.json()['errors'])
+
+    def test_inactive_sample(self):
+        Sample.objects.filter(name='numbers').update(is_active=False)
+        self.assertEqual(self.post(self.body).status_code, 404)
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class ApiCancelTestCase(TransactionTestCase):
+    """ Закрытие ответа отправляет request_finished и закрывает соединения Django, поэтому не TestCase """
+
+    def setUp(self):
+        ApiExecuteTestCase.setUp(self)
+
+    def tearDown(self):
+        datasample.close_all()
+
+    def test_close_cancels_query(self):
+        """ Клиент отключился, не дочитав ответ: Django закрывает ответ, запрос отменяется """
+        cancel = datasample.CancelHandle()
+        with patch('datasample.CancelHandle', return_value=cancel):
+            response = self.client.post(self.url, json.dumps(self.body), content_type='application/json')
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertTrue(cancel.cancelled)
@@ -0,0 +1,117 @@
+import pickle
+from time import sleep, monotonic
+from threading import Thread
+from unittest.mock import patch
+from django.core.cache import caches
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+import datasample
+from datasample.cache import result_key
+from datasamples.cache import DjangoResultCache, get_result_cache
+from datasamples.models import Sample
+
+__all__ = (
+    'SampleResultCacheTestCase',
+    'DjangoResultCacheTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select 1 as one'},
+    'fields': {'one': {'ctype': 'Integer'}},
+    'params': {},
+}
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1',
+}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class SampleResultCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        self.cache = get_result_cache()
+        self.cache.clear()
+        self.instance = Sample(name='cached', version='1', description='',
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)))
+        self.instance.save()
+
+    def test_invalidate_on_revision(self):
+        """ Изменение описания СВД удаляет её результаты из кэша """
+        key = result_key(self.instance.name, [self.instance.version, self.instance.revision], {}, {}, DB_SETTINGS)
+        self.cache.set(key, self.instance.name, [(1,)])
+        self.instance.description = 'Описание не влияет на результаты'
+        self.instance.save()
+        self.assertIsNotNone(self.cache.get(key))
+        self.instance.obj = pickle.dumps(datasample.Sample({**SAMPLE_METADATA, 'tables': {'main': 'select 2 as one'}}))
+        self.instance.save()
+        self.assertEqual(self.instance.revision, 2)
+        self.assertIsNone(self.cache.get(key))
+
+
+class DjangoResultCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = DjangoResultCache(alias='default', ttl=60, lock_timeout=5, wait_interval=0.01)
+        self.cache.clear()
+        self.calls = 0
+
+    def slow_execute(self, sample_meta, params, options, db_settings):
+        self.calls += 1
+        sleep(0.2)
+        return [(1, 'a')]
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('key', 'sample'))
+        self.assertEqual(self.cache.set('key', 'sample', [[1, 'a']]), [(1, 'a')])
+        self.assertEqual(self.cache.get('key', 'sample'), [(1, 'a')])
+        self.assertDictEqual(self.cache.stats, {'hits': 1, 'misses': 1, 'coalesced': 0})
+
+    def test_invalidate(self):
+        self.cache.set('key', 'sample', [(1,)])
+        self.cache.set('other', 'other', [(2,)])
+        self.cache.invalidate('sample')
+        self.assertIsNone(self.cache.get('key', 'sample'))
+        self.assertIsNotNone(self.cache.get('other', 'other'))
+
+    def test_clear(self):
+        """ Очищаются только результаты этого кэша """
+        django_cache = caches['default']
+        django_cache.set('foreign', 1)
+        self.cache.set('key', 'sample', [(1,)])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key', 'sample'))
+        self.assertEqual(django_cache.get('foreign'), 1)
+
+    def run_threads(self, cache: DjangoResultCache, count: int = 5) -> list:
+        results = []
+        with patch('datasamples.cache.execute', self.slow_execute):
+            threads = [
+                Thread(target=lambda: results.append(cache.execute('sample', 1, SAMPLE_METADATA, {}, {}, DB_SETTINGS)))
+                for _ in range(count)
+            ]
+            started = monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.duration = monotonic() - started
+        return results
+
+    def test_single_flight(self):
+        """ Одновременные одинаковые запросы выполняются в БД один раз """
+        results = self.run_threads(self.cache)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [[(1, 'a')]] * 5)
+        self.assertEqual(self.cache.stats['coalesced'], 4)
+
+    def test_uncacheable(self):
+        """ Результат, который не сохраняется в кэш, не заставляет одинаковые запросы выполняться по очереди """
+        for cache in (DjangoResultCache(alias='default', ttl=0, lock_timeout=5, wait_interval=0.01),
+                      DjangoResultCache(alias='default', ttl=60, max_bytes=1, lock_timeout=5, wait_interval=0.01)):
+            with self.subTest(ttl=cache.ttl, max_bytes=cache.max_bytes):
+                cache.clear()
+                self.calls = 0
+                self.assertEqual(self.run_threads(cache), [[(1, 'a')]] * 5)
+                self.assertEqual(self.calls, 5)
+                # Последовательно 5 запросов заняли бы 1 секунду
+                self.assertLess(self.duration, 0.8)
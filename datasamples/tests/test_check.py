@@ -0,0 +1,92 @@
+import json
+import pickle
+from unittest.mock import patch
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+
+import datasample
+from datasamples.cache import get_result_cache
+from datasamples.models import Sample, SampleExecution
+
+__all__ = (
+    'CheckDatasampleTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num from generate_series(1, 5) as i'},
+    'fields': {'num': {'ctype': 'Integer', 'ordered': True}},
+    'params': {},
+}
+OPTIONS = {'fields': [['num', None]], 'order': [['num', 'asc']]}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class CheckDatasampleTestCase(TestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        user = get_user_model().objects.create_user('reader', password='reader')
+        user.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.client.force_login(user)
+        self.instance = Sample(name='numbers', version='1', description='', is_active=True,
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)))
+        self.instance.save()
+        self.url = reverse('datasamples:check-datasample', kwargs={'pk': self.instance.pk})
+
+    def tearDown(self):
+        datasample.close_all()
+
+    def execute(self, src: dict = None):
+        database = settings.DATABASES['default']
+        response = self.client.post(self.url, {
+            'btnOK': 'Execute',
+            'src_json': json.dumps(src or pickle.loads(self.instance.obj).state),
+            'params_json': '{}',
+            'options_json': json.dumps(OPTIONS),
+            'db_user': database['USER'],
+            'db_password': database.get('PASSWORD', ''),
+            'db_host': database['HOST'],
+            'db_port': database.get('PORT') or '5432',
+            'db_name': database['NAME'],
+        })
+        self.assertEqual(response.status_code, 200)
+        return [tuple(row) for row in response.context['dataset']]
+
+    def test_cached(self):
+        """ Сохранённая СВД выполняется через кэш результатов """
+        with patch('datasample.cache.execute', wraps=datasample.execute) as execute:
+            self.assertListEqual(self.execute(), [(1,), (2,), (3,), (4,), (5,)])
+            self.assertListEqual(self.execute(), [(1,), (2,), (3,), (4,), (5,)])
+        self.assertEqual(execute.call_count, 1)
+
+    def test_unsaved_not_cached(self):
+        """ Несохранённое описание СВД из формы выполняется без кэша """
+        src = datasample.Sample({**SAMPLE_METADATA,
+                                 'tables': {'main': 'select i as num from generate_series(1, 2) as i'}}).state
+        with patch('datasample.cache.execute', wraps=datasample.execute) as execute:
+            self.assertListEqual(self.execute(src), [(1,), (2,)])
+        execute.assert_not_called()
+        self.assertListEqual(self.execute(), [(1,), (2,), (3,), (4,), (5,)])
+
+    def test_new_revision(self):
+        """ После изменения описания СВД результат прежней revision из кэша не выдаётся """
+        self.assertListEqual(self.execute(), [(1,), (2,), (3,), (4,), (5,)])
+        self.instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA, 'tables': {'main': 'select i as num from generate_series(1, 3) as i'},
+        }))
+        self.instance.save()
+        with patch('datasample.cache.execute', wraps=datasample.execute) as execute:
+            self.assertListEqual(self.execute(), [(1,), (2,), (3,)])
+            self.assertListEqual(self.execute(), [(1,), (2,), (3,)])
+        self.assertEqual(execute.call_count, 1)
+
+    def test_logged(self):
+        """ Выполнения сохранённой и несохранённой СВД записываются в журнал """
+        src = datasample.Sample({**SAMPLE_METADATA,
+                                 'tables': {'main': 'select i as num from generate_series(1, 2) as i'}}).state
+        self.execute()
+        self.execute(src)
+        self.assertListEqual(list(SampleExecution.objects.order_by('pk').values_list('sample', 'rows', 'error')),
+                             [(self.instance.pk, 5, ''), (self.instance.pk, 2, '')])
@@ -0,0 +1,135 @@
+import os
+import json
+import pickle
+import tempfile
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+
+import datasample
+from datasamples.jobs import claim_job, work, fail_stale_jobs, cleanup_jobs
+from datasamples.models import Sample, SampleJob
+
+__all__ = (
+    'SampleJobTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num, 10 / (i - :ZERO_AT) as ratio from generate_series(1, 5) as i'},
+    'fields': {
+        'num': {'ctype': 'Integer', 'label': 'Номер', 'ordered': True},
+        'ratio': {'ctype': 'Integer'},
+    },
+    'params': {'ZERO_AT': {'ctype': 'Integer'}},
+}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class SampleJobTestCase(TestCase):
+    def setUp(self):
+        self.result_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(DATASAMPLE_JOBS={'RESULT_DIR': self.result_dir.name})
+        self.settings.enable()
+        self.user = get_user_model().objects.create_user('reader', password='reader')
+        self.user.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.client.force_login(self.user)
+        Sample(name='numbers', version='1', description='', is_active=True,
+               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA))).save()
+        self.url = reverse('datasamples:api-submit-job', kwargs={'name': 'numbers', 'version': '1'})
+        self.body = {
+            'params': {'ZERO_AT': 0},
+            'options': {'fields': [['num', None], ['ratio', None]], 'order': [['num', 'asc']]},
+            'format': 'csv',
+        }
+
+    def tearDown(self):
+        datasample.close_all()
+        self.settings.disable()
+        self.result_dir.cleanup()
+
+    def submit(self, body):
+        return self.client.post(self.url, json.dumps(body), content_type='application/json')
+
+    def test_csv_job(self):
+        response = self.submit(self.body)
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(response.json()['status'], SampleJob.QUEUED)
+        self.assertEqual(self.client.get(status_url + '/download').status_code, 409)
+
+        self.assertEqual(work(once=True), 1)
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], SampleJob.DONE)
+        self.assertEqual(status['rows_fetched'], 5)
+        download = self.client.get(status['download_url'])
+        self.assertEqual(download['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(download.streaming_content).decode().splitlines()[:2], ['Номер,ratio', '1,10'])
+
+    def test_ndjson_job(self):
+        self.submit({**self.body, 'format': 'ndjson'})
+        work(once=True)
+        job = SampleJob.objects.get()
+        download = self.client.get(reverse('datasamples:api-job-download', kwargs={'pk': job.pk}))
+        rows = [json.loads(line) for line in b''.join(download.streaming_content).decode().splitlines()]
+        self.assertDictEqual(rows[-1], {'num': 5, 'ratio': 2})
+
+    def test_failed_job(self):
+        self.submit({**self.body, 'params': {'ZERO_AT': 3}})
+        with self.assertLogs('datasamples.jobs', 'ERROR'):
+            work(once=True)
+        job = SampleJob.objects.get()
+        self.assertEqual(job.status, SampleJob.FAILED)
+        self.assertIn('division by zero', job.error)
+        self.assertEqual(job.result_file, '')
+
+    def test_validation(self):
+        self.assertEqual(self.submit({**self.body, 'format': 'xml'}).status_code, 400)
+        response = self.submit({**self.body, 'params': {}})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SampleJob.objects.exists())
+
+    def test_claim_order(self):
+        self.submit(self.body)
+        self.submit(self.body)
+        first, second = SampleJob.objects.order_by('pk')
+        self.assertEqual(claim_job('test').pk, first.pk)
+        self.assertEqual(claim_job('test').pk, second.pk)
+        self.assertIsNone(claim_job('test'))
+
+    def test_other_user(self):
+        self.submit(self.body)
+        job = SampleJob.objects.get()
+        other = get_user_model().objects.create_user('other', password='other')
+        other.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('datasamples:api-job-status', kwargs={'pk': job.pk})).status_code,
+                         404)
+
+    def test_stale_job(self):
+        """ Задание упавшего обработчика завершается с ошибкой, а не остаётся выполняемым навсегда """
+        self.submit(self.body)
+        self.submit(self.body)
+        lost, alive = (claim_job('test') for _ in range(2))
+        SampleJob.objects.filter(pk=lost.pk).update(heartbeat=now() - timedelta(seconds=600))
+        self.assertEqual(fail_stale_jobs(300), 1)
+        lost.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(lost.status, SampleJob.FAILED)
+        self.assertIsNotNone(lost.finished)
+        self.assertEqual(alive.status, SampleJob.RUNNING)
+
+    def test_cleanup(self):
+        self.submit(self.body)
+        self.submit(self.body)
+        work(once=True)
+        old, recent = SampleJob.objects.order_by('pk')
+        SampleJob.objects.filter(pk=old.pk).update(finished=now() - timedelta(days=8))
+        orphan = os.path.join(self.result_dir.name, '999.csv.part')
+        open(orphan, 'w').close()
+        os.utime(orphan, (0, 0))
+        self.assertEqual(cleanup_jobs(7 * 24 * 3600), 1)
+        self.assertListEqual(list(SampleJob.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertListEqual(os.listdir(self.result_dir.name), [recent.result_file])
@@ -0,0 +1,98 @@
+import pickle
+from io import StringIO
+from unittest.mock import patch
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+import datasample
+from datasamples.cache import get_result_cache
+from datasamples.materialize import refresh_sample, drop_sample_views, view_prefix
+from datasamples.models import Sample
+from datasamples.utils import get_db_settings
+from datasample.materialize import find_views
+
+__all__ = (
+    'MaterializeTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num from generate_series(1, 5) as i'},
+    'fields': {'num': {'ctype': 'Integer', 'ordered': True, 'filtered': ('<=',)}},
+    'params': {},
+}
+OPTIONS = {'fields': [['num', None]], 'filters': [['num', '<=', [3]]], 'order': [['num', 'asc']]}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class MaterializeTestCase(TestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        self.instance = Sample(name='numbers', version='1', description='', is_active=True,
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)),
+                               execution={'materialize': {'tables': {'main': ['num']}}})
+        self.instance.save()
+
+    def tearDown(self):
+        drop_sample_views(self.instance)
+        datasample.close_all()
+
+    def views(self) -> list:
+        return find_views(view_prefix(self.instance), get_db_settings())
+
+    def test_materialize(self):
+        # Пока представления не созданы - исходный подзапрос
+        self.assertEqual(self.instance.sample_meta.tables['main'], SAMPLE_METADATA['tables']['main'])
+        self.assertTrue(refresh_sample(self.instance))
+        self.assertEqual(self.instance.materialized_revision, 1)
+        self.assertIsNotNone(self.instance.refreshed)
+        self.assertListEqual(self.views(), [f'{view_prefix(self.instance)}1_main'])
+        instance = Sample.objects.get(pk=self.instance.pk)
+        self.assertEqual(instance.sample_meta.tables['main'], f'select * from "{view_prefix(instance)}1_main"')
+        self.assertListEqual(instance.execute({}, OPTIONS, get_db_settings()), [(1,), (2,), (3,)])
+        # Без refresh_interval - только по требованию
+        self.assertFalse(refresh_sample(instance))
+        self.assertTrue(refresh_sample(instance, force=True))
+
+    def test_not_on_save(self):
+        """ По-умолчанию представления не создаются при сохранении СВД - их создаёт refresh_sample_views """
+        self.instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA, 'tables': {'main': 'select i as num from generate_series(2, 5) as i'},
+        }))
+        with patch('datasamples.models.on_commit') as on_commit:
+            self.instance.save()
+        self.assertNotIn(self.instance._materialize, [call[0][0] for call in on_commit.call_args_list])
+        with override_settings(DATASAMPLE_MATERIALIZE={'ON_SAVE': True}), \
+                patch('datasamples.models.on_commit') as on_commit:
+            self.instance.save()
+        self.assertIn(self.instance._materialize, [call[0][0] for call in on_commit.call_args_list])
+
+    def test_new_revision(self):
+        refresh_sample(self.instance)
+        self.instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA, 'tables': {'main': 'select i as num from generate_series(2, 5) as i'},
+        }))
+        self.instance.save()
+        self.assertEqual(self.instance.revision, 2)
+        self.assertEqual(self.instance.materialized_revision, 1)
+        # Представления прежней revision не используются
+        self.assertEqual(self.instance.sample_meta.tables['main'], 'select i as num from generate_series(2, 5) as i')
+
+        stdout = StringIO()
+        call_command('refresh_sample_views', 'numbers', stdout=stdout)
+        self.assertIn('views of revision 2 refreshed', stdout.getvalue())
+        self.assertListEqual(self.views(), [f'{view_prefix(self.instance)}2_main'])
+        instance = Sample.objects.get(pk=self.instance.pk)
+        self.assertListEqual(instance.execute({}, OPTIONS, get_db_settings()), [(2,), (3,)])
+
+    def test_config_changed(self):
+        refresh_sample(self.instance)
+        self.instance.execution = {'materialize': {'tables': {'main': []}, 'refresh_interval': 60}}
+        self.instance.save()
+        self.assertIsNone(self.instance.materialized_revision)
+        self.assertEqual(self.instance.sample_meta.tables['main'], SAMPLE_METADATA['tables']['main'])
+
+    def test_clean(self):
+        self.instance.execution = {'materialize': {'tables': {'other': []}}}
+        with self.assertRaises(ValidationError):
+            self.instance.clean()
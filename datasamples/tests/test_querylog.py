@@ -0,0 +1,191 @@
+import os
+import json
+import pickle
+import tempfile
+from io import StringIO
+from time import sleep
+from datetime import timedelta
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+
+import datasample
+from datasamples.cache import get_result_cache
+from datasamples.models import Sample, SampleExecution
+from datasamples.querylog import QueryLogWriter, get_query_log, latency_by_revision, execution_workload
+
+__all__ = (
+    'QueryLogTestCase',
+    'QueryLogWriterTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num from generate_series(1, 5) as i'},
+    'fields': {'num': {'ctype': 'Integer', 'ordered': True, 'filtered': ('<=',)}},
+    'params': {},
+}
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1',
+}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class QueryLogTestCase(TestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        self.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.user.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.instance = Sample(name='numbers', version='1', description='', is_active=True,
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)))
+        self.instance.save()
+        self.options = {'fields': [['num', None]], 'filters': [['num', '<=', [3]]], 'order': [['num', 'asc']]}
+
+    def tearDown(self):
+        datasample.close_all()
+
+    def test_execute(self):
+        self.instance.execute({}, self.options, DB_SETTINGS, user=self.user)
+        self.instance.execute({}, self.options, DB_SETTINGS)
+        first, second = SampleExecution.objects.order_by('pk')
+        self.assertEqual(first.revision, self.instance.revision)
+        self.assertEqual(first.user, self.user)
+        self.assertEqual(first.rows, 3)
+        self.assertFalse(first.cached)
+        self.assertSetEqual(set(first.phases), {'validate', 'compose', 'execute', 'fetch'})
+        self.assertEqual(first.phases['fetch']['rows'], 3)
+        self.assertFalse(first.slow)
+        self.assertEqual(first.sql, '')
+        # Повторное выполнение - из кэша результатов, отпечаток настроек тот же
+        self.assertTrue(second.cached)
+        self.assertEqual(second.rows, 3)
+        self.assertEqual(second.options_fingerprint, first.options_fingerprint)
+
+    def test_export_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'numbers.csv')
+            stdout = StringIO()
+            call_command('export_csv', 'numbers', '1', '--options', json.dumps(self.options), '--output', path,
+                         stdout=stdout)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(len(f.read().splitlines()), 4)
+        self.assertIn('3 rows exported', stdout.getvalue())
+        self.assertEqual(SampleExecution.objects.get().rows, 3)
+
+    @override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False, 'SLOW_SECONDS': 0})
+    def test_slow(self):
+        self.instance.execute({}, self.options, DB_SETTINGS)
+        execution = SampleExecution.objects.get()
+        self.assertTrue(execution.slow)
+        self.assertIn('%(_filter_0)s', execution.sql)
+        self.assertDictEqual(execution.binds, {'_filter_0': 3})
+
+    def test_error(self):
+        with self.assertRaises(datasample.SampleElementError):
+            self.instance.execute({}, {'fields': [['unknown', None]]}, DB_SETTINGS)
+        execution = SampleExecution.objects.get()
+        self.assertTrue(execution.error.startswith('SampleElementError'))
+
+    @override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': False})
+    def test_disabled(self):
+        self.instance.execute({}, self.options, DB_SETTINGS)
+        self.assertFalse(SampleExecution.objects.exists())
+
+    def test_api_execute(self):
+        """ Выполнение через API записывается по окончании выдачи ответа """
+        self.client.force_login(self.user)
+        url = reverse('datasamples:api-execute', kwargs={'name': 'numbers', 'version': '1'})
+        response = self.client.post(url, json.dumps({'options': self.options}), content_type='application/json')
+        self.assertFalse(SampleExecution.objects.exists())
+        b''.join(response.streaming_content)
+        execution = SampleExecution.objects.get()
+        self.assertEqual(execution.rows, 3)
+        self.assertIn('serialize', execution.phases)
+        self.assertGreater(execution.phases['serialize']['bytes'], 0)
+
+    def test_execution_workload(self):
+        for value in (3, 4, 2):
+            self.instance.execute({}, {**self.options, 'filters': [['num', '<=', [value]]]}, DB_SETTINGS)
+        self.instance.execute({}, {'fields': [['num', None]]}, DB_SETTINGS)
+        # Из кэша - не нагрузка на БД
+        self.instance.execute({}, {'fields': [['num', None]]}, DB_SETTINGS)
+        (params, options, weight), (_, other, other_weight) = execution_workload(self.instance)
+        self.assertEqual(weight, 3)
+        self.assertDictEqual(params, {})
+        self.assertListEqual(options['filters'], [['num', '<=', [2]]])
+        self.assertEqual(other_weight, 1)
+        self.assertNotIn('filters', other)
+
+        stdout = StringIO()
+        call_command('advise_indexes', 'numbers', '1', method='transaction', stdout=stdout)
+        self.assertIn('2 query shapes, 4 executions', stdout.getvalue())
+        # Поле из generate_series не берётся из колонки таблицы - индексы не предлагаются
+        self.assertIn('no indexes recommended', stdout.getvalue())
+
+    def test_latency_by_revision(self):
+        started = now() - timedelta(hours=1)
+        SampleExecution.objects.bulk_create(
+            [SampleExecution(sample=self.instance, revision=1, started=started, duration=duration)
+             for duration in (1, 2, 3, 4)]
+            + [SampleExecution(sample=self.instance, revision=2, started=started, duration=duration * 2)
+               for duration in (1, 2, 3, 4)]
+            + [SampleExecution(sample=self.instance, revision=2, started=started, duration=100, error='Error')]
+        )
+        first, second = latency_by_revision()
+        self.assertEqual(first['count'], 4)
+        self.assertAlmostEqual(first['p50'], 2.5)
+        self.assertIsNone(first['change'])
+        self.assertEqual(second['count'], 4)
+        self.assertAlmostEqual(second['change'], 2)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:datasamples_sampleexecution_latency'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<td>numbers</td>', count=2)
+        response = self.client.get(reverse('admin:datasamples_sampleexecution_changelist'))
+        self.assertContains(response, reverse('admin:datasamples_sampleexecution_latency'))
+        # Сотруднику без права просмотра журнала перцентили недоступны
+        staff = get_user_model().objects.create_user('staff', password='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('admin:datasamples_sampleexecution_latency')).status_code, 403)
+        self.client.logout()
+        response = self.client.get(reverse('admin:datasamples_sampleexecution_latency'))
+        self.assertEqual(response.status_code, 302)
+
+
+class QueryLogWriterTestCase(SimpleTestCase):
+    def test_batches(self):
+        writer = QueryLogWriter(batch_size=2, flush_interval=0.05)
+        batches = []
+        writer._save = batches.append
+        for execution in range(5):
+            writer.submit(execution)
+        for _ in range(100):
+            if sum(map(len, batches)) == 5:
+                break
+            sleep(0.01)
+        self.assertListEqual(sorted(sum(batches, [])), [0, 1, 2, 3, 4])
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+
+    def test_overflow(self):
+        writer = QueryLogWriter(max_pending=1, asynchronous=True)
+        writer._thread = type('Thread', (), {'is_alive': lambda self: True})()
+        writer.submit(1)
+        writer.submit(2)
+        self.assertEqual(writer.dropped, 1)
+        batches = []
+        writer._save = batches.append
+        writer.flush()
+        self.assertListEqual(batches, [[1]])
+
+    def test_settings_changed(self):
+        """ Журнал процесса следует настройкам, изменённым через override_settings """
+        with override_settings(DATASAMPLE_QUERY_LOG={'ASYNC': True}):
+            self.assertTrue(get_query_log().asynchronous)
+        with override_settings(DATASAMPLE_QUERY_LOG={'ASYNC': False, 'BATCH_SIZE': 5}):
+            self.assertFalse(get_query_log().asynchronous)
+            self.assertEqual(get_query_log().batch_size, 5)
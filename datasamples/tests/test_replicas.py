@@ -0,0 +1,90 @@
+import json
+import pickle
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+import datasample
+from datasample.replicas import PRIMARY
+from datasamples import replicas
+from datasamples.models import Sample, SampleExecution
+from datasamples.replicas import get_replica_router, read_route, run_routed
+from datasamples.utils import get_db_settings
+
+__all__ = (
+    'ReplicasTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num from generate_series(1, 5) as i'},
+    'fields': {'num': {'ctype': 'Integer'}},
+    'params': {},
+}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class ReplicasTestCase(TestCase):
+    def setUp(self):
+        replicas._router = None
+        self.instance = Sample(name='numbers', version='1', description='', is_active=True,
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)))
+        self.instance.save()
+
+    def tearDown(self):
+        replicas._router = None
+        datasample.close_all()
+
+    def test_no_replicas(self):
+        self.assertIsNone(get_replica_router())
+        self.assertEqual(read_route(self.instance), (PRIMARY, get_db_settings()))
+
+    @override_settings(DATASAMPLE_REPLICAS={'DATABASES': ['default']})
+    def test_replica(self):
+        # Реплика выбирается после первой проверки в фоне
+        self.assertEqual(read_route(self.instance).name, PRIMARY)
+        get_replica_router().refresh(wait=True)
+        route = read_route(self.instance)
+        self.assertEqual(route.name, 'default')
+        self.assertIs(route.db_settings, settings.DATABASES['default'])
+        self.assertIs(get_replica_router(), get_replica_router())
+        self.assertTrue(get_replica_router().stats['default']['available'])
+        self.assertEqual(read_route().name, 'default')
+        # СВД, закреплённая за основной БД
+        self.instance.execution = {'pin_primary': True}
+        self.assertEqual(read_route(self.instance).name, PRIMARY)
+
+    @override_settings(DATASAMPLE_REPLICAS={'DATABASES': ['default']})
+    def test_failover(self):
+        """ При ошибке соединения с репликой выполнение повторяется на основной БД """
+        router = get_replica_router()
+        router.refresh(wait=True)
+        # Реплика прошла проверку, но стала недоступна
+        router._replicas['default'].db_settings = {**settings.DATABASES['default'], 'PORT': '1'}
+        user = get_user_model().objects.create_user('reader', password='reader')
+        user.user_permissions.add(Permission.objects.get(codename='view_sample'))
+        self.client.force_login(user)
+        url = reverse('datasamples:api-execute', kwargs={'name': 'numbers', 'version': '1'})
+        response = self.client.post(url, json.dumps({'options': {'fields': [['num', None]]}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 5)
+        self.assertFalse(router.stats['default']['available'])
+        self.assertEqual(SampleExecution.objects.get().error, '')
+
+        router._replicas['default'].down_until = None
+        routes = []
+
+        def execute(db_settings):
+            routes.append(datasample.instrumentation.current_labels()['replica'])
+            return datasample.execute(SAMPLE_METADATA, {}, {'fields': [['num', None]]}, db_settings)
+
+        self.assertEqual(len(run_routed(self.instance, execute)), 5)
+        self.assertListEqual(routes, ['default', PRIMARY])
+
+    def test_clean(self):
+        self.instance.execution = {'pin_primary': 'yes'}
+        with self.assertRaises(ValidationError):
+            self.instance.clean()
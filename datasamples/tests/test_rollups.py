@@ -0,0 +1,118 @@
+import pickle
+from io import StringIO
+from unittest.mock import patch
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+import datasample
+from datasamples.cache import get_result_cache
+from datasamples.models import Sample
+from datasamples.rollups import build_rollups, refresh_rollups, drop_sample_rollups, rollup_prefix
+from datasamples.utils import get_db_settings
+from datasample.rollup import find_rollups
+
+__all__ = (
+    'RollupsTestCase',
+)
+
+SAMPLE_METADATA = {
+    'tables': {'main': 'select i as num, i % 2 as grp, i * 10 as amount from generate_series(1, 5) as i'},
+    'fields': {
+        'num': {'ctype': 'Integer', 'key': True, 'ordered': True},
+        'grp': {'ctype': 'Integer', 'key': True, 'ordered': True},
+        'amount': {'ctype': 'Integer', 'calc': ('sum', 'avg')},
+    },
+    'params': {},
+}
+ROLLUPS = [{'name': 'by_grp', 'keys': ['grp'], 'measures': ['amount'], 'incremental': 'grp'}]
+OPTIONS = {'fields': [['grp', None], ['amount', 'sum']], 'group': ['grp'], 'order': [['grp', 'asc']]}
+
+
+@override_settings(DATASAMPLE_QUERY_LOG={'ENABLED': True, 'ASYNC': False})
+class RollupsTestCase(TestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        self.instance = Sample(name='numbers', version='1', description='', is_active=True,
+                               obj=pickle.dumps(datasample.Sample(SAMPLE_METADATA)),
+                               execution={'rollups': ROLLUPS})
+        self.instance.save()
+
+    def tearDown(self):
+        drop_sample_rollups(self.instance)
+        datasample.close_all()
+
+    def tables(self) -> list:
+        return find_rollups(rollup_prefix(self.instance), get_db_settings())
+
+    def test_build(self):
+        # Пока предагрегаты не построены - запрос по исходному подзапросу
+        self.assertFalse(getattr(self.instance.sample_meta, 'rollups', ()))
+        build_rollups(self.instance)
+        self.assertListEqual(self.tables(), [f'{rollup_prefix(self.instance)}1_by_grp'])
+        rollup = self.instance.rollups.get()
+        self.assertEqual((rollup.revision, rollup.rows), (1, 2))
+        instance = Sample.objects.get(pk=self.instance.pk)
+        self.assertEqual(instance.sample_meta.rollups[0].table, rollup.table)
+        self.assertListEqual(instance.execute({}, OPTIONS, get_db_settings()), [(0, 60), (1, 90)])
+        self.assertTrue(refresh_rollups(instance))
+        self.assertTrue(refresh_rollups(instance, full=True))
+        self.assertEqual(instance.rollups.get().rows, 2)
+
+    def test_sample_meta_reused(self):
+        """ Описание СВД компилируется и предагрегаты запрашиваются один раз для объекта """
+        build_rollups(self.instance)
+        instance = Sample.objects.get(pk=self.instance.pk)
+        with self.assertNumQueries(1):
+            sample_meta = instance.sample_meta
+            self.assertIs(instance.sample_meta, sample_meta)
+        self.assertIsInstance(sample_meta, datasample.CompiledSample)
+        instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA,
+            'tables': {'main': 'select i as num, i % 2 as grp, i as amount from generate_series(1, 5) as i'},
+        }))
+        self.assertIsNot(instance.sample_meta, sample_meta)
+
+    def test_new_revision(self):
+        build_rollups(self.instance)
+        self.instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA,
+            'tables': {'main': 'select i as num, i % 2 as grp, i as amount from generate_series(1, 5) as i'},
+        }))
+        self.instance.save()
+        self.assertEqual(self.instance.revision, 2)
+        # Предагрегат прежней revision не используется
+        self.assertFalse(getattr(self.instance.sample_meta, 'rollups', ()))
+
+        stdout = StringIO()
+        call_command('refresh_sample_rollups', 'numbers', stdout=stdout)
+        self.assertIn('rollups of revision 2 refreshed', stdout.getvalue())
+        self.assertListEqual(self.tables(), [f'{rollup_prefix(self.instance)}2_by_grp'])
+        instance = Sample.objects.get(pk=self.instance.pk)
+        self.assertListEqual(instance.execute({}, OPTIONS, get_db_settings()), [(0, 6), (1, 9)])
+
+    def test_not_on_save(self):
+        """ По-умолчанию предагрегаты не строятся при сохранении СВД - их строит refresh_sample_rollups """
+        self.instance.obj = pickle.dumps(datasample.Sample({
+            **SAMPLE_METADATA,
+            'tables': {'main': 'select i as num, i % 2 as grp, i as amount from generate_series(1, 5) as i'},
+        }))
+        with patch('datasamples.models.on_commit') as on_commit:
+            self.instance.save()
+        self.assertNotIn(self.instance._build_rollups, [call[0][0] for call in on_commit.call_args_list])
+        with override_settings(DATASAMPLE_ROLLUPS={'ON_SAVE': True}), \
+                patch('datasamples.models.on_commit') as on_commit:
+            self.instance.save()
+        self.assertIn(self.instance._build_rollups, [call[0][0] for call in on_commit.call_args_list])
+
+    def test_config_changed(self):
+        build_rollups(self.instance)
+        self.instance.execution = {'rollups': [{**ROLLUPS[0], 'keys': ['grp', 'num']}]}
+        self.instance.save()
+        self.assertFalse(self.instance.rollups.exists())
+        self.assertFalse(getattr(self.instance.sample_meta, 'rollups', ()))
+
+    def test_clean(self):
+        self.instance.execution = {'rollups': [{'name': 'by_amount', 'keys': ['amount']}]}
+        with self.assertRaises(ValidationError):
+            self.instance.clean()
@@ -8,4 +8,9 @@ urlpatterns = [
     path('edit-sample/<int:pk>', views.edit_sample, name='edit-sample'),
     path('create-sample', views.create_sample, name='create-sample'),
     path('check_datasample/<int:pk>', views.check_datasample, name='check-datasample'),
+    path('api/samples/<str:name>/<str:version>/execute', views.api_execute, name='api-execute'),
+    path('api/samples/<str:name>/<str:version>/jobs', views.api_submit_job, name='api-submit-job'),
+    path('api/jobs/<int:pk>', views.api_job_status, name='api-job-status'),
+    path('api/jobs/<int:pk>/download', views.api_job_download, name='api-job-download'),
+    path('api/scheduler/stats', views.api_scheduler_stats, name='api-scheduler-stats'),
 ]
@@ -0,0 +1,16 @@
+from django.conf import settings
+
+__all__ = (
+    'get_db_settings',
+    'get_statement_timeout',
+)
+
+
+def get_db_settings() -> dict:
+    """ Настройки БД для выполнения СВД: алиас settings.DATASAMPLE_DATABASE из settings.DATABASES """
+    return settings.DATABASES[getattr(settings, 'DATASAMPLE_DATABASE', 'default')]
+
+
+def get_statement_timeout():
+    """ Ограничение времени выполнения запроса СВД в секундах: settings.DATASAMPLE_STATEMENT_TIMEOUT """
+    return getattr(settings, 'DATASAMPLE_STATEMENT_TIMEOUT', None)
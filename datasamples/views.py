@@ -1,15 +1,28 @@
 import pickle
 import json
+import zlib
 import sqlparse
 from yapf.yapflib.yapf_api import FormatCode
-from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
+from django.views.decorators.http import require_POST, require_GET
 
 import datasample
+from datasample.instrumentation import span, render_gauges
 from . import models
 from .forms import SampleForm, CheckDatasampleForm
+from .guard import get_cost_guard
+from .jobs import EXTENSIONS, CONTENT_TYPES, result_path
+from .metrics import get_metrics_sink
+from .querylog import start_execution, log_execution
+from .replicas import read_route, run_routed, iter_routed
+from .scheduler import get_scheduler
+from .utils import get_statement_timeout
 
 
 @permission_required('datasamples.view_sample')
@@ -175,27 +188,67 @@ def check_datasample(request, pk):
 
                 elif button == 'Execute':
                     sample_meta = json.loads(form.cleaned_data['src_json'])
+                    params = json.loads(form.cleaned_data['params_json'])
                     options = json.loads(form.cleaned_data['options_json'])
-                    header = get_header(sample_meta, options)
-                    dataset = datasample.execute(
-                        sample_meta=sample_meta,
-                        params=json.loads(form.cleaned_data['params_json']),
-                        options=options,
-                        db_settings={
-                            'USER': form.cleaned_data['db_user'],
-                            'PASSWORD': form.cleaned_data['db_password'] if form.cleaned_data['db_password'] else '',
-                            'HOST': form.cleaned_data['db_host'],
-                            'PORT': form.cleaned_data['db_port'],
-                            'NAME': form.cleaned_data['db_name'],
-                        }
-                    )
+                    db_settings = {
+                        'USER': form.cleaned_data['db_user'],
+                        'PASSWORD': form.cleaned_data['db_password'] if form.cleaned_data['db_password'] else '',
+                        'HOST': form.cleaned_data['db_host'],
+                        'PORT': form.cleaned_data['db_port'],
+                        'NAME': form.cleaned_data['db_name'],
+                    }
+                    # Сохранённая СВД выполняется через кэш результатов: одинаковые запросы (в том числе
+                    # одновременные) выполняются один раз. Несохранённое описание СВД из формы не кэшируется
+                    saved = sample_meta == json.loads(json.dumps(pickle.loads(instance.obj).state))
+                    if saved:
+                        decision = instance.check_cost(params, options, db_settings)
+                    else:
+                        decision = get_cost_guard().check(sample_meta, params, options, db_settings,
+                                                          budget=instance.execution.get('budget'))
+                    if decision.action in ('stream', 'queue'):
+                        way = "через API" if decision.action == 'stream' else "фоновым заданием API"
+                        messages.add_message(request, messages.ERROR,
+                                             f"Оценка запроса (стоимость {decision.plan.total_cost}, "
+                                             f"строк {decision.plan.rows}) слишком велика для просмотра, "
+                                             f"выполните его {way}")
+                    else:
+                        if decision.action == 'cap':
+                            messages.add_message(request, messages.WARNING,
+                                                 f"Результат ограничен {decision.options['limit']} строками "
+                                                 f"(оценка запроса - {decision.plan.rows} строк)")
+                        header = get_header(sample_meta, options)
+                        with get_scheduler().slot(sample=instance.name, user=request.user.pk):
+                            if saved:
+                                dataset = instance.execute(params, decision.options, db_settings,
+                                                           user=request.user.pk, timeout=get_statement_timeout())
+                            else:
+                                with log_execution(instance, sample_meta, params, decision.options,
+                                                   request.user.pk) as record, \
+                                        datasample.labels(**instance.metric_labels):
+                                    dataset = datasample.execute(
+                                        sample_meta=sample_meta,
+                                        params=params,
+                                        options=decision.options,
+                                        db_settings=db_settings,
+                                        timeout=get_statement_timeout(),
+                                    )
+                                    if record is not None:
+                                        record.rows = len(dataset)
 
             except datasample.SampleElementError as e:
                 messages.add_message(request, messages.ERROR, str(e))
+            except datasample.SampleBudgetError as e:
+                messages.add_message(request, messages.ERROR, f"{e}. Уточните фильтры")
+            except datasample.SampleOverloadError as e:
+                messages.add_message(request, messages.ERROR, f"{e}. Повторите запрос позже")
+            except datasample.SampleTimeoutError as e:
+                messages.add_message(request, messages.ERROR,
+                                     f"{e}. Уточните фильтры или уменьшите количество полей группировки")
             except Exception as e:  # TODO конкретизировать список исключений
                 messages.add_message(request, messages.ERROR, str(e))
     else:
-        db_settings = settings.DATABASES.get('default')
+        # Проверка выполняется на той же БД, что и API (реплика или основная БД)
+        db_settings = read_route(instance).db_settings
         initial = {
             'src_json': json.dumps(pickle.loads(instance.obj).state, ensure_ascii=False, indent=2),
             'db_user': db_settings.get('USER'),
@@ -204,4 +257,275 @@ def check_datasample(request, pk):
             'db_name': db_settings.get('NAME'),
         }
         form = CheckDatasampleForm(instance=instance, initial=initial)
-    return render(request, 'datasamples/check_datasample.html', {'form': form, 'header': header, 'dataset': dataset})
+    context = {'form': form, 'header': header, 'dataset': dataset}
+    if not dataset:
+        return render(request, 'datasamples/check_datasample.html', context)
+    with span('render', instance.metric_labels) as render_span:
+        response = render(request, 'datasamples/check_datasample.html', context)
+        render_span.add(rows=len(dataset), bytes=len(response.content))
+    return response
+
+
+def ndjson_chunks(batches, columns: list, compress: bool = False, labels: dict = None):
+    """
+        Сериализовать порции строк в NDJSON
+
+    Каждая порция отдаётся отдельным фрагментом ответа, при сжатии - с Z_SYNC_FLUSH,
+    чтобы клиент получал строки по мере их чтения из БД.
+    labels - метки замера serialize (генератор выполняется вне блока datasample.labels).
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    gzip = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    serialize_span = span('serialize', labels or {})
+    for rows in batches:
+        with serialize_span.measure():
+            chunk = ''.join(encoder.encode(dict(zip(columns, row))) + '\n' for row in rows).encode()
+            if gzip:
+                chunk = gzip.compress(chunk) + gzip.flush(zlib.Z_SYNC_FLUSH)
+        serialize_span.add(rows=len(rows), bytes=len(chunk))
+        yield chunk
+    if gzip:
+        chunk = gzip.flush()
+        serialize_span.add(bytes=len(chunk))
+        yield chunk
+    serialize_span.finish()
+
+
+class CancellingStream:
+    """
+        Итератор ответа, отменяющий запрос СВД при закрытии
+
+    Django закрывает ответ (и этот итератор), когда клиент отключился, не дочитав ответ.
+    Выполняющийся в этот момент запрос отменяется через pg_cancel_backend,
+    место запроса в планировщике освобождается. release вызывается один раз - по окончании
+    выдачи или при закрытии - с исключением, прервавшим выдачу, или None.
+    """
+
+    def __init__(self, chunks, cancel: datasample.CancelHandle, release=None):
+        self.chunks = chunks
+        self.cancel = cancel
+        self.release = release
+        self.error = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self._release()
+            raise
+        except Exception as e:
+            self.error = e
+            raise
+
+    def _release(self):
+        release, self.release = self.release, None
+        if release is not None:
+            release(self.error)
+
+    def close(self):
+        try:
+            self.cancel.cancel()
+            self.chunks.close()
+        finally:
+            self._release()
+
+
+def load_body(request) -> dict:
+    """ Тело запроса API - JSON-объект. TypeError, если это не объект """
+    body = json.loads(request.body or b'{}')
+    if not isinstance(body, dict):
+        raise TypeError("Тело запроса должно быть JSON-объектом")
+    return body
+
+
+def overload_response(message: str) -> JsonResponse:
+    response = JsonResponse({'errors': {'overload': [message]}}, status=503)
+    response['Retry-After'] = '60'
+    return response
+
+
+@require_POST
+@permission_required('datasamples.view_sample', raise_exception=True)
+def api_execute(request, name, version):
+    """
+        Выполнить активную СВД и вернуть строки в формате NDJSON или Arrow IPC stream
+
+    Тело запроса - JSON {"params": {...}, "options": {...}}.
+    Формат ответа задаётся параметром строки запроса format: ndjson (по-умолчанию) или arrow.
+    Ошибки валидации возвращаются до начала выдачи строк: статус 400 и {"errors": {...}}.
+    Ответ NDJSON сжимается gzip, если клиент передал Accept-Encoding: gzip.
+    Если клиент отключился, не дочитав ответ, выполняющийся запрос отменяется.
+    Запрос предварительно оценивается по бюджету СВД (см. Sample.check_cost): при превышении
+    запрос отклоняется (400), выполняется с ограничением количества строк или ставится в очередь
+    фоновых заданий (on_exceed='queue': 202 и состояние задания, как api_submit_job).
+    Выполнение запросов ограничивается планировщиком (см. datasamples.scheduler):
+    если запрос не дождался очереди - статус 503.
+    Запрос выполняется на реплике для чтения, а при ошибке соединения с ней - на основной БД
+    (см. datasamples.replicas); ошибка после начала выдачи строк прерывает ответ.
+    Выполнение записывается в журнал (см. datasamples.querylog) по окончании выдачи ответа.
+    """
+    instance = get_object_or_404(models.Sample, name=name, version=version, is_active=True, deleted=False)
+    result_format = request.GET.get('format', 'ndjson')
+    execute_options = {'timeout': get_statement_timeout(), 'cancel': datasample.CancelHandle()}
+    compress = result_format == 'ndjson' and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    try:
+        body = load_body(request)
+        params = body.get('params', {})
+        options = body['options']
+        decision = run_routed(instance, lambda db_settings: instance.check_cost(params, options, db_settings))
+        options = decision.options
+        if result_format not in ('arrow', 'ndjson'):
+            raise ValueError(f"Неизвестный формат ответа {repr(result_format)}")
+        if decision.action == 'queue':
+            # Запрос сверх бюджета выполняет обработчик фоновых заданий (см. datasamples.jobs)
+            job = models.SampleJob.objects.create(sample=instance, user=request.user, params=params,
+                                                  options=options, format=result_format)
+            return JsonResponse(job_status(job), status=202)
+        record = start_execution(instance, instance.sample_meta, params, options, request.user.pk)
+        try:
+            # Метки замеров запоминаются при создании генераторов, поэтому этапы выдачи попадут в запись журнала.
+            # Если соединение с репликой не удалось до выдачи первых строк, выполнение повторяется на основной БД
+            with datasample.labels(execution=record):
+                if result_format == 'arrow':
+                    chunks = iter_routed(instance, lambda db_settings: instance.iter_arrow_stream(
+                        params, options, db_settings, **execute_options))
+                    content_type = 'application/vnd.apache.arrow.stream'
+                else:
+                    batches = iter_routed(instance, lambda db_settings: instance.execute_iter(
+                        params, options, db_settings, batches=True, **execute_options))
+                    chunks = ndjson_chunks(batches, [field_name for field_name, *_ in options['fields']], compress,
+                                           {**instance.metric_labels, 'execution': record})
+                    content_type = 'application/x-ndjson'
+            # Выгрузки уступают очередь интерактивным запросам
+            priority = 'export' if result_format == 'arrow' else 'interactive'
+            scheduler = get_scheduler()
+            ticket = scheduler.acquire(sample=instance.name, user=request.user.pk, priority=priority)
+        except Exception as e:
+            if record is not None:
+                record.finish(e)
+            raise
+    except datasample.SampleElementError as e:
+        return JsonResponse({'errors': e.errors}, status=400)
+    except datasample.SampleBudgetError as e:
+        return JsonResponse({'errors': {'budget': [str(e)]}}, status=400)
+    except datasample.SampleOverloadError as e:
+        return overload_response(str(e))
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'errors': {'request': [str(e)]}}, status=400)
+
+    def release(error=None):
+        scheduler.release(ticket)
+        if record is not None:
+            record.finish(error)
+
+    response = StreamingHttpResponse(
+        CancellingStream(chunks, execute_options['cancel'], release=release),
+        content_type=content_type,
+    )
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    if result_format == 'ndjson':
+        # Сжатие ответа зависит от Accept-Encoding запроса
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@permission_required('datasamples.view_sample', raise_exception=True)
+def api_scheduler_stats(request):
+    """ Метрики планировщика выполнения запросов процесса (см. datasample.ExecutionScheduler.stats) """
+    return JsonResponse(get_scheduler().stats)
+
+
+@require_GET
+def metrics(request):
+    """
+        Замеры этапов выполнения СВД и метрики планировщика процесса в формате Prometheus
+
+    Доступно без авторизации (как принято для Prometheus), закрывается на уровне веб-сервера.
+    При settings.DATASAMPLE_METRICS['ENABLED'] = False - 404.
+    """
+    sink = get_metrics_sink()
+    if sink is None:
+        raise Http404("Metrics are disabled")
+    text = sink.render() + render_gauges('datasample_scheduler', get_scheduler().stats)
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def job_status(job: models.SampleJob) -> dict:
+    return {
+        'id': job.pk,
+        'sample': job.sample.name,
+        'version': job.sample.version,
+        'format': job.format,
+        'status': job.status,
+        'rows_fetched': job.rows_fetched,
+        'error': job.error,
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+        'status_url': reverse('datasamples:api-job-status', kwargs={'pk': job.pk}),
+        'download_url': reverse('datasamples:api-job-download', kwargs={'pk': job.pk})
+        if job.status == models.SampleJob.DONE else None,
+    }
+
+
+def get_user_job(request, pk) -> models.SampleJob:
+    """ Задание текущего пользователя (суперпользователю доступны все задания) """
+    job = get_object_or_404(models.SampleJob.objects.select_related('sample'), pk=pk)
+    if job.user_id != request.user.pk and not request.user.is_superuser:
+        raise Http404
+    return job
+
+
+@require_POST
+@permission_required('datasamples.view_sample', raise_exception=True)
+def api_submit_job(request, name, version):
+    """
+        Поставить выполнение активной СВД в очередь фоновых заданий
+
+    Тело запроса - JSON {"params": {...}, "options": {...}, "format": "csv"|"ndjson"|"arrow"}.
+    Запрос проверяется сразу (400 и {"errors": {...}}), выполняется обработчиком run_sample_jobs.
+    Ответ - 202 и состояние задания со ссылкой status_url.
+    """
+    instance = get_object_or_404(models.Sample, name=name, version=version, is_active=True, deleted=False)
+    try:
+        body = load_body(request)
+        params = body.get('params', {})
+        options = body['options']
+        result_format = body.get('format', 'csv')
+        if result_format not in EXTENSIONS:
+            raise ValueError(f"'format' must be in {tuple(EXTENSIONS)}")
+        # Только проверка и компоновка запроса, без обращения к БД
+        datasample.compose(pickle.loads(instance.obj), params, options)
+    except datasample.SampleElementError as e:
+        return JsonResponse({'errors': e.errors}, status=400)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'errors': {'request': [str(e)]}}, status=400)
+    job = models.SampleJob.objects.create(sample=instance, user=request.user, params=params, options=options,
+                                          format=result_format)
+    return JsonResponse(job_status(job), status=202)
+
+
+@require_GET
+@permission_required('datasamples.view_sample', raise_exception=True)
+def api_job_status(request, pk):
+    """ Состояние фонового задания, в том числе количество уже полученных строк """
+    return JsonResponse(job_status(get_user_job(request, pk)))
+
+
+@require_GET
+@permission_required('datasamples.view_sample', raise_exception=True)
+def api_job_download(request, pk):
+    """ Файл результата выполненного задания. Пока задание не выполнено - 409 """
+    job = get_user_job(request, pk)
+    if job.status != models.SampleJob.DONE:
+        return JsonResponse(job_status(job), status=409)
+    try:
+        fileobj = open(result_path(job), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(fileobj, as_attachment=True, content_type=CONTENT_TYPES[job.format],
+                        filename=f"{job.sample.name}_{job.pk}.{EXTENSIONS[job.format]}")
@@ -0,0 +1,159 @@
+"""
+    Нагрузочное тестирование выполнения СВД
+
+Смесь запросов (mix) - список JSON-объектов:
+    name, version - СВД из datasamples.Sample (активная версия) или
+    sample        - описатель схемы доступа к данным (для СВД, не сохранённой в БД);
+    params        - значения параметров (по-умолчанию {});
+    options       - настройки выборки;
+    weight        - относительная частота запроса в смеси (по-умолчанию 1);
+    label         - имя запроса в отчёте (по-умолчанию <name>/<version> или номер в смеси).
+
+Запросы выполняются параллельно в concurrency потоках, каждый поток выбирает запрос
+из смеси случайно с учётом weight. Отчёт - количество запросов и ошибок, пропускная способность
+и перцентили длительности в целом и по каждому запросу смеси.
+"""
+import pickle
+import random
+from itertools import count
+from threading import Lock
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+import datasample
+
+__all__ = (
+    'PERCENTILES',
+    'load_mix',
+    'percentile',
+    'run_load',
+    'format_report',
+)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_mix(entries: list, use_cache: bool = False) -> list:
+    """
+        Подготовить смесь запросов: [(label, weight, функция выполнения с аргументом db_settings)]
+
+    :param use_cache: выполнять СВД из БД через Sample.execute (кэш результатов и журнал выполнений),
+                      иначе - напрямую через datasample.execute
+    """
+    from datasamples.models import Sample
+    mix = []
+    for number, entry in enumerate(entries):
+        params, options = entry.get('params', {}), entry['options']
+        if 'sample' in entry:
+            label = entry.get('label', str(number))
+            sample_meta = datasample.Sample(entry['sample'])
+        else:
+            label = entry.get('label', f"{entry['name']}/{entry['version']}")
+            instance = Sample.objects.get(name=entry['name'], version=entry['version'], is_active=True,
+                                          deleted=False)
+            if use_cache:
+                mix.append((label, entry.get('weight', 1),
+                            lambda db_settings, i=instance, p=params, o=options: i.execute(p, o, db_settings)))
+                continue
+            sample_meta = pickle.loads(instance.obj)
+        mix.append((label, entry.get('weight', 1),
+                    lambda db_settings, s=sample_meta, p=params, o=options: datasample.execute(s, p, o, db_settings)))
+    return mix
+
+
+def percentile(values: list, p: float) -> float:
+    """ Перцентиль p (0..100) отсортированного списка с линейной интерполяцией """
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _summary(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        **{f'p{p}': percentile(latencies, p) for p in PERCENTILES},
+        'max': latencies[-1] if latencies else None,
+    }
+
+
+def run_load(mix: list, db_settings: dict, concurrency: int = 4, duration: float = None, requests: int = None,
+             seed: int = 0) -> dict:
+    """
+        Выполнять запросы смеси в concurrency потоках в течение duration секунд или до requests запросов
+
+    Пропускная способность (rps) считается по успешным запросам.
+    :return: {'concurrency': ..., 'elapsed': ..., 'total': {...}, 'queries': {<label>: {...}}, 'errors': [...]}
+    """
+    if duration is None and requests is None:
+        raise ValueError("duration or requests must be specified")
+    labels = [label for label, _, _ in mix]
+    weights = [weight for _, weight, _ in mix]
+    results = {label: [] for label in labels}
+    errors = {label: 0 for label in labels}
+    messages = dict()
+    lock = Lock()
+    counter = count()
+
+    def worker(number: int):
+        rng = random.Random(f'{seed}:{number}')
+        while True:
+            if requests is not None and next(counter) >= requests:
+                break
+            if duration is not None and perf_counter() - started >= duration:
+                break
+            label, _, func = rng.choices(mix, weights)[0]
+            start = perf_counter()
+            try:
+                func(db_settings)
+            except Exception as e:
+                with lock:
+                    errors[label] += 1
+                    messages.setdefault(f"{type(e).__name__}: {e}", label)
+                continue
+            latency = perf_counter() - start
+            with lock:
+                results[label].append(latency)
+
+    started = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker, number) for number in range(concurrency)]:
+            future.result()
+    elapsed = perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'total': _summary(sum(results.values(), []), sum(errors.values()), elapsed),
+        'queries': {label: _summary(results[label], errors[label], elapsed) for label in labels},
+        'errors': [f"{label}: {message}" for message, label in messages.items()],
+    }
+
+
+def format_report(report: dict) -> str:
+    """ Отчёт run_load в виде текстовой таблицы (длительность в миллисекундах) """
+    columns = ('requests', 'errors', 'rps', *(f'p{p}' for p in PERCENTILES), 'max')
+    width = max(len('total'), *map(len, report['queries']))
+    lines = [
+        f"concurrency: {report['concurrency']}, elapsed: {report['elapsed']:.1f} s",
+        f"{'query':<{width}} " + ' '.join(f'{column:>10}' for column in columns),
+    ]
+    for label, summary in (*report['queries'].items(), ('total', report['total'])):
+        values = []
+        for column in columns:
+            value = summary[column]
+            if value is None:
+                values.append(f"{'-':>10}")
+            elif column in ('requests', 'errors'):
+                values.append(f'{value:>10}')
+            elif column == 'rps':
+                values.append(f'{value:>10.1f}')
+            else:
+                values.append(f'{value * 1000:>10.1f}')
+        lines.append(f"{label:<{width}} " + ' '.join(values))
+    lines.extend(report['errors'])
+    return '\n'.join(lines)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from example.synthetic import SCALE_ROWS, load_example_data
+
+
+class Command(BaseCommand):
+    help = ("Загрузить синтетические данные примера через PostgreSQL COPY. "
+            f"На единицу масштаба: {', '.join(f'{table} - {rows}' for table, rows in SCALE_ROWS.items())}")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help="Масштаб (0.01 - около 12 тыс. строк)")
+        parser.add_argument('--seed', type=int, default=0, help="Начальное значение генератора случайных чисел")
+        parser.add_argument('--truncate', action='store_true',
+                            help="Предварительно удалить данные примера и синтетических пользователей")
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0:
+            raise CommandError("scale must be positive")
+        load_example_data(options['scale'], options['seed'], options['truncate'],
+                          progress=lambda table, rows: self.stdout.write(f"{table}: {rows} rows"))
+        self.stdout.write(self.style.SUCCESS("Example data loaded"))
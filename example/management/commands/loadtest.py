@@ -0,0 +1,51 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+import datasample
+from datasamples.models import Sample
+from datasamples.utils import get_db_settings
+from example.loadtest import load_mix, run_load, format_report
+
+
+class Command(BaseCommand):
+    help = "Нагрузочное тестирование: параллельное выполнение смеси запросов СВД (см. example.loadtest)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('mix', help="Смесь запросов в JSON или @<путь к JSON-файлу>")
+        parser.add_argument('--concurrency', '-c', type=int, default=4, help="Количество параллельных потоков")
+        parser.add_argument('--duration', '-d', type=float, help="Длительность теста в секундах")
+        parser.add_argument('--requests', '-n', type=int, help="Количество запросов (если не задана длительность)")
+        parser.add_argument('--cache', action='store_true',
+                            help="Выполнять СВД из БД через кэш результатов и журнал выполнений")
+        parser.add_argument('--seed', type=int, default=0, help="Начальное значение выбора запросов из смеси")
+        parser.add_argument('--output', '-o', help="Файл JSON для отчёта")
+
+    @staticmethod
+    def load_json(value: str):
+        if value.startswith('@'):
+            with open(value[1:], encoding='utf-8') as f:
+                return json.load(f)
+        return json.loads(value)
+
+    def handle(self, *args, **options):
+        if options['duration'] is None and options['requests'] is None:
+            options['duration'] = 10
+        try:
+            mix = load_mix(self.load_json(options['mix']), use_cache=options['cache'])
+        except (OSError, ValueError, KeyError, Sample.DoesNotExist, datasample.SampleElementError) as e:
+            raise CommandError(str(e))
+        if not mix:
+            raise CommandError("Empty mix")
+        db_settings = get_db_settings()
+        # Пул соединений datasample должен вмещать все потоки теста
+        db_settings = {**db_settings, 'POOL': {**db_settings.get('POOL', {}),
+                                                'pool_size': options['concurrency'], 'max_overflow': 0}}
+        try:
+            report = run_load(mix, db_settings, options['concurrency'], options['duration'], options['requests'],
+                              options['seed'])
+        finally:
+            datasample.close_all()
+        self.stdout.write(format_report(report))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,169 @@
+"""
+    Генератор синтетических данных примера для нагрузочного тестирования
+
+Данные детерминированы: при одинаковых scale и seed в пустую БД загружаются одинаковые строки.
+Строки загружаются через PostgreSQL COPY FROM STDIN, минуя ORM.
+
+Количество строк на единицу масштаба (scale) - SCALE_ROWS, при scale=1 загружается около 1,2 млн строк.
+Менеджеры и продавцы создаются как пользователи synthetic_<N> без пароля (вход невозможен).
+"""
+import io
+import random
+from itertools import islice
+from decimal import Decimal
+from django.db import connection, transaction
+
+__all__ = (
+    'SCALE_ROWS',
+    'SYNTHETIC_USER_PREFIX',
+    'CopyReader',
+    'load_example_data',
+)
+
+SCALE_ROWS = {
+    'auth_user': 100,
+    'example_catalog': 1000,
+    'example_catalog_sellers': 5000,
+    'example_product': 100000,
+    'example_service': 1000,
+    'example_tarif': 1000000,
+}
+SYNTHETIC_USER_PREFIX = 'synthetic_'
+WORDS = ('альфа', 'бета', 'гамма', 'дельта', 'эпсилон', 'дзета', 'эта', 'тета', 'йота', 'каппа',
+         'лямбда', 'мю', 'ню', 'кси', 'омикрон', 'пи', 'ро', 'сигма', 'тау', 'ипсилон')
+FIRST_NAMES = ('Иван', 'Пётр', 'Анна', 'Мария', 'Олег', 'Ольга', 'Сергей', 'Елена', 'Павел', 'Ирина')
+LAST_NAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев')
+
+
+class CopyReader(io.RawIOBase):
+    """ Файлоподобный объект для COPY FROM STDIN, читающий строки из итератора по мере загрузки """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target) -> int:
+        while len(self.buffer) < len(target):
+            chunk = ''.join(islice(self.lines, 1000))
+            if not chunk:
+                break
+            self.buffer += chunk.encode()
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def _copy_line(*values) -> str:
+    """ Строка текстового формата COPY (значения не содержат табуляций, переводов строк и обратной косой черты) """
+    return '\t'.join(r'\N' if value is None else str(value) for value in values) + '\n'
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def _users(rng, first_id: int, count: int, context: dict):
+    for i in range(first_id, first_id + count):
+        yield _copy_line('!', None, 'f', f'{SYNTHETIC_USER_PREFIX}{i}', rng.choice(FIRST_NAMES),
+                         rng.choice(LAST_NAMES), f'{SYNTHETIC_USER_PREFIX}{i}@example.com', 'f', 't',
+                         '2020-01-01 00:00:00+00')
+
+
+def _catalogs(rng, first_id: int, count: int, context: dict):
+    users = context['auth_user']
+    for i in range(first_id, first_id + count):
+        yield _copy_line(i, f'Раздел {i} {_words(rng, 2)}', rng.randint(*users))
+
+
+def _catalog_sellers(rng, first_id: int, count: int, context: dict):
+    catalogs, users = context['example_catalog'], context['auth_user']
+    catalogs_count = catalogs[1] - catalogs[0] + 1
+    # Разные продавцы одного раздела: у раздела не больше одной связи с одним продавцом
+    for n, i in enumerate(range(first_id, first_id + count)):
+        catalog_id = catalogs[0] + n % catalogs_count
+        user_id = users[0] + (n // catalogs_count + catalog_id) % (users[1] - users[0] + 1)
+        yield _copy_line(i, catalog_id, user_id)
+
+
+def _products(rng, first_id: int, count: int, context: dict):
+    catalogs = context['example_catalog']
+    for i in range(first_id, first_id + count):
+        yield _copy_line(i, f'Товар {i}', f'p-{i}', _words(rng, 8), rng.randint(*catalogs),
+                         Decimal(rng.randint(100, 10000000)) / 100, rng.randint(0, 1000))
+
+
+def _services(rng, first_id: int, count: int, context: dict):
+    users = context['auth_user']
+    for i in range(first_id, first_id + count):
+        yield _copy_line(i, f'Услуга {i}', f's-{i}', _words(rng, 8), rng.randint(*users))
+
+
+def _tarifs(rng, first_id: int, count: int, context: dict):
+    products, services = context['example_product'], context['example_service']
+    for i in range(first_id, first_id + count):
+        # Часть тарифов - на услугу без привязки к товару
+        product_id = rng.randint(*products) if rng.random() < 0.9 else None
+        yield _copy_line(i, product_id, rng.randint(*services), Decimal(rng.randint(100, 10000000)) / 10000,
+                         't' if rng.random() < 0.7 else 'f', 't' if rng.random() < 0.1 else 'f')
+
+
+# Таблица: (колонки, генератор строк) в порядке загрузки
+TABLES = (
+    ('auth_user', ('password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name',
+                   'email', 'is_staff', 'is_active', 'date_joined'), _users),
+    ('example_catalog', ('id', 'name', 'manager_id'), _catalogs),
+    ('example_catalog_sellers', ('id', 'catalog_id', 'user_id'), _catalog_sellers),
+    ('example_product', ('id', 'name', 'label', 'description', 'catalog_id', 'price', 'counts'), _products),
+    ('example_service', ('id', 'name', 'label', 'description', 'manager_id'), _services),
+    ('example_tarif', ('id', 'product_id', 'service_id', 'price', 'is_active', 'archived'), _tarifs),
+)
+
+
+def _max_id(cursor, table: str) -> int:
+    cursor.execute(f"select coalesce(max(id), 0) from {table}")
+    return cursor.fetchone()[0]
+
+
+def load_example_data(scale: float = 1, seed: int = 0, truncate: bool = False, progress=None) -> dict:
+    """
+        Загрузить синтетические данные примера через COPY
+
+    :param scale: масштаб: количество строк таблицы - SCALE_ROWS[<таблица>] * scale
+    :param seed: начальное значение генератора случайных чисел
+    :param truncate: предварительно удалить данные примера и синтетических пользователей
+    :param progress: функция, вызываемая с именем таблицы и количеством строк после загрузки таблицы
+    :return: словарь <таблица>: количество загруженных строк
+    """
+    counts = {table: max(1, int(rows * scale)) for table, rows in SCALE_ROWS.items()}
+    # Продавец связывается с разделом не более одного раза
+    counts['example_catalog_sellers'] = min(counts['example_catalog_sellers'],
+                                            counts['example_catalog'] * counts['auth_user'])
+    loaded = dict()
+    context = dict()  # таблица: (первый id, последний id) загруженных строк
+    with transaction.atomic(), connection.cursor() as cursor:
+        if truncate:
+            cursor.execute("truncate example_tarif, example_service, example_product, "
+                           "example_catalog_sellers, example_catalog restart identity")
+            cursor.execute("delete from auth_user where username like %s", [f'{SYNTHETIC_USER_PREFIX}%'])
+        for table, columns, generate in TABLES:
+            first_id = _max_id(cursor, table) + 1
+            if table == 'auth_user':
+                # id пользователей выдаёт последовательность, поэтому номер берётся из неё заранее
+                cursor.execute("select setval(pg_get_serial_sequence('auth_user', 'id'), %s, false)", [first_id])
+            rng = random.Random(f'{seed}:{table}')
+            cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+                CopyReader(generate(rng, first_id, counts[table], context)),
+            )
+            context[table] = (first_id, first_id + counts[table] - 1)
+            loaded[table] = counts[table]
+            cursor.execute(f"select setval(pg_get_serial_sequence('{table}', 'id'), %s)", [context[table][1]])
+            if progress is not None:
+                progress(table, counts[table])
+        for table in loaded:
+            cursor.execute(f"analyze {table}")
+    return loaded
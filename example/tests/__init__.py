@@ -1,3 +1,6 @@
+from .test_loadtest import *
+from .test_synthetic import *
+
 fixtures = (
     'example_data.json'
 )
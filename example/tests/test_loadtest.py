@@ -0,0 +1,67 @@
+from django.test import SimpleTestCase
+
+import datasample
+from example.loadtest import load_mix, percentile, run_load, format_report
+
+__all__ = (
+    'PercentileTestCase',
+    'RunLoadTestCase',
+)
+
+DB_SETTINGS = {
+    'NAME': 'postgres',
+    'USER': 'postgres',
+    'HOST': '127.0.0.1',
+}
+MIX = [
+    {
+        'label': 'numbers',
+        'sample': {
+            'tables': {'main': 'select i as num from generate_series(1, 10) as i'},
+            'fields': {'num': {'ctype': 'Integer', 'ordered': True}},
+            'params': {},
+        },
+        'options': {'fields': [['num', None]], 'order': [['num', 'asc']]},
+        'weight': 3,
+    },
+    {
+        'label': 'broken',
+        'sample': {
+            'tables': {'main': 'select 1 / 0 as num'},
+            'fields': {'num': {'ctype': 'Integer'}},
+            'params': {},
+        },
+        'options': {'fields': [['num', None]]},
+    },
+]
+
+
+class PercentileTestCase(SimpleTestCase):
+    def test_percentile(self):
+        values = [1.0, 2.0, 3.0, 4.0]
+        self.assertEqual(percentile(values, 0), 1.0)
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 100), 4.0)
+        self.assertAlmostEqual(percentile(values, 90), 3.7)
+        self.assertEqual(percentile([5.0], 99), 5.0)
+        self.assertIsNone(percentile([], 50))
+
+
+class RunLoadTestCase(SimpleTestCase):
+    def tearDown(self):
+        datasample.close_all()
+
+    def test_requests(self):
+        report = run_load(load_mix(MIX), DB_SETTINGS, concurrency=3, requests=20)
+        self.assertEqual(report['total']['requests'], 20)
+        self.assertSetEqual(set(report['queries']), {'numbers', 'broken'})
+        self.assertEqual(sum(summary['requests'] for summary in report['queries'].values()), 20)
+        self.assertEqual(report['total']['errors'], report['queries']['broken']['errors'])
+        self.assertEqual(report['queries']['numbers']['errors'], 0)
+        if report['total']['errors']:
+            self.assertIn('division by zero', report['errors'][0])
+        self.assertIn('numbers', format_report(report))
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            run_load(load_mix(MIX), DB_SETTINGS)
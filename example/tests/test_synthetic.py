@@ -0,0 +1,40 @@
+import random
+from django.test import SimpleTestCase, TestCase
+
+from example.models import Catalog, Product, Tarif
+from example.synthetic import SCALE_ROWS, CopyReader, load_example_data, _products
+
+__all__ = (
+    'CopyReaderTestCase',
+    'LoadExampleDataTestCase',
+)
+
+
+class CopyReaderTestCase(SimpleTestCase):
+    def read_lines(self, count: int, seed: int = 0) -> list:
+        rng = random.Random(seed)
+        reader = CopyReader(_products(rng, 1, count, {'example_catalog': (1, 10)}))
+        # Чтение маленькими порциями: строки генератора разрезаются между порциями
+        data = b''.join(iter(lambda: reader.read(100), b''))
+        return data.decode().splitlines()
+
+    def test_line_count(self):
+        for count in (1, 999, 2500):
+            with self.subTest(count=count):
+                lines = self.read_lines(count)
+                self.assertEqual(len(lines), count)
+                self.assertTrue(all(len(line.split('\t')) == 7 for line in lines))
+        self.assertListEqual(self.read_lines(0), [])
+
+    def test_deterministic(self):
+        self.assertListEqual(self.read_lines(100, seed=1), self.read_lines(100, seed=1))
+        self.assertNotEqual(self.read_lines(100, seed=1), self.read_lines(100, seed=2))
+
+
+class LoadExampleDataTestCase(TestCase):
+    def test_load(self):
+        loaded = load_example_data(scale=0.001)
+        self.assertEqual(loaded['example_product'], int(SCALE_ROWS['example_product'] * 0.001))
+        self.assertEqual(Catalog.objects.count(), loaded['example_catalog'])
+        self.assertEqual(Product.objects.count(), loaded['example_product'])
+        self.assertEqual(Tarif.objects.count(), loaded['example_tarif'])
@@ -205,3 +205,132 @@ except ImportError:
     pass
 
 LOGIN_REDIRECT_URL = '/'
+
+# Алиас БД из DATABASES, в которой выполняются СВД через API
+DATASAMPLE_DATABASE = 'default'
+try:
+    from .local_settings import DATASAMPLE_DATABASE
+except ImportError:
+    pass
+
+# Реплики для чтения, на которых выполняются СВД (см. datasamples.replicas)
+DATASAMPLE_REPLICAS = {
+    'DATABASES': [],  # алиасы реплик из DATABASES
+    'MAX_LAG': 30,
+    'ALPHA': 0.3,
+    'CHECK_INTERVAL': 10,
+    'CHECK_TIMEOUT': 2,
+    'FAILURE_BACKOFF': 30,
+}
+try:
+    from .local_settings import DATASAMPLE_REPLICAS
+except ImportError:
+    pass
+
+# Ограничение времени выполнения одного запроса СВД в секундах (None - без ограничения)
+DATASAMPLE_STATEMENT_TIMEOUT = 60
+try:
+    from .local_settings import DATASAMPLE_STATEMENT_TIMEOUT
+except ImportError:
+    pass
+
+# Общий бюджет стоимости запросов СВД (см. datasample.guard, бюджет СВД - Sample.execution['budget'])
+DATASAMPLE_COST_GUARD = {
+    'MAX_COST': None,
+    'MAX_ROWS': None,
+    'ON_EXCEED': 'reject',
+    'CAP_ROWS': 10000,
+    'MAX_PLANS': 1024,
+}
+try:
+    from .local_settings import DATASAMPLE_COST_GUARD
+except ImportError:
+    pass
+
+# Ограничения одновременного выполнения запросов СВД в каждом процессе веб-сервера (см. datasample.scheduler)
+DATASAMPLE_SCHEDULER = {
+    'MAX_CONCURRENT': 8,
+    'PER_SAMPLE': 4,
+    'PER_USER': 2,
+    'MAX_QUEUE': 100,
+    'QUEUE_TIMEOUT': 30,
+}
+try:
+    from .local_settings import DATASAMPLE_SCHEDULER
+except ImportError:
+    pass
+
+# Фоновые выполнения СВД (см. datasamples.jobs, обработчики - python manage.py run_sample_jobs)
+DATASAMPLE_JOBS = {
+    'RESULT_DIR': os.path.join(BASE_DIR, 'jobs'),
+    'WORKERS': 2,
+    'POLL_INTERVAL': 1,
+    'PROGRESS_INTERVAL': 1,
+    'TIMEOUT': None,
+    'STALE_AFTER': 300,
+    'RETENTION': 7 * 24 * 3600,
+    'CLEANUP_INTERVAL': 60,
+}
+try:
+    from .local_settings import DATASAMPLE_JOBS
+except ImportError:
+    pass
+
+# Кэш результатов выполнения СВД (см. datasamples.cache).
+# Для общего кэша нескольких процессов: 'BACKEND': 'django' и общий для процессов кэш в CACHES (например, Redis)
+DATASAMPLE_RESULT_CACHE = {
+    'BACKEND': 'local',
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'TTL': 300,
+    'SAMPLE_TTL': {},
+}
+try:
+    from .local_settings import DATASAMPLE_RESULT_CACHE
+except ImportError:
+    pass
+
+# Замеры этапов выполнения СВД, выдаются в формате Prometheus по адресу /metrics (см. datasamples.metrics)
+DATASAMPLE_METRICS = {
+    'ENABLED': True,
+    'BUCKETS': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+}
+try:
+    from .local_settings import DATASAMPLE_METRICS
+except ImportError:
+    pass
+
+# Журнал выполнений СВД и медленных запросов (см. datasamples.querylog)
+DATASAMPLE_QUERY_LOG = {
+    'ENABLED': True,
+    'SLOW_SECONDS': 1.0,
+    'ASYNC': True,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 2,
+    'MAX_PENDING': 10000,
+}
+try:
+    from .local_settings import DATASAMPLE_QUERY_LOG
+except ImportError:
+    pass
+
+# Материализованные представления подзапросов таблиц СВД (см. datasamples.materialize).
+# Представления создаёт python manage.py refresh_sample_views (ON_SAVE - сразу после сохранения СВД, в запросе)
+DATASAMPLE_MATERIALIZE = {
+    'PREFIX': 'dsmv',
+    'ON_SAVE': False,
+}
+try:
+    from .local_settings import DATASAMPLE_MATERIALIZE
+except ImportError:
+    pass
+
+# Предагрегаты СВД (см. datasamples.rollups).
+# Предагрегаты строит python manage.py refresh_sample_rollups (ON_SAVE - сразу после сохранения СВД, в запросе)
+DATASAMPLE_ROLLUPS = {
+    'PREFIX': 'dsru',
+    'ON_SAVE': False,
+}
+try:
+    from .local_settings import DATASAMPLE_ROLLUPS
+except ImportError:
+    pass
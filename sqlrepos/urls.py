@@ -16,7 +16,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from datasamples.views import metrics
+
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('', include('datasamples.urls', namespace='datasamples')),
     path('accounts/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),